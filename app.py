@@ -1,29 +1,49 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, Response
+from flask import Flask, render_template, request, redirect, url_for, jsonify, Response, stream_with_context, abort, make_response
 from markupsafe import escape
 from flask_sqlalchemy import SQLAlchemy
 import csv
 import json
-import pandas as pd
 import io
 import logging
 import re
 import os
 import time
 from werkzeug.utils import secure_filename
-from sqlalchemy import text, distinct
+from sqlalchemy import text, distinct, select
 import threading
 import uuid
+from datetime import timezone
 
 # Configure Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('app')
 
 # Import own modules
-from models import db, SMDPart, HardwareDevice, BOMEntry
+from models import db, SMDPart, HardwareDevice, BOMEntry, SubAssembly, FlatBOMEntry, init_storage, use_read_engine, read_only
 from digikey_api import get_digikey_access_token, fetch_digikey_product_info, fetch_digikey_description, search_digikey_keyword, is_digikey_part_number, extract_product_data
 from helpers import get_required_quantity, get_part_status_class, get_buildable_count, get_total_required_quantity, get_part_devices
 from helpers import get_buildable_percentage, has_bom_entries, get_devices_with_bom
 from helpers import get_unassigned_parts, count_unassigned_parts, has_unassigned_parts, is_part_unassigned
+from helpers import get_part_status_map, get_device_build_summary, get_part_devices_map, get_inventory_delta
+from stock import parse_stock_deltas, apply_stock_deltas, record_stock_movements, take_stock_snapshot
+from stock import get_consumption, get_part_history, start_snapshot_scheduler, build_device
+from bom import parse_usage_items, apply_usage_batch, MAX_USAGE_BATCH
+from bom import mark_bom_changed, set_sub_assembly, replace_sub_assemblies, refresh_missing_flat_boms, get_ancestor_ids
+from reservations import reserve_device, release_reservations, get_reservations, join_device_reservations, device_available_quantity
+from bulk import parse_id_list, delete_parts, delete_devices, reassign_usages
+from fragments import fragment_key, render_cached, render_cached_fragment
+from versions import get_versions, device_scope, GLOBAL_SCOPE, PARTS_SCOPE
+from planner import parse_plan_targets, plan_production, PLAN_STRATEGIES
+from shopping import shopping_list_query, build_shopping_list
+from scan import parse_scans, ingest_scans, init_scan
+from query_budget import init_query_budget
+from assets import init_assets, build_assets
+from compression import init_compression
+from changefeed import init_change_feed
+from profiling import init_profiling
+from tracing import init_tracing, propagate, traced
+from metrics import init_metrics, IMPORT_ROWS, IMPORT_DURATION, IMPORT_THROUGHPUT, IMPORT_JOBS
+from export import EXPORT_FORMATS, inventory_query, bom_query, missing_parts_query, stream_export, export_filename
 
 app = Flask(__name__)
 # Use environment variable for database path or default
@@ -36,11 +56,86 @@ app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10 MB
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5 MB
 
 # Initialize database with the app
-db.init_app(app)
+init_storage(app)
+
+# Opt-in request tracing (first, so the root span covers the other request hooks)
+init_tracing(app)
+
+# Opt-in per-request profiles (before the remaining hooks, so they are covered)
+init_profiling(app)
+
+# Request, database and API metrics, exposed on /metrics
+init_metrics(app)
+
+# Background threads of the barcode scan ingest
+init_scan(app)
+
+# Per-request SQL statement counts, N+1 detection and query budgets
+init_query_budget(app)
+
+# Fingerprinted static assets (built with "flask build-assets"), pages
+# linking other bundles must not be reused, so their version is part of the ETag
+ASSETS_VERSION = init_assets(app)
+
+# Brotli/gzip compression of HTML, JSON, CSV and static files
+init_compression(app)
+
+# Live inventory deltas for open pages (Server-Sent Events on /api/changes)
+init_change_feed(app)
 
 # Global upload progress tracker
 upload_progress = {}
 
+# Read-only requests use the separate read engine
+@app.before_request
+def route_read_only_requests():
+    if request.method in ('GET', 'HEAD'):
+        use_read_engine()
+
+# Periodic stock ledger snapshots (started with the first request, not on import)
+@app.before_request
+def ensure_snapshot_scheduler():
+    start_snapshot_scheduler(app)
+
+# CLI command for taking a ledger snapshot, e.g. from cron
+@app.cli.command('snapshot-stock')
+def snapshot_stock_command():
+    """Writes stock snapshots for all parts with new ledger entries"""
+    written = take_stock_snapshot()
+    print(f"Snapshot written for {written} parts")
+
+# CLI command for building the minified, fingerprinted static assets at deploy time
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Writes the static asset bundles and their manifest into static/dist"""
+    manifest = build_assets(app.static_folder)
+    for source, target in sorted(manifest.items()):
+        print(f"{source} -> {target}")
+
+def init_database():
+    """Creates missing tables and flattened BOMs
+
+    Not run on import: worker processes must start without touching the
+    database. Run it once before starting the workers (flask init-db).
+    """
+    db.create_all()
+    db.session.commit()
+    refresh_missing_flat_boms()
+
+# CLI command for creating the database, e.g. before the workers start
+@app.cli.command('init-db')
+def init_db_command():
+    """Creates the database tables and builds missing flattened BOMs"""
+    init_database()
+    print("Database initialized")
+
+# CLI command for building missing flattened BOMs, e.g. after an upgrade
+@app.cli.command('refresh-boms')
+def refresh_boms_command():
+    """Builds the flattened BOMs of all devices that have none yet"""
+    refreshed = refresh_missing_flat_boms()
+    print(f"Flattened BOMs refreshed for {refreshed} devices")
+
 # Template context processor for global functions
 @app.context_processor
 def utility_processor():
@@ -75,6 +170,52 @@ def validate_input(input_str, max_length=100, pattern=r'^[a-zA-Z0-9\-_.]+$'):
         
     return True, input_str
 
+def data_validators(scopes):
+    """ETag and Last-Modified of a response that only depends on the given data version scopes"""
+    versions = get_versions(scopes)
+    etag = 'v' + '-'.join(str(versions[scope][0]) for scope in scopes) + f".{ASSETS_VERSION}"
+    modified = [updated_at for _, updated_at in versions.values() if updated_at]
+    last_modified = max(modified).replace(tzinfo=timezone.utc) if modified else None
+    return etag, last_modified
+
+def not_modified_response(etag, last_modified):
+    """Returns a 304 response if the browser's copy is still current, otherwise None"""
+    if request.if_none_match:
+        # Weak comparison, compressed responses carry the ETag as weak validator
+        is_current = request.if_none_match.contains_weak(etag)
+    else:
+        is_current = bool(last_modified and request.if_modified_since and last_modified <= request.if_modified_since)
+    
+    if not is_current:
+        return None
+    
+    return with_validators(Response(status=304), etag, last_modified)
+
+def with_validators(response, etag, last_modified):
+    """Adds ETag/Last-Modified, browsers revalidate before reusing the response"""
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+def wants_delta():
+    """True if the client asked for a JSON delta (Accept: application/json) instead of a full page"""
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
+def conditional_response(scopes, build):
+    """Answers conditional requests with 304 without building the response if nothing changed"""
+    etag, last_modified = data_validators(scopes)
+    
+    not_modified = not_modified_response(etag, last_modified)
+    if not_modified:
+        return not_modified
+    
+    response = make_response(build())
+    if response.status_code != 200:
+        return response
+    return with_validators(response, etag, last_modified)
+
 # Enhanced route for searching part numbers
 @app.route('/search_digikey_by_mpn/<search_term>')
 def search_digikey_by_mpn(search_term):
@@ -85,6 +226,12 @@ def search_digikey_by_mpn(search_term):
         if not is_valid:
             return jsonify({"error": result}), 400
             
+        # Only local results carry an ETag, so a match means they are still current
+        etag, last_modified = data_validators([PARTS_SCOPE])
+        not_modified = not_modified_response(etag, last_modified)
+        if not_modified:
+            return not_modified
+        
         logger.info(f"Search request for: {search_term}")
         # Check if the search term could be a DigiKey number
         is_dk_number = is_digikey_part_number(search_term)
@@ -112,7 +259,7 @@ def search_digikey_by_mpn(search_term):
         # If results found, return them directly
         if local_results:
             logger.info(f"Local results found: {len(local_results)}")
-            return jsonify(local_results)
+            return with_validators(jsonify(local_results), etag, last_modified)
         
         # If no local results, query the DigiKey API
         api_products = search_digikey_keyword(search_term, 10)
@@ -276,14 +423,19 @@ def import_csv():
             upload_progress[tracking_id]["progress"] = 30
             upload_progress[tracking_id]["message"] = "Starting BOM import..."
             
+            # Pass only the ID and the already read content, the thread works with
+            # its own session and must not depend on the request's file object
+            device_id = hardware_device.id
+            file_buffer = io.BytesIO(file_content)
+            
             # Define the process-async function
             def process_async():
                 # Create an application context for this thread
                 with app.app_context():
                     try:
                         # BOM import
-                        file.seek(0)
-                        result, successful, failed = process_bom_csv(file, hardware_device, tracking_id)
+                        device = db.session.get(HardwareDevice, device_id)
+                        result, successful, failed = process_bom_csv(file_buffer, device, tracking_id)
                         
                         if result:
                             upload_progress[tracking_id]["status"] = "completed"
@@ -299,9 +451,13 @@ def import_csv():
                         logger.error(f"Background process error: {str(e)}")
                         upload_progress[tracking_id]["status"] = "error"
                         upload_progress[tracking_id]["message"] = f"Error: {str(e)}"
+                    finally:
+                        IMPORT_JOBS.dec()
             
             # Start asynchronous processing
-            thread = threading.Thread(target=process_async)
+            IMPORT_JOBS.inc()
+            # The import continues the request's trace in its own span
+            thread = threading.Thread(target=propagate(process_async, 'bom.import_async'))
             thread.daemon = True
             thread.start()
             
@@ -321,8 +477,10 @@ def import_csv():
         upload_progress[tracking_id]["message"] = f"Import error: {str(e)}"
         return redirect(url_for('index', error=f"Import error: {str(e)}", tracking_id=tracking_id))
 
+@traced('bom.process_csv')
 def process_bom_csv(file, hardware_device, tracking_id=None):
     """Processes a BOM CSV file with semicolon or comma as separator"""
+    import_start = time.perf_counter()
     try:
         # Read CSV file
         content = file.read().decode('utf-8', errors='replace').splitlines()
@@ -389,12 +547,11 @@ def process_bom_csv(file, hardware_device, tracking_id=None):
             upload_progress[tracking_id]["details"]["total_parts"] = total_rows
             upload_progress[tracking_id]["details"]["processed_parts"] = 0
         
-        # Prepare batch import of BOM entries
-        parts_to_process = []   # Stores (part, quantity) pairs
-        parts_to_add = []       # Parts to add to the database
+        # Collect BOM rows first, quantities of repeated parts are summed up
+        bom_quantities = {}     # DigiKey number -> required quantity
+        sub_quantities = {}     # Sub-assembly device name -> required quantity
         failed_parts = []       # Failed parts for reporting
         
-        # Process the data
         for i, row in enumerate(rows):
             if len(row) <= max(dk_index, qty_index):
                 continue  # Skip invalid rows
@@ -402,16 +559,9 @@ def process_bom_csv(file, hardware_device, tracking_id=None):
             digikey_number = row[dk_index].strip()
             
             # Skip empty DigiKey numbers
-            if not digikey_number:
+            if not digikey_number or digikey_number == "nan":
                 continue
             
-            # Update progress
-            if tracking_id:
-                progress_percent = 45 + (i / total_rows * 35)
-                upload_progress[tracking_id]["progress"] = int(progress_percent)
-                upload_progress[tracking_id]["message"] = f"Processing part {i+1} of {total_rows}: {digikey_number}..."
-                upload_progress[tracking_id]["details"]["processed_parts"] = i + 1
-            
             # Validate DigiKey number (pattern=None allows special characters like /)
             is_valid, result = validate_input(digikey_number, max_length=100, pattern=None)
             if not is_valid:
@@ -433,16 +583,47 @@ def process_bom_csv(file, hardware_device, tracking_id=None):
                 logger.warning(f"Invalid quantity value for {digikey_number}, using default of 1")
                 quantity = 1  # Default to 1
             
-            # Collect BOM information with improved error handling
-            result = process_bom_entry_batch(digikey_number, quantity, hardware_device.id)
+            # Rows like "Device:Power Module" reference another device as a sub-assembly
+            if digikey_number.lower().startswith('device:'):
+                device_name = digikey_number[len('device:'):].strip()
+                sub_quantities[device_name] = sub_quantities.get(device_name, 0) + quantity
+                continue
+            
+            bom_quantities[digikey_number] = bom_quantities.get(digikey_number, 0) + quantity
+        
+        # Look up all known parts with one query on the read engine. The read
+        # transaction ends before the DigiKey API is called, so no lock is held
+        # while waiting for the network.
+        with read_only():
+            known_parts = dict(db.session.query(SMDPart.digikey_number, SMDPart.id).filter(
+                SMDPart.digikey_number.in_(list(bom_quantities.keys()))
+            ).all()) if bom_quantities else {}
+            sub_devices = dict(db.session.query(HardwareDevice.name, HardwareDevice.id).filter(
+                HardwareDevice.name.in_(list(sub_quantities.keys()))
+            ).all()) if sub_quantities else {}
+        
+        for device_name in sub_quantities:
+            if device_name not in sub_devices:
+                failed_parts.append({
+                    "digikey_number": f"Device:{device_name}",
+                    "error": "Sub-assembly device not found"
+                })
+        
+        unknown_numbers = [number for number in bom_quantities if number not in known_parts]
+        
+        # Fetch unknown parts from the DigiKey API (outside of any transaction)
+        parts_to_add = {}       # DigiKey number -> new part
+        for i, digikey_number in enumerate(unknown_numbers):
+            # Update progress
+            if tracking_id:
+                progress_percent = 45 + (i / len(unknown_numbers) * 35)
+                upload_progress[tracking_id]["progress"] = int(progress_percent)
+                upload_progress[tracking_id]["message"] = f"Fetching new part {i+1} of {len(unknown_numbers)}: {digikey_number}..."
+                upload_progress[tracking_id]["details"]["processed_parts"] = len(known_parts) + i + 1
             
-            if result:
-                part, is_new = result
-                if is_new:
-                    parts_to_add.append(part)
-                
-                # Add BOM entry for processing
-                parts_to_process.append((part, quantity))
+            new_part = fetch_new_bom_part(digikey_number)
+            if new_part:
+                parts_to_add[digikey_number] = new_part
             else:
                 # Part could not be processed - do NOT add to database anymore
                 # Only store in the error list
@@ -454,9 +635,10 @@ def process_bom_csv(file, hardware_device, tracking_id=None):
         if tracking_id:
             upload_progress[tracking_id]["progress"] = 80
             upload_progress[tracking_id]["message"] = "Saving new parts to the database..."
+            upload_progress[tracking_id]["details"]["processed_parts"] = total_rows
         
-        # Add parts individually to ensure IDs
-        for part in parts_to_add:
+        # Short write transaction: new parts and the BOM entries of the device
+        for part in parts_to_add.values():
             db.session.add(part)
             
         # Ensure all parts have an ID
@@ -466,37 +648,49 @@ def process_bom_csv(file, hardware_device, tracking_id=None):
             upload_progress[tracking_id]["progress"] = 90
             upload_progress[tracking_id]["message"] = "Connecting parts to the device..."
         
+        part_ids = dict(known_parts)
+        part_ids.update({number: part.id for number, part in parts_to_add.items()})
+        
         # Batch import of BOM entries
-        if parts_to_process:
+        rejected = []
+        if part_ids or sub_devices:
             # Delete existing BOM entries for this device
             BOMEntry.query.filter_by(hardware_device_id=hardware_device.id).delete()
+            mark_bom_changed([hardware_device.id])
             
-            # Create new BOM entries - with additional checking
-            entries_to_add = []
-            for part, qty in parts_to_process:
-                # Ensure part has an ID before creating a BOM entry
-                if part.id is None:
-                    logger.warning(f"Part {part.part_number} has no ID, skipping BOM entry for {part.digikey_number}")
-                    continue
-                
-                entries_to_add.append(BOMEntry(
-                    smd_part_id=part.id,
+            db.session.add_all([
+                BOMEntry(
+                    smd_part_id=part_ids[number],
                     hardware_device_id=hardware_device.id,
                     quantity_required=qty
-                ))
+                )
+                for number, qty in bom_quantities.items() if number in part_ids
+            ])
             
-            # Add BOM entries individually to be safer
-            for entry in entries_to_add:
-                db.session.add(entry)
+            # Sub-assemblies are replaced as well, links that would create a cycle are rejected
+            rejected = replace_sub_assemblies(hardware_device.id, {
+                sub_devices[name]: qty for name, qty in sub_quantities.items() if name in sub_devices
+            })
+            for name, device_id in sub_devices.items():
+                if device_id in rejected:
+                    failed_parts.append({
+                        "digikey_number": f"Device:{name}",
+                        "error": "Sub-assembly would create a cycle"
+                    })
         
-        # Commit all changes
+        # Commit all changes (the flattened BOMs are rebuilt before the commit)
         db.session.commit()
         
         if tracking_id:
             upload_progress[tracking_id]["progress"] = 100
+        
+        duration = time.perf_counter() - import_start
+        IMPORT_ROWS.inc(total_rows)
+        IMPORT_DURATION.observe(duration)
+        IMPORT_THROUGHPUT.set(round(total_rows / duration, 2) if duration > 0 else 0)
             
         # Return: success, number of successful parts, list of failed parts
-        return True, len(parts_to_process) - len(failed_parts), failed_parts
+        return True, len(part_ids) + len(sub_devices) - len(rejected), failed_parts
     except Exception as e:
         db.session.rollback()
         logger.error(f"CSV processing error: {str(e)}")
@@ -514,56 +708,94 @@ def create_error_part_entry(digikey_number):
         quantity=0  # Initial stock is 0
     )
 
-def process_bom_entry_batch(digikey_number, quantity, hardware_device_id):
-    """Prepares a BOM entry for batch import"""
-    
-    # Skip empty entries
-    if not digikey_number or digikey_number == "nan":
+@traced('bom.fetch_new_part')
+def fetch_new_bom_part(digikey_number):
+    """Creates a new (not yet added) part with info from the DigiKey API"""
+    if not is_digikey_part_number(digikey_number):
         return None
     
-    # Check if part exists in database
-    smd_part = SMDPart.query.filter_by(digikey_number=digikey_number).first()
-    
-    if not smd_part:
-        # If not, create a new part with info from DigiKey API
-        if is_digikey_part_number(digikey_number):
-            try:
-                manufacturer_part_number, description = fetch_digikey_product_info(digikey_number)
-                if not manufacturer_part_number:
-                    manufacturer_part_number = digikey_number  # Fallback
-                
-                smd_part = SMDPart(
-                    part_number=manufacturer_part_number,
-                    description=description or "No description available",
-                    digikey_number=digikey_number,
-                    quantity=0  # Initial stock is 0
-                )
-                
-                return (smd_part, True)  # Part and flag for new creation
-            except Exception as e:
-                logger.error(f"Error fetching part {digikey_number}: {str(e)}")
-                return None  # Error retrieving, handled in the main handler
-    
-    return (smd_part, False) if smd_part else None  # Part and flag for existing
+    try:
+        manufacturer_part_number, description = fetch_digikey_product_info(digikey_number)
+        if not manufacturer_part_number:
+            manufacturer_part_number = digikey_number  # Fallback
+        
+        return SMDPart(
+            part_number=manufacturer_part_number,
+            description=description or "No description available",
+            digikey_number=digikey_number,
+            quantity=0  # Initial stock is 0
+        )
+    except Exception as e:
+        logger.error(f"Error fetching part {digikey_number}: {str(e)}")
+        return None  # Error retrieving, handled in the main handler
 
 # Home page
 @app.route('/')
 def index():
-    smd_parts = SMDPart.query.all()
+    # Answer with 304 if nothing changed since the browser loaded the page
+    return conditional_response([GLOBAL_SCOPE], render_index)
+
+def render_index():
+    """Renders the home page"""
     hardware_devices = HardwareDevice.query.all()
     devices_with_bom = get_devices_with_bom()
-    unassigned_parts = get_unassigned_parts()
+    
+    # Aggregates for all devices, computed with one query
+    build_summary = get_device_build_summary()
     
     # Read parameters from URL
     tracking_id = request.args.get('tracking_id')
     
     return render_template('base.html', 
-                          smd_parts=smd_parts, 
                           hardware_devices=hardware_devices, 
                           devices_with_bom=devices_with_bom,
-                          unassigned_parts=unassigned_parts,
+                          inventory_table=render_inventory_table(),
+                          device_rows=render_device_rows(devices_with_bom, build_summary),
                           tracking_id=tracking_id)
 
+def render_inventory_table():
+    """Inventory table HTML from the fragment cache
+
+    The whole table is reused while the global data version is unchanged. After
+    a change, it is assembled from cached rows and only rows whose content
+    changed are rendered again.
+    """
+    version = get_versions([GLOBAL_SCOPE])[GLOBAL_SCOPE][0]
+    return render_cached_fragment(fragment_key('inventory_table', version), build_inventory_table)
+
+def build_inventory_table():
+    """Renders the inventory table from cached or newly rendered rows"""
+    smd_parts = db.session.execute(
+        select(SMDPart.id, SMDPart.part_number, SMDPart.digikey_number, SMDPart.description, SMDPart.quantity)
+    ).mappings().all()
+    
+    # Aggregates for all parts, each computed with one query
+    part_status = get_part_status_map()
+    part_devices = get_part_devices_map()
+    
+    items = []
+    for part in smd_parts:
+        status = part_status.get(part['id'], '')
+        devices = part_devices.get(part['id'], [])
+        # The key covers everything the row shows, so an edited row gets a new key
+        key = fragment_key('inventory_row', tuple(part.values()), status,
+                           tuple(tuple(device.values()) for device in devices))
+        items.append((key, {'part': part, 'status': status, 'devices': devices}))
+    
+    rows = render_cached('partials/inventory_row.html', items)
+    return render_template('partials/inventory_table.html', inventory_rows=rows)
+
+def render_device_rows(devices, build_summary):
+    """Device rows of the buildable units card from the fragment cache"""
+    items = []
+    for device in devices:
+        summary = build_summary.get(device.id)
+        key = fragment_key('device_row', device.id, device.name, tuple(summary.values()) if summary else None)
+        items.append((key, {'device': device, 'summary': summary}))
+    
+    rows = render_cached('partials/device_row.html', items)
+    return {device.id: row for device, row in zip(devices, rows)}
+
 # Update SMD stock
 @app.route('/update_stock', methods=['POST'])
 def update_stock():
@@ -590,8 +822,15 @@ def update_stock():
             
             smd_part = SMDPart.query.get(part_id)
             if smd_part:
+                delta = new_quantity - (smd_part.quantity or 0)
                 smd_part.quantity = new_quantity
+                record_stock_movements([(smd_part.id, delta, new_quantity)], 'adjustment')
                 db.session.commit()
+            elif wants_delta():
+                return jsonify({'success': False, 'message': 'Part not found'}), 404
+            
+            if wants_delta():
+                return jsonify({'success': True, 'message': 'Stock updated', 'delta': get_inventory_delta([part_id])})
         else:
             # New structure with search form
             digikey_number = request.form.get('digikey_number', '').strip()
@@ -662,6 +901,7 @@ def update_stock():
             if smd_part:
                 # Update existing part
                 logger.info(f"Existing part found: {smd_part.part_number} / {smd_part.digikey_number}")
+                record_stock_movements([(smd_part.id, quantity - (smd_part.quantity or 0), quantity)], 'adjustment')
                 smd_part.quantity = quantity
                 
                 # Also update description and manufacturer number if provided
@@ -698,6 +938,7 @@ def update_stock():
                 db.session.add(new_part)
                 db.session.flush()  # To generate the ID
                 smd_part = new_part
+                record_stock_movements([(smd_part.id, quantity, quantity)], 'initial')
             
             # Update device assignments
             if valid_device_ids:
@@ -734,8 +975,18 @@ def update_stock():
                 
                 if entries_to_add:
                     db.session.bulk_save_objects(entries_to_add)
+                
+                # Bulk saves bypass the change tracking of the flattened BOMs
+                mark_bom_changed(valid_device_ids)
             
             db.session.commit()
+            
+            if wants_delta():
+                return jsonify({
+                    'success': True,
+                    'message': 'Part saved',
+                    'delta': get_inventory_delta([smd_part.id], set(valid_device_ids) | get_ancestor_ids(valid_device_ids))
+                })
     
         return redirect(url_for('index'))
     except Exception as e:
@@ -743,6 +994,76 @@ def update_stock():
         logger.error(f"Error in update_stock: {str(e)}")
         return f"Error updating stock: {str(e)}", 500
 
+# Batched relative stock changes (e.g. from barcode scanners)
+@app.route('/api/stock/deltas', methods=['POST'])
+def api_stock_deltas():
+    try:
+        data = request.get_json(silent=True)
+        reference = None
+        
+        # Accept either a plain list or {"deltas": [...], "reference": "..."}
+        if isinstance(data, dict):
+            reference = data.get('reference')
+            data = data.get('deltas')
+        
+        if reference is not None and not isinstance(reference, str):
+            return jsonify({'success': False, 'message': 'Invalid reference'}), 400
+        
+        is_valid, result = parse_stock_deltas(data)
+        if not is_valid:
+            return jsonify({'success': False, 'message': 'Invalid stock deltas', 'errors': result}), 400
+        
+        success, result = apply_stock_deltas(result, reference=reference)
+        if not success:
+            # Unknown parts are reported as 404, insufficient stock as 409
+            status = 404 if all(error.get('error') == 'Part not found' for error in result) else 409
+            return jsonify({'success': False, 'message': 'No stock changes applied', 'errors': result}), status
+        
+        response = {'success': True, 'parts': result}
+        if wants_delta():
+            response['delta'] = get_inventory_delta(part['part_id'] for part in result)
+        return jsonify(response)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error applying stock deltas: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
+# Barcode scans of DigiKey labels: adds the scanned quantities to the stock
+@app.route('/api/scan', methods=['POST'])
+def api_scan():
+    try:
+        reference = None
+        
+        # Accept raw payloads (one per line), a plain list or {"scans": [...], "reference": "..."}
+        if request.mimetype == 'text/plain':
+            # Not splitlines(), it also splits at the separators inside the labels
+            data = [line.strip('\r') for line in request.get_data(as_text=True).split('\n') if line.strip()]
+        else:
+            data = request.get_json(silent=True)
+            if isinstance(data, dict):
+                reference = data.get('reference')
+                data = data.get('scans')
+        
+        if reference is not None and not isinstance(reference, str):
+            return jsonify({'success': False, 'message': 'Invalid reference'}), 400
+        
+        is_valid, result = parse_scans(data)
+        if not is_valid:
+            return jsonify({'success': False, 'message': result}), 400
+        
+        results = ingest_scans(result, reference)
+        response = {
+            'success': all(result['status'] in ('applied', 'created', 'queued') for result in results),
+            'results': results
+        }
+        if wants_delta():
+            response['delta'] = get_inventory_delta({result['part_id'] for result in results if 'part_id' in result})
+        return jsonify(response)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error ingesting scans: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
 # New endpoint for updating part usage
 @app.route('/update_part_usage', methods=['POST'])
 def update_part_usage():
@@ -789,74 +1110,312 @@ def update_part_usage():
         
         db.session.commit()
         
-        return jsonify({
+        response = {
             'success': True, 
             'message': 'Usage updated',
             'new_qty': qty_required
-        })
+        }
+        if wants_delta():
+            # The device and all devices containing it have a changed BOM
+            response['delta'] = get_inventory_delta([part_id], {device_id} | get_ancestor_ids([device_id]))
+        return jsonify(response)
     except Exception as e:
         db.session.rollback()
         logger.error(f"Error updating part usage: {str(e)}")
         return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
 
-# Get missing parts for a model (API endpoint)
-@app.route('/missing_parts/<int:device_id>')
-def missing_parts(device_id):
+# Stock history of a part (latest snapshot and recent ledger entries)
+@app.route('/api/parts/<int:part_id>/history')
+def api_part_history(part_id):
+    part = SMDPart.query.get_or_404(part_id)
     try:
-        # Validate device_id
-        hardware_device = HardwareDevice.query.get_or_404(device_id)
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 1000)
         
-        # All BOM entries for this device - Optimized query
-        entries_with_parts = db.session.query(
-            BOMEntry, SMDPart
-        ).join(
-            SMDPart, BOMEntry.smd_part_id == SMDPart.id
-        ).filter(
-            BOMEntry.hardware_device_id == device_id
-        ).all()
+        history = get_part_history(part_id, limit)
+        history['part'] = part.to_dict()
+        return jsonify(history)
+    except Exception as e:
+        logger.error(f"Error getting part history: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# Consumption within the last days for one or all parts
+@app.route('/api/consumption')
+@app.route('/api/parts/<int:part_id>/consumption')
+def api_consumption(part_id=None):
+    if part_id is not None:
+        SMDPart.query.get_or_404(part_id)
+    
+    try:
+        days = request.args.get('days', 30, type=int)
+        if days <= 0 or days > 3650:
+            return jsonify({'error': 'Invalid number of days'}), 400
         
-        missing_parts = []
-        for entry, part in entries_with_parts:
-            if part.quantity < entry.quantity_required:
-                missing_parts.append({
-                    'part_number': part.part_number,
-                    'description': part.description,
-                    'required': entry.quantity_required,
-                    'available': part.quantity,
-                    'missing': entry.quantity_required - part.quantity
-                })
+        consumption = get_consumption(days, [part_id] if part_id is not None else None)
         
-        # Sort by missing stock in descending order
-        missing_parts.sort(key=lambda x: x['missing'], reverse=True)
+        results = [{'part_id': pid, **values} for pid, values in consumption.items()]
+        results.sort(key=lambda x: x['consumed'], reverse=True)
+        return jsonify({'days': days, 'parts': results})
+    except Exception as e:
+        logger.error(f"Error getting consumption: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# Batch endpoint for updating many part usages at once
+@app.route('/api/bom/usage', methods=['POST'])
+def api_bom_usage():
+    try:
+        data = request.get_json(silent=True)
+        
+        # Accept either a plain list or {"items": [...]}
+        if isinstance(data, dict):
+            data = data.get('items')
+        
+        if not isinstance(data, list) or not data:
+            return jsonify({'success': False, 'message': 'Expected a non-empty list of usage items'}), 400
+        
+        if len(data) > MAX_USAGE_BATCH:
+            return jsonify({'success': False, 'message': f'Too many items (max. {MAX_USAGE_BATCH})'}), 400
+        
+        items, errors = parse_usage_items(data)
+        results = apply_usage_batch(items) if items else []
+        results = sorted(errors + results, key=lambda result: result['index'])
         
         return jsonify({
-            'device_name': hardware_device.name,
-            'missing_parts': missing_parts
+            'success': all(result['success'] for result in results),
+            'results': results
         })
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error updating part usage batch: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
+def get_missing_parts(device_id):
+    """Missing parts of a device, largest shortage first"""
+    # Flattened BOM of this device (including sub-assemblies) with the stock
+    # available to it (unreserved plus its own reservations) - Optimized query
+    entries_with_parts = join_device_reservations(db.session.query(
+        FlatBOMEntry, SMDPart, device_available_quantity()
+    ).join(
+        SMDPart, FlatBOMEntry.smd_part_id == SMDPart.id
+    ), FlatBOMEntry.hardware_device_id).filter(
+        FlatBOMEntry.hardware_device_id == device_id
+    ).all()
+    
+    missing_parts = []
+    for entry, part, available in entries_with_parts:
+        if available < entry.quantity_required:
+            missing_parts.append({
+                'part_number': part.part_number,
+                'description': part.description,
+                'required': entry.quantity_required,
+                'available': available,
+                'missing': entry.quantity_required - available
+            })
+    
+    # Sort by missing stock in descending order
+    missing_parts.sort(key=lambda x: x['missing'], reverse=True)
+    return missing_parts
+
+# Get missing parts for a model (API endpoint)
+@app.route('/missing_parts/<int:device_id>')
+def missing_parts(device_id):
+    # Validate device_id
+    hardware_device = HardwareDevice.query.get_or_404(device_id)
+    try:
+        # Only changes of this device's BOM or of part data affect the result
+        return conditional_response([device_scope(device_id), PARTS_SCOPE], lambda: jsonify({
+            'device_name': hardware_device.name,
+            'missing_parts': get_missing_parts(device_id)
+        }))
     except Exception as e:
         logger.error(f"Error getting missing parts: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+# Production run planner: demand, shortages and feasible mix for many devices
+@app.route('/api/plan', methods=['POST'])
+def api_plan():
+    try:
+        data = request.get_json(silent=True)
+        strategy = 'priority'
+        
+        # Accept either a plain list or {"targets": [...], "strategy": "..."}
+        if isinstance(data, dict):
+            strategy = data.get('strategy', strategy)
+            data = data.get('targets')
+        
+        if strategy not in PLAN_STRATEGIES:
+            return jsonify({'success': False, 'message': f'Unknown strategy (use {", ".join(PLAN_STRATEGIES)})'}), 400
+        
+        is_valid, result = parse_plan_targets(data)
+        if not is_valid:
+            return jsonify({'success': False, 'message': 'Invalid targets', 'errors': result}), 400
+        
+        # Check that all devices exist
+        device_ids = [target['device_id'] for target in result]
+        existing = {device_id for (device_id,) in db.session.query(HardwareDevice.id).filter(HardwareDevice.id.in_(device_ids)).all()}
+        unknown = [device_id for device_id in device_ids if device_id not in existing]
+        if unknown:
+            return jsonify({'success': False, 'message': 'Device not found', 'device_ids': unknown}), 404
+        
+        plan = plan_production(result, strategy)
+        return jsonify({'success': True, **plan})
+    except Exception as e:
+        logger.error(f"Error planning production: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
+# Shopping list: shortages of all or selected devices, optionally with DigiKey prices
+@app.route('/api/shopping-list', methods=['GET', 'POST'])
+def api_shopping_list():
+    try:
+        targets = None
+        with_pricing = request.args.get('pricing', '').lower() in ('1', 'true')
+        
+        # POST accepts a plain list or {"targets": [...], "pricing": true}, GET covers one unit of every device
+        if request.method == 'POST':
+            data = request.get_json(silent=True)
+            if isinstance(data, dict):
+                with_pricing = bool(data.get('pricing', with_pricing))
+                data = data.get('targets')
+            
+            is_valid, targets = parse_plan_targets(data)
+            if not is_valid:
+                return jsonify({'success': False, 'message': 'Invalid targets', 'errors': targets}), 400
+            
+            device_ids = [target['device_id'] for target in targets]
+            existing = set(db.session.execute(select(HardwareDevice.id).where(HardwareDevice.id.in_(device_ids))).scalars())
+            unknown = [device_id for device_id in device_ids if device_id not in existing]
+            if unknown:
+                return jsonify({'success': False, 'message': 'Device not found', 'device_ids': unknown}), 404
+        
+        if with_pricing:
+            # Prices change independently of the data versions, no validators
+            return jsonify({'success': True, **build_shopping_list(targets, with_pricing=True)})
+        if targets is None:
+            return conditional_response([GLOBAL_SCOPE], lambda: jsonify({'success': True, **build_shopping_list()}))
+        return jsonify({'success': True, **build_shopping_list(targets)})
+    except Exception as e:
+        logger.error(f"Error building shopping list: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
+def export_response(query, export_format, name):
+    """Streams an export as a download without building it in memory"""
+    if export_format not in EXPORT_FORMATS:
+        abort(404)
+    
+    return Response(
+        stream_with_context(stream_export(query, export_format)),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': f'attachment; filename="{export_filename(name, export_format)}"'}
+    )
+
+# Export of the complete inventory
+@app.route('/export/inventory.<export_format>')
+def export_inventory(export_format):
+    return export_response(inventory_query(), export_format, 'inventory')
+
+# Export of the BOM of a device
+@app.route('/export/devices/<int:device_id>/bom.<export_format>')
+def export_device_bom(device_id, export_format):
+    hardware_device = HardwareDevice.query.get_or_404(device_id)
+    return export_response(bom_query(device_id), export_format, f"bom_{hardware_device.name}")
+
+# Export of the missing parts of a device
+@app.route('/export/missing_parts/<int:device_id>.<export_format>')
+def export_missing_parts(device_id, export_format):
+    hardware_device = HardwareDevice.query.get_or_404(device_id)
+    return export_response(missing_parts_query(device_id), export_format, f"missing_parts_{hardware_device.name}")
+
+# Export of the shopping list for one unit of every device
+@app.route('/export/shopping_list.<export_format>')
+def export_shopping_list(export_format):
+    return export_response(shopping_list_query(), export_format, 'shopping_list')
+
 # Delete function for SMD parts
 @app.route('/delete_part/<int:part_id>', methods=['POST'])
 def delete_part(part_id):
     try:
         # Validate part_id
-        part = SMDPart.query.get_or_404(part_id)
-        
-        # First delete the BOM entries (foreign key relationship)
-        BOMEntry.query.filter_by(smd_part_id=part_id).delete()
+        SMDPart.query.get_or_404(part_id)
         
-        # Then delete the part itself
-        db.session.delete(part)
-        
-        db.session.commit()
+        # BOM entries and other dependent rows are removed by the cascade
+        delete_parts([part_id])
         return jsonify({'success': True, 'message': 'Part successfully deleted'})
     except Exception as e:
         db.session.rollback()
         logger.error(f"Error deleting part: {str(e)}")
         return jsonify({'success': False, 'message': f'Error deleting: {str(e)}'}), 500
 
+# Bulk delete of many parts in one transaction
+@app.route('/api/parts/bulk_delete', methods=['POST'])
+def api_bulk_delete_parts():
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        is_valid, result = parse_id_list(data.get('part_ids') if isinstance(data, dict) else data)
+        if not is_valid:
+            return jsonify({'success': False, 'message': result}), 400
+        
+        counts = delete_parts(result)
+        return jsonify({'success': True, 'message': f"{counts['parts']} parts deleted", 'deleted': counts})
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Bulk delete parts error: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error deleting: {str(e)}'}), 500
+
+# Bulk delete of many devices in one transaction
+@app.route('/api/devices/bulk_delete', methods=['POST'])
+def api_bulk_delete_devices():
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        is_valid, result = parse_id_list(data.get('device_ids') if isinstance(data, dict) else data)
+        if not is_valid:
+            return jsonify({'success': False, 'message': result}), 400
+        
+        counts = delete_devices(result)
+        return jsonify({'success': True, 'message': f"{counts['devices']} devices deleted", 'deleted': counts})
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Bulk delete devices error: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error deleting: {str(e)}'}), 500
+
+# Move the usages of many parts from one device to another
+@app.route('/api/bom/reassign', methods=['POST'])
+def api_bom_reassign():
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'success': False, 'message': 'Expected a JSON object'}), 400
+        
+        # Validate input data
+        try:
+            from_device_id = int(data.get('from_device_id'))
+            to_device_id = int(data.get('to_device_id'))
+        except (ValueError, TypeError):
+            return jsonify({'success': False, 'message': 'Invalid device IDs'}), 400
+        
+        if from_device_id == to_device_id:
+            return jsonify({'success': False, 'message': 'Source and target device must differ'}), 400
+        
+        part_ids = None
+        if data.get('part_ids') is not None:
+            is_valid, result = parse_id_list(data.get('part_ids'))
+            if not is_valid:
+                return jsonify({'success': False, 'message': result}), 400
+            part_ids = result
+        
+        existing = {device_id for (device_id,) in db.session.query(HardwareDevice.id).filter(
+            HardwareDevice.id.in_([from_device_id, to_device_id])
+        ).all()}
+        if len(existing) != 2:
+            return jsonify({'success': False, 'message': 'Device not found'}), 404
+        
+        counts = reassign_usages(from_device_id, to_device_id, part_ids)
+        return jsonify({'success': True, 'message': f"{counts['moved']} usages moved", **counts})
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Reassign usages error: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
 # DigiKey API Test Route (for testing the API connection)
 @app.route('/test_api/<digikey_number>')
 def test_api(digikey_number):
@@ -910,22 +1469,207 @@ def add_device():
 def delete_device(device_id):
     try:
         # Check if the device exists
-        device = HardwareDevice.query.get_or_404(device_id)
+        device_name = HardwareDevice.query.get_or_404(device_id).name
         
-        # First delete all BOM entries for this device
+        # BOM entries, sub-assembly links and reservations are removed as well
         # This causes components to become unassigned if they were only used for this device
-        BOMEntry.query.filter_by(hardware_device_id=device_id).delete()
-        
-        # Then delete the device itself
-        db.session.delete(device)
-        db.session.commit()
+        delete_devices([device_id])
         
-        return jsonify({'success': True, 'message': f'Device "{device.name}" successfully deleted'})
+        return jsonify({'success': True, 'message': f'Device "{device_name}" successfully deleted'})
     except Exception as e:
         db.session.rollback()
         logger.error(f"Delete device error: {str(e)}")
         return jsonify({'success': False, 'message': f'Error deleting: {str(e)}'}), 500
 
+# Add, update or remove (quantity 0) a sub-assembly of a device
+@app.route('/devices/<int:device_id>/subassemblies', methods=['POST'])
+def update_sub_assembly(device_id):
+    device = HardwareDevice.query.get_or_404(device_id)
+    try:
+        data = request.get_json(silent=True) or request.form
+        
+        # Validate input data
+        try:
+            child_id = int(data.get('child_device_id'))
+            quantity = int(data.get('quantity', 1))
+        except (ValueError, TypeError):
+            return jsonify({'success': False, 'message': 'Invalid parameter values'}), 400
+        
+        if quantity < 0:
+            return jsonify({'success': False, 'message': 'Quantity must not be negative'}), 400
+        
+        if not HardwareDevice.query.get(child_id):
+            return jsonify({'success': False, 'message': 'Sub-assembly device not found'}), 404
+        
+        success, result = set_sub_assembly(device_id, child_id, quantity)
+        if not success:
+            return jsonify({'success': False, 'message': result}), 409
+        
+        return jsonify({
+            'success': True,
+            'message': f'Sub-assembly of "{device.name}" {result}',
+            'action': result,
+            'new_qty': quantity
+        })
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Update sub-assembly error: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
+# Flattened BOM of a device: total part quantities across all sub-assemblies
+@app.route('/devices/<int:device_id>/flat_bom')
+def flat_bom(device_id):
+    device = HardwareDevice.query.get_or_404(device_id)
+    try:
+        entries = db.session.query(
+            FlatBOMEntry, SMDPart
+        ).join(
+            SMDPart, FlatBOMEntry.smd_part_id == SMDPart.id
+        ).filter(
+            FlatBOMEntry.hardware_device_id == device_id
+        ).order_by(SMDPart.id).all()
+        
+        sub_assemblies = SubAssembly.query.filter_by(parent_device_id=device_id).all()
+        
+        return jsonify({
+            'device_name': device.name,
+            'sub_assemblies': [link.to_dict() for link in sub_assemblies],
+            'parts': [
+                {
+                    'part_id': part.id,
+                    'part_number': part.part_number,
+                    'digikey_number': part.digikey_number,
+                    'required': entry.quantity_required,
+                    'available': part.quantity
+                }
+                for entry, part in entries
+            ]
+        })
+    except Exception as e:
+        logger.error(f"Error getting flattened BOM: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# Build units of a device: consumes the stock of all BOM parts at once
+@app.route('/devices/<int:device_id>/build', methods=['POST'])
+def build_device_units(device_id):
+    device = HardwareDevice.query.get_or_404(device_id)
+    try:
+        # Validate the number of units
+        is_valid, result = parse_units(request.get_json(silent=True) or request.form)
+        if not is_valid:
+            return jsonify({'success': False, 'message': result}), 400
+        units = result
+        
+        success, result = build_device(device_id, units)
+        if not success:
+            if not result:
+                return jsonify({'success': False, 'message': f'Device "{device.name}" has no BOM entries'}), 400
+            return jsonify({
+                'success': False,
+                'message': f'Not enough stock to build {units} units of "{device.name}"',
+                'missing_parts': result
+            }), 409
+        
+        response = {
+            'success': True,
+            'message': f'{units} units of "{device.name}" built, stock of {result} parts consumed',
+            'units': units,
+            'parts_consumed': result,
+            'buildable': get_buildable_count(device_id)
+        }
+        if wants_delta():
+            part_ids = db.session.execute(
+                select(FlatBOMEntry.smd_part_id).where(FlatBOMEntry.hardware_device_id == device_id)
+            ).scalars()
+            response['delta'] = get_inventory_delta(part_ids, [device_id])
+        return jsonify(response)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Build device error: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
+def parse_units(data, required=True):
+    """Validates the number of units of a build or reservation request
+
+    Returns:
+        tuple: (is_valid, units or error message)
+    """
+    if not required and data.get('units') is None:
+        return True, None
+    
+    try:
+        units = int(data.get('units', 1))
+    except (ValueError, TypeError):
+        return False, 'Invalid number of units'
+    
+    if units <= 0:
+        return False, 'Number of units must be positive'
+    
+    return True, units
+
+# Reserve the stock for planned builds of a device
+@app.route('/devices/<int:device_id>/reserve', methods=['POST'])
+def reserve_device_units(device_id):
+    device = HardwareDevice.query.get_or_404(device_id)
+    try:
+        is_valid, result = parse_units(request.get_json(silent=True) or request.form)
+        if not is_valid:
+            return jsonify({'success': False, 'message': result}), 400
+        units = result
+        
+        success, result = reserve_device(device_id, units)
+        if not success:
+            if not result:
+                return jsonify({'success': False, 'message': f'Device "{device.name}" has no BOM entries'}), 400
+            return jsonify({
+                'success': False,
+                'message': f'Not enough available stock to reserve {units} units of "{device.name}"',
+                'missing_parts': result
+            }), 409
+        
+        return jsonify({
+            'success': True,
+            'message': f'Stock of {result} parts reserved for {units} units of "{device.name}"',
+            'units': units,
+            'parts_reserved': result
+        })
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Reserve device error: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
+# Release the reservations of a device (all or for a number of units)
+@app.route('/devices/<int:device_id>/release', methods=['POST'])
+def release_device_units(device_id):
+    device = HardwareDevice.query.get_or_404(device_id)
+    try:
+        is_valid, result = parse_units(request.get_json(silent=True) or request.form, required=False)
+        if not is_valid:
+            return jsonify({'success': False, 'message': result}), 400
+        
+        changed = release_reservations(device_id, result)
+        return jsonify({
+            'success': True,
+            'message': f'Reservations of "{device.name}" released',
+            'parts_released': changed
+        })
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Release reservations error: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'}), 500
+
+# List reservations, optionally filtered by device or part
+@app.route('/api/reservations')
+def api_reservations():
+    try:
+        device_id = request.args.get('device_id', type=int)
+        part_id = request.args.get('part_id', type=int)
+        
+        return jsonify({'reservations': get_reservations(device_id, part_id)})
+    except Exception as e:
+        logger.error(f"Error getting reservations: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 # New route for editing device names
 @app.route('/update_device_name', methods=['POST'])
 def update_device_name():
@@ -966,8 +1710,7 @@ def update_device_name():
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
-        db.session.commit()
+        init_database()
         
     # Control debug mode via environment variable
     debug_mode = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
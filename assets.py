@@ -0,0 +1,259 @@
+"""Static asset pipeline: minified, content-hashed bundles with immutable caching
+
+The bundles are built once (at deploy time) into static/dist together with a
+manifest that maps the source names to the fingerprinted names:
+
+    python -m assets
+
+Templates link assets with asset_url('styles.css'). With a manifest, this is
+the fingerprinted bundle, served with a far-future immutable Cache-Control
+header, so browsers never revalidate it; a changed file gets a new name.
+Without a manifest (or in debug mode) the source file is linked, with a
+version parameter derived from its modification time.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+from flask import request, url_for
+
+# Configure Logging
+logger = logging.getLogger('assets')
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+
+# Source files (relative to static/) that are minified and fingerprinted
+ASSETS = ('styles.css', 'js/main.js')
+
+# Lifetime of fingerprinted files: one year, they never change under their name
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+IDENTIFIER_CHARS = re.compile(r'[\w$\\]')
+
+# After these characters a "/" starts a regular expression, not a division
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^\n')
+REGEX_KEYWORDS = ('return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'void', 'yield', 'await', 'delete', 'throw', 'new')
+
+def minify_js(source):
+    """Removes comments and unneeded whitespace from JavaScript
+
+    Strings, template literals and regular expressions are copied unchanged.
+    Line breaks are kept (collapsed), so automatic semicolon insertion still
+    applies where the source relies on it.
+    """
+    out = []
+    i = 0
+    length = len(source)
+    pending_space = ''      # '', ' ' or '\n' between two tokens
+    template_depth = []     # brace depth of each open ${ ... } expression
+    brace_depth = 0
+
+    def last_significant():
+        text = ''.join(out[-3:]).rstrip(' ')
+        return text[-1] if text else '\n'
+
+    def emit(token):
+        nonlocal pending_space
+        if pending_space and out:
+            previous = out[-1][-1]
+            if pending_space == '\n':
+                out.append('\n')
+            elif (IDENTIFIER_CHARS.match(previous) and IDENTIFIER_CHARS.match(token[0])) \
+                    or (previous in '+-' and token[0] == previous):
+                out.append(' ')
+        pending_space = ''
+        out.append(token)
+
+    def read_quoted(start, quote):
+        j = start + 1
+        while j < length and source[j] != quote:
+            j += 2 if source[j] == '\\' else 1
+        return j + 1
+
+    def read_template(start):
+        """Reads template text up to the closing backtick or the next ${"""
+        j = start
+        while j < length:
+            if source[j] == '\\':
+                j += 2
+            elif source[j] == '`':
+                return j + 1, False
+            elif source.startswith('${', j):
+                return j + 2, True
+            else:
+                j += 1
+        return j, False
+
+    while i < length:
+        char = source[i]
+
+        if char in ' \t\r\n':
+            j = i
+            while j < length and source[j] in ' \t\r\n':
+                j += 1
+            if '\n' in source[i:j]:
+                pending_space = '\n'
+            elif not pending_space:
+                pending_space = ' '
+            i = j
+        elif source.startswith('//', i):
+            end = source.find('\n', i)
+            i = length if end == -1 else end
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = length if end == -1 else end + 2
+            if not pending_space:
+                pending_space = ' '
+        elif char in '\'"':
+            end = read_quoted(i, char)
+            emit(source[i:end])
+            i = end
+        elif char == '`':
+            end, opened = read_template(i + 1)
+            emit(source[i:end])
+            if opened:
+                template_depth.append(brace_depth)
+            i = end
+        elif char == '}' and template_depth and template_depth[-1] == brace_depth:
+            # End of a ${ ... } expression, the template text continues
+            template_depth.pop()
+            end, opened = read_template(i + 1)
+            pending_space = ''
+            out.append(source[i:end])
+            if opened:
+                template_depth.append(brace_depth)
+            i = end
+        elif char == '/':
+            previous_word = re.search(r'([\w$]+)\s*$', ''.join(out[-3:]))
+            is_regex = last_significant() in REGEX_PRECEDERS or (
+                previous_word is not None and previous_word.group(1) in REGEX_KEYWORDS
+            )
+            if is_regex:
+                j = i + 1
+                in_class = False
+                while j < length and (source[j] != '/' or in_class):
+                    if source[j] == '\\':
+                        j += 1
+                    elif source[j] == '[':
+                        in_class = True
+                    elif source[j] == ']':
+                        in_class = False
+                    j += 1
+                j += 1
+                while j < length and source[j].isalpha():
+                    j += 1  # flags
+                emit(source[i:j])
+                i = j
+            else:
+                emit(char)
+                i += 1
+        else:
+            if char == '{':
+                brace_depth += 1
+            elif char == '}':
+                brace_depth -= 1
+            j = i + 1
+            if IDENTIFIER_CHARS.match(char):
+                while j < length and IDENTIFIER_CHARS.match(source[j]):
+                    j += 1
+            emit(source[i:j])
+            i = j
+
+    return ''.join(out).strip() + '\n'
+
+def minify_css(source):
+    """Removes comments and unneeded whitespace from CSS (strings are kept)"""
+    parts = re.split(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')', source)
+    for index in range(0, len(parts), 2):
+        text = re.sub(r'/\*.*?\*/', '', parts[index], flags=re.DOTALL)
+        text = re.sub(r'\s+', ' ', text)
+        text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+        text = re.sub(r';}', '}', text)
+        parts[index] = text
+    return ''.join(parts).strip() + '\n'
+
+MINIFIERS = {'.js': minify_js, '.css': minify_css}
+
+def fingerprinted_name(filename, content):
+    """styles.css -> dist/styles.<hash>.css"""
+    digest = hashlib.sha256(content.encode('utf-8')).hexdigest()[:12]
+    base, extension = os.path.splitext(filename)
+    return f"{DIST_DIR}/{base}.{digest}{extension}"
+
+def build_assets(static_dir=STATIC_DIR):
+    """Writes the minified, fingerprinted bundles and the manifest into static/dist
+
+    Returns:
+        dict: Manifest {source name: fingerprinted name}
+    """
+    manifest = {}
+    for filename in ASSETS:
+        with open(os.path.join(static_dir, filename), encoding='utf-8') as source_file:
+            source = source_file.read()
+
+        extension = os.path.splitext(filename)[1]
+        content = MINIFIERS[extension](source) if extension in MINIFIERS else source
+        target = fingerprinted_name(filename, content)
+
+        target_path = os.path.join(static_dir, target)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        with open(target_path, 'w', encoding='utf-8') as target_file:
+            target_file.write(content)
+
+        manifest[filename] = target
+        logger.info(f"Built {target} ({len(source)} -> {len(content)} bytes)")
+
+    with open(os.path.join(static_dir, DIST_DIR, MANIFEST_NAME), 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+    return manifest
+
+def load_manifest(static_dir=STATIC_DIR):
+    """Reads the manifest of the built bundles, empty if none were built"""
+    try:
+        with open(os.path.join(static_dir, DIST_DIR, MANIFEST_NAME), encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+
+def init_assets(app):
+    """Registers asset_url() for templates and the immutable caching of bundles
+
+    Returns:
+        str: Version of the served assets, changes with every rebuilt bundle
+    """
+    manifest = {} if app.debug else load_manifest(app.static_folder)
+    if manifest:
+        logger.info(f"Serving {len(manifest)} fingerprinted assets")
+
+    def asset_url(filename):
+        """URL of a static asset: the fingerprinted bundle or the versioned source file"""
+        if filename in manifest:
+            return url_for('static', filename=manifest[filename])
+        try:
+            version = int(os.path.getmtime(os.path.join(app.static_folder, filename)))
+        except OSError:
+            version = None
+        return url_for('static', filename=filename, v=version)
+
+    @app.context_processor
+    def asset_processor():
+        return dict(asset_url=asset_url)
+
+    @app.after_request
+    def cache_fingerprinted_assets(response):
+        if request.endpoint == 'static' and request.view_args.get('filename', '').startswith(f"{DIST_DIR}/") \
+                and response.status_code in (200, 304):
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+    return hashlib.sha1(json.dumps(manifest, sort_keys=True).encode('utf-8')).hexdigest()[:8] if manifest else 'src'
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    build_assets()
+    sys.exit(0)
@@ -0,0 +1,154 @@
+"""Concurrency stress test for the SQLite storage profile
+
+Runs a BOM import (with a slow, stubbed DigiKey API) and a long write
+transaction while reader threads keep requesting read-only pages and
+writer threads post stock deltas. Fails if a read is blocked longer than
+the allowed latency or if any request fails (e.g. "database is locked").
+
+Usage:
+    python -m benchmarks.sqlite_concurrency [--parts 2000] [--max-read-latency 1.0]
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--parts', type=int, default=2000, help='Number of parts in the inventory')
+    parser.add_argument('--new-parts', type=int, default=40, help='Number of unknown parts in the imported BOM')
+    parser.add_argument('--api-delay', type=float, default=0.05, help='Simulated DigiKey API latency in seconds')
+    parser.add_argument('--hold', type=float, default=2.0, help='Duration of the long write transaction in seconds')
+    parser.add_argument('--readers', type=int, default=4, help='Number of reader threads')
+    parser.add_argument('--writers', type=int, default=2, help='Number of writer threads')
+    parser.add_argument('--max-read-latency', type=float, default=1.0, help='Maximum allowed read latency in seconds')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    db_dir = tempfile.mkdtemp(prefix='smd_stress_')
+    os.environ['DATABASE_URI'] = f"sqlite:///{os.path.join(db_dir, 'stress.db')}"
+
+    # Import only after the database URI is set
+    import app as smd_app
+    from models import db, SMDPart, HardwareDevice, BOMEntry
+
+    app = smd_app.app
+
+    with app.app_context():
+        db.create_all()
+        db.session.execute(SMDPart.__table__.insert(), [
+            {'part_number': f'MPN-{i}', 'description': f'Part {i}', 'digikey_number': f'{i}-STRESS-ND', 'quantity': 1000}
+            for i in range(args.parts)
+        ])
+        device = HardwareDevice(name='Stress Reader Device')
+        db.session.add(device)
+        db.session.flush()
+        db.session.execute(BOMEntry.__table__.insert(), [
+            {'smd_part_id': part_id, 'hardware_device_id': device.id, 'quantity_required': 2}
+            for part_id in range(1, min(args.parts, 200) + 1)
+        ])
+        db.session.commit()
+        read_device_id = device.id
+
+    # Simulated slow DigiKey API
+    def fetch_stub(digikey_number):
+        time.sleep(args.api_delay)
+        return f"MPN-{digikey_number}", "Imported part"
+    smd_app.fetch_digikey_product_info = fetch_stub
+
+    stop = threading.Event()
+    read_latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def reader():
+        client = app.test_client()
+        urls = [f'/missing_parts/{read_device_id}', '/search_digikey_by_mpn/1-STRESS-ND', '/export/inventory.csv']
+        i = 0
+        while not stop.is_set():
+            url = urls[i % len(urls)]
+            i += 1
+            start = time.perf_counter()
+            response = client.get(url)
+            response.get_data()
+            elapsed = time.perf_counter() - start
+            with lock:
+                read_latencies.append(elapsed)
+                if response.status_code != 200:
+                    errors.append(f"GET {url}: HTTP {response.status_code}")
+
+    def writer(offset):
+        client = app.test_client()
+        i = 0
+        while not stop.is_set():
+            part_id = (offset + i) % args.parts + 1
+            i += 1
+            response = client.post('/api/stock/deltas', json=[{'part_id': part_id, 'delta': 1}])
+            if response.status_code != 200:
+                with lock:
+                    errors.append(f"POST /api/stock/deltas: HTTP {response.status_code} {response.get_data(as_text=True)[:200]}")
+            time.sleep(0.01)
+
+    def importer():
+        rows = [f'{i}-STRESS-ND,1' for i in range(args.parts)]
+        rows += [f'{i}-NEW-ND,1' for i in range(args.new_parts)]
+        content = 'Device,Stress Import\nDigiKey-No,Quantity\n' + '\n'.join(rows)
+        with app.app_context():
+            device = HardwareDevice(name='Stress Import')
+            db.session.add(device)
+            db.session.commit()
+            try:
+                smd_app.process_bom_csv(io.BytesIO(content.encode()), device)
+            except Exception as e:
+                with lock:
+                    errors.append(f"Import: {e}")
+
+    def long_transaction():
+        # Holds the write lock, like a long-running import used to
+        with app.app_context():
+            db.session.execute(SMDPart.__table__.update().where(SMDPart.id == 1).values(quantity=SMDPart.quantity + 1))
+            time.sleep(args.hold)
+            db.session.commit()
+
+    threads = [threading.Thread(target=reader) for _ in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(i * 1000,)) for i in range(args.writers)]
+    for thread in threads:
+        thread.start()
+
+    started = time.perf_counter()
+    for phase in (importer, long_transaction):
+        phase_thread = threading.Thread(target=phase)
+        phase_thread.start()
+        phase_thread.join()
+    duration = time.perf_counter() - started
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies = sorted(read_latencies)
+    result = {
+        'duration_s': round(duration, 3),
+        'reads': len(latencies),
+        'read_p50_ms': round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+        'read_p95_ms': round(latencies[int(len(latencies) * 0.95)] * 1000, 2) if latencies else None,
+        'read_max_ms': round(latencies[-1] * 1000, 2) if latencies else None,
+        'errors': errors[:20],
+        'error_count': len(errors)
+    }
+    print(json.dumps(result, indent=2))
+
+    if errors or not latencies or latencies[-1] > args.max_read_latency:
+        print("FAILED: reads were blocked or requests failed", file=sys.stderr)
+        return 1
+    print("OK: reads were not blocked during import and long write transaction")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
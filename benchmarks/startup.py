@@ -0,0 +1,184 @@
+"""Startup benchmark: import time of the app with python -X importtime
+
+Imports the app in fresh interpreters, as a worker process does when it boots,
+and reports the median import time and the slowest modules. The run fails if
+
+- the median import time exceeds --budget-ms,
+- a dependency that must be loaded lazily (--lazy) was imported, or
+- importing opened the database (the SQLite file was created).
+
+Redis points to an unreachable address, so an import that connects to Redis
+runs into the timeout and fails the run. Results can be written as JSON and
+compared with an earlier run like the results of benchmarks.suite.
+
+Usage:
+    python -m benchmarks.startup [--budget-ms 1000] [--output startup.json]
+    python -m benchmarks.startup --compare startup.json [--max-regression 0.2]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from benchmarks.suite import summarize, compare, git_commit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dependencies that are only imported by the code paths using them
+LAZY_MODULES = ('pandas', 'numpy', 'requests', 'redis', 'sqlalchemy.dialects.postgresql')
+
+# Reserved for documentation (RFC 5737), connections to it never succeed
+UNREACHABLE_HOST = '192.0.2.1'
+
+# Runs in the child interpreter, the names of the lazy modules are passed as arguments
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+print(json.dumps({'import_ms': elapsed * 1000, 'loaded': [m for m in sys.argv[1:] if m in sys.modules]}))
+"""
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='Timed imports')
+    parser.add_argument('--budget-ms', type=float, default=1000, help='Maximum median import time of the app')
+    parser.add_argument('--lazy', default=','.join(LAZY_MODULES), help='Comma-separated modules that must not be imported')
+    parser.add_argument('--top', type=int, default=15, help='Number of slowest modules to report')
+    parser.add_argument('--timeout', type=float, default=60, help='Seconds before an import counts as hanging')
+    parser.add_argument('--output', help='Write the results to this JSON file (default: stdout)')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare with')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='Allowed slowdown of the median, e.g. 0.2 = 20%%')
+    return parser.parse_args()
+
+def parse_importtime(output):
+    """Parses the -X importtime report
+
+    Returns:
+        list: (self ms, cumulative ms, nesting depth, module) of every imported module
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((int(self_us) / 1000, int(cumulative_us) / 1000, depth, name.strip()))
+    return modules
+
+def app_imports(modules):
+    """(module, cumulative ms) of the modules imported directly by the app
+
+    The report lists every module after the modules it imported, so the direct
+    imports of the app are the depth 1 entries right before it.
+    """
+    index = next(i for i, (_, _, depth, name) in enumerate(modules) if depth == 0 and name == 'app')
+    direct = []
+    for _, cumulative, depth, name in reversed(modules[:index]):
+        if depth == 0:
+            break
+        if depth == 1:
+            direct.append((name, cumulative))
+    return direct
+
+def import_app(database_path, lazy, timeout):
+    """Imports the app once in a new interpreter
+
+    Returns:
+        tuple: (child report, parsed importtime report, process time in ms)
+    """
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URI': f"sqlite:///{database_path}",
+        'REDIS_HOST': UNREACHABLE_HOST
+    })
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD, *lazy],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=timeout
+    )
+    elapsed = (time.perf_counter() - start) * 1000
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'import failed')
+    report = json.loads(completed.stdout.strip().splitlines()[-1])
+    return report, parse_importtime(completed.stderr), elapsed
+
+def main():
+    args = parse_args()
+    lazy = [name for name in args.lazy.split(',') if name]
+    database_path = os.path.join(tempfile.mkdtemp(prefix='smd_startup_'), 'startup.db')
+
+    import_times = []
+    process_times = []
+    loaded = set()
+    modules = []
+    try:
+        # The first import compiles the bytecode and is not timed
+        for i in range(args.repeat + 1):
+            report, modules, elapsed = import_app(database_path, lazy, args.timeout)
+            loaded.update(report['loaded'])
+            if i > 0:
+                import_times.append(report['import_ms'])
+                process_times.append(elapsed)
+    except subprocess.TimeoutExpired:
+        print(f"Importing the app took longer than {args.timeout} s (connection attempt on import?)", file=sys.stderr)
+        return 1
+    except RuntimeError as e:
+        print(f"Importing the app failed: {e}", file=sys.stderr)
+        return 1
+
+    direct = sorted(app_imports(modules), key=lambda item: -item[1])
+    slowest = sorted(((name, own) for own, _, _, name in modules), key=lambda item: -item[1])
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'parameters': {'repeat': args.repeat, 'budget_ms': args.budget_ms, 'lazy': lazy}
+        },
+        'results': {
+            'import_app': summarize(import_times),
+            'start_process': summarize(process_times)
+        },
+        'direct_imports_ms': {name: round(ms, 3) for name, ms in direct[:args.top]},
+        'slowest_modules_ms': {name: round(ms, 3) for name, ms in slowest[:args.top]},
+        'eagerly_loaded': sorted(loaded),
+        'database_opened': os.path.exists(database_path)
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+
+    ok = True
+    median = results['results']['import_app']['median_ms']
+    print(f"import app: {median} ms (budget {args.budget_ms} ms)", file=sys.stderr)
+    if median > args.budget_ms:
+        print(f"Import time budget exceeded: {median} ms > {args.budget_ms} ms", file=sys.stderr)
+        ok = False
+    if loaded:
+        print(f"Imported on startup, must be loaded lazily: {', '.join(sorted(loaded))}", file=sys.stderr)
+        ok = False
+    if results['database_opened']:
+        print("Importing the app opened the database", file=sys.stderr)
+        ok = False
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if not compare(results, baseline, args.max_regression):
+            ok = False
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,240 @@
+"""Benchmark suite for page rendering, imports and aggregates
+
+Generates a synthetic inventory in a temporary SQLite database (or uses the
+database given with --database), times the main code paths and writes the
+results as JSON. The DigiKey API is stubbed, so no network access is needed.
+
+Two result files, e.g. from two commits, can be compared; the comparison fails
+if a case got slower than --max-regression allows.
+
+Usage:
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --output after.json --compare before.json [--max-regression 0.2]
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from benchmarks.synthetic import add_arguments, generate_inventory
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', help='Existing database URI (default: new synthetic SQLite database)')
+    parser.add_argument('--repeat', type=int, default=10, help='Timed runs per case')
+    parser.add_argument('--import-rows', type=int, default=200, help='Rows of the imported BOMs')
+    parser.add_argument('--cases', help='Comma-separated names of the cases to run (default: all)')
+    parser.add_argument('--output', help='Write the results to this JSON file (default: stdout)')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare with')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='Allowed slowdown of the median, e.g. 0.2 = 20%%')
+    parser.add_argument('--verbose', action='store_true', help='Keep the application log output')
+    add_arguments(parser)
+    return parser.parse_args()
+
+def measure(run, repeat, setup=None):
+    """Times run() repeat times after one warm-up run, setup() is not timed
+
+    Returns:
+        dict: Timing statistics in milliseconds
+    """
+    timings = []
+    for i in range(repeat + 1):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        run()
+        elapsed = (time.perf_counter() - start) * 1000
+        if i > 0:
+            timings.append(elapsed)
+    return summarize(timings)
+
+def summarize(timings):
+    """Statistics of timings in milliseconds"""
+    timings = sorted(timings)
+    return {
+        'runs': len(timings),
+        'min_ms': round(timings[0], 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'max_ms': round(timings[-1], 3)
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def define_cases(smd_app, inventory, args):
+    """Returns {name: (run, setup)} of all benchmark cases"""
+    from models import db, HardwareDevice
+    from fragments import fragment_cache
+    import helpers
+
+    app = smd_app.app
+    client = app.test_client()
+    part_ids = inventory['part_ids']
+    device_id = inventory['device_ids'][0]
+
+    def get(url):
+        def run():
+            response = client.get(url)
+            response.get_data()
+            assert response.status_code == 200, f"GET {url}: HTTP {response.status_code}"
+        return run
+
+    def in_app_context(function):
+        def run():
+            with app.app_context():
+                function()
+        return run
+
+    # Imports go into their own device, known parts are taken from the inventory
+    with app.app_context():
+        import_device = HardwareDevice(name='Benchmark Import')
+        db.session.add(import_device)
+        db.session.commit()
+        import_device_id = import_device.id
+
+    rows = min(args.import_rows, len(part_ids))
+    known_csv = 'DigiKey-No,Quantity\n' + '\n'.join(f'{i}-SYN-ND,2' for i in range(rows))
+    unknown_runs = iter(range(10 ** 9))
+
+    def import_csv(content):
+        with app.app_context():
+            device = db.session.get(HardwareDevice, import_device_id)
+            smd_app.process_bom_csv(io.BytesIO(content.encode()), device)
+
+    def import_unknown():
+        # New DigiKey numbers in every run, so the parts are always unknown
+        run = next(unknown_runs)
+        import_csv('DigiKey-No,Quantity\n' + '\n'.join(f'{i}-NEW{run}-ND,1' for i in range(rows)))
+
+    return {
+        'index_cold': (get('/'), fragment_cache.clear),
+        'index_warm': (get('/'), None),
+        'missing_parts': (get(f'/missing_parts/{device_id}'), None),
+        'search_local_digikey': (get('/search_digikey_by_mpn/1-SYN-ND'), None),
+        'search_local_mpn': (get('/search_digikey_by_mpn/SYN-0001'), None),
+        'import_known_parts': (lambda: import_csv(known_csv), None),
+        'import_unknown_parts': (import_unknown, None),
+        'part_status_map': (in_app_context(helpers.get_part_status_map), None),
+        'device_build_summary': (in_app_context(helpers.get_device_build_summary), None),
+        'devices_with_bom': (in_app_context(helpers.get_devices_with_bom), None),
+        'count_unassigned_parts': (in_app_context(helpers.count_unassigned_parts), None),
+        'part_devices_map': (in_app_context(helpers.get_part_devices_map), None)
+    }
+
+def compare(results, baseline, max_regression):
+    """Prints the median change of every case, returns False if a case regressed too much"""
+    ok = True
+    print(f"{'case':<28}{'before ms':>12}{'after ms':>12}{'change':>10}")
+    for name, stats in results['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if not before:
+            print(f"{name:<28}{'-':>12}{stats['median_ms']:>12.3f}{'new':>10}")
+            continue
+        change = (stats['median_ms'] - before['median_ms']) / before['median_ms'] if before['median_ms'] else 0.0
+        flag = ''
+        if change > max_regression:
+            flag = '  REGRESSION'
+            ok = False
+        print(f"{name:<28}{before['median_ms']:>12.3f}{stats['median_ms']:>12.3f}{change:>+10.1%}{flag}")
+    return ok
+
+def main():
+    args = parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+
+    database = args.database
+    if not database:
+        database = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='smd_bench_'), 'bench.db')}"
+    os.environ['DATABASE_URI'] = database
+
+    # Import only after the database URI is set
+    import app as smd_app
+    from models import db, SMDPart, HardwareDevice
+
+    # Stubbed DigiKey API
+    smd_app.fetch_digikey_product_info = lambda digikey_number: (f"MPN-{digikey_number}", "Imported part")
+    smd_app.search_digikey_keyword = lambda keyword, limit=10: []
+
+    with smd_app.app.app_context():
+        db.create_all()
+        if args.database:
+            inventory = {
+                'part_ids': list(db.session.execute(db.select(SMDPart.id)).scalars()),
+                'device_ids': list(db.session.execute(db.select(HardwareDevice.id)).scalars())
+            }
+        else:
+            inventory = generate_inventory(
+                args.parts, args.devices, args.bom_size, args.shared_ratio, args.shared_pool, args.seed
+            )
+
+    if not inventory['part_ids'] or not inventory['device_ids']:
+        print("The database needs at least one part and one device", file=sys.stderr)
+        return 1
+
+    cases = define_cases(smd_app, inventory, args)
+    selected = args.cases.split(',') if args.cases else list(cases)
+    unknown = [name for name in selected if name not in cases]
+    if unknown:
+        print(f"Unknown cases: {', '.join(unknown)}", file=sys.stderr)
+        return 1
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': 'custom' if args.database else 'synthetic sqlite',
+            'parameters': {
+                'parts': len(inventory['part_ids']),
+                'devices': len(inventory['device_ids']),
+                'bom_size': args.bom_size,
+                'shared_ratio': args.shared_ratio,
+                'shared_pool': args.shared_pool,
+                'seed': args.seed,
+                'repeat': args.repeat,
+                'import_rows': args.import_rows
+            }
+        },
+        'results': {}
+    }
+
+    for name in selected:
+        run, setup = cases[name]
+        results['results'][name] = measure(run, args.repeat, setup)
+        print(f"{name}: {results['results'][name]['median_ms']} ms", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if not compare(results, baseline, args.max_regression):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""Synthetic inventory generator
+
+Fills a database with parts, devices and BOMs of a configurable size. Each BOM
+takes a share of its entries (--shared-ratio) from a small pool of common parts
+(resistors, capacitors, ...) used by many devices, and the rest from the
+remaining parts, which are used by few devices.
+
+Usage:
+    python -m benchmarks.synthetic --database sqlite:///synthetic.db [--parts 5000] [--devices 50]
+"""
+import argparse
+import os
+import random
+
+# Rows per INSERT statement
+INSERT_BATCH = 5000
+
+def add_arguments(parser):
+    """Adds the generator options to an argument parser"""
+    parser.add_argument('--parts', type=int, default=5000, help='Number of parts')
+    parser.add_argument('--devices', type=int, default=50, help='Number of devices')
+    parser.add_argument('--bom-size', type=int, default=150, help='BOM entries per device')
+    parser.add_argument('--shared-ratio', type=float, default=0.3, help='Share of BOM entries taken from the common parts')
+    parser.add_argument('--shared-pool', type=float, default=0.05, help='Share of all parts that are common parts')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed, the same seed gives the same inventory')
+
+def generate_inventory(parts=5000, devices=50, bom_size=150, shared_ratio=0.3, shared_pool=0.05, seed=42):
+    """Inserts a synthetic inventory into the database of the current app context
+
+    Args:
+        parts (int): Number of parts
+        devices (int): Number of devices
+        bom_size (int): BOM entries per device (limited by the number of parts)
+        shared_ratio (float): Share of each BOM taken from the common parts
+        shared_pool (float): Share of all parts that are common parts
+        seed (int): Random seed
+
+    Returns:
+        dict: Numbers of generated rows and the IDs of parts and devices
+    """
+    from models import db, SMDPart, HardwareDevice, BOMEntry
+    from bom import refresh_missing_flat_boms
+
+    rng = random.Random(seed)
+
+    part_rows = [
+        {
+            'part_number': f'SYN-{i:06d}',
+            'description': f'Synthetic part {i}',
+            'digikey_number': f'{i}-SYN-ND',
+            'quantity': rng.randint(0, 500)
+        }
+        for i in range(parts)
+    ]
+    for start in range(0, len(part_rows), INSERT_BATCH):
+        db.session.execute(SMDPart.__table__.insert(), part_rows[start:start + INSERT_BATCH])
+
+    db.session.execute(HardwareDevice.__table__.insert(), [
+        {'name': f'Synthetic Device {i:04d}'} for i in range(devices)
+    ])
+    db.session.flush()
+
+    part_ids = list(db.session.execute(db.select(SMDPart.id).order_by(SMDPart.id)).scalars())
+    device_ids = list(db.session.execute(db.select(HardwareDevice.id).order_by(HardwareDevice.id)).scalars())
+
+    pool_size = max(1, int(len(part_ids) * shared_pool))
+    common, specific = part_ids[:pool_size], part_ids[pool_size:] or part_ids
+    size = min(bom_size, len(part_ids))
+
+    entry_rows = []
+    for device_id in device_ids:
+        shared_count = min(int(size * shared_ratio), len(common))
+        chosen = set(rng.sample(common, shared_count))
+        chosen.update(rng.sample(specific, min(size - shared_count, len(specific))))
+        entry_rows.extend(
+            {'smd_part_id': part_id, 'hardware_device_id': device_id, 'quantity_required': rng.randint(1, 10)}
+            for part_id in sorted(chosen)
+        )
+    for start in range(0, len(entry_rows), INSERT_BATCH):
+        db.session.execute(BOMEntry.__table__.insert(), entry_rows[start:start + INSERT_BATCH])
+
+    db.session.commit()
+    refresh_missing_flat_boms()
+
+    return {
+        'parts': len(part_ids),
+        'devices': len(device_ids),
+        'bom_entries': len(entry_rows),
+        'part_ids': part_ids,
+        'device_ids': device_ids
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', required=True, help='Database URI, e.g. sqlite:///synthetic.db')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URI'] = args.database
+
+    # Import only after the database URI is set
+    from app import app
+    from models import db
+
+    with app.app_context():
+        db.create_all()
+        result = generate_inventory(
+            args.parts, args.devices, args.bom_size, args.shared_ratio, args.shared_pool, args.seed
+        )
+    print(f"Generated {result['parts']} parts, {result['devices']} devices and {result['bom_entries']} BOM entries")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+import logging
+from sqlalchemy import select, delete, tuple_, func, literal, event
+from sqlalchemy.dialects import sqlite
+
+from models import db, SMDPart, HardwareDevice, BOMEntry, SubAssembly, FlatBOMEntry, RoutingSession
+from tracing import traced
+
+# Configure Logging
+logger = logging.getLogger('bom')
+
+# Upper bound for one batch of usage edits
+MAX_USAGE_BATCH = 1000
+
+# Maximum nesting depth of sub-assemblies during BOM explosion
+MAX_BOM_DEPTH = 20
+
+def dialect_insert(model):
+    """Returns an INSERT construct that supports ON CONFLICT for the current database"""
+    if db.engine.dialect.name == 'postgresql':
+        # Imported on first use, the dialect is not loaded for SQLite databases
+        from sqlalchemy.dialects import postgresql
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+def parse_usage_items(items):
+    """Validates a list of {part_id, device_id, qty_required} items
+
+    Returns:
+        tuple: (parsed items, list of errors) - invalid items only end up in the errors
+    """
+    parsed = []
+    errors = []
+
+    for index, item in enumerate(items):
+        try:
+            part_id = int(item.get('part_id'))
+            device_id = int(item.get('device_id'))
+            qty_required = int(item.get('qty_required', 0))
+        except (AttributeError, ValueError, TypeError):
+            errors.append({'index': index, 'success': False, 'message': 'Invalid parameter values'})
+            continue
+
+        if qty_required < 0:
+            errors.append({'index': index, 'success': False, 'message': 'Quantity must not be negative'})
+            continue
+
+        parsed.append({
+            'index': index,
+            'part_id': part_id,
+            'device_id': device_id,
+            'qty_required': qty_required
+        })
+
+    return parsed, errors
+
+def apply_usage_batch(items):
+    """Upserts and deletes many BOM entries in a single transaction
+
+    Existence of parts and devices is checked with one query each. Entries with a
+    quantity > 0 are upserted through the unique (part, device) index, entries with
+    a quantity of 0 are deleted.
+
+    Args:
+        items (list): Parsed items from parse_usage_items
+
+    Returns:
+        list: One result dictionary per item
+    """
+    part_ids = {item['part_id'] for item in items}
+    device_ids = {item['device_id'] for item in items}
+
+    existing_parts = set(db.session.execute(
+        select(SMDPart.id).where(SMDPart.id.in_(part_ids))
+    ).scalars()) if part_ids else set()
+    existing_devices = set(db.session.execute(
+        select(HardwareDevice.id).where(HardwareDevice.id.in_(device_ids))
+    ).scalars()) if device_ids else set()
+
+    results = []
+    # The last edit for a (part, device) pair wins
+    changes = {}
+    for item in items:
+        if item['part_id'] not in existing_parts or item['device_id'] not in existing_devices:
+            results.append({'index': item['index'], 'success': False, 'message': 'Part or device not found'})
+            continue
+        changes[(item['part_id'], item['device_id'])] = item
+
+    if changes:
+        existing_pairs = set(db.session.execute(
+            select(BOMEntry.smd_part_id, BOMEntry.hardware_device_id)
+            .where(tuple_(BOMEntry.smd_part_id, BOMEntry.hardware_device_id).in_(list(changes.keys())))
+        ).tuples())
+
+        upserts = [
+            {'smd_part_id': part_id, 'hardware_device_id': device_id, 'quantity_required': item['qty_required']}
+            for (part_id, device_id), item in changes.items() if item['qty_required'] > 0
+        ]
+        deletions = [pair for pair, item in changes.items() if item['qty_required'] <= 0 and pair in existing_pairs]
+
+        if upserts:
+            stmt = dialect_insert(BOMEntry)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[BOMEntry.smd_part_id, BOMEntry.hardware_device_id],
+                set_={'quantity_required': stmt.excluded.quantity_required}
+            )
+            db.session.execute(stmt, upserts)
+
+        if deletions:
+            db.session.execute(
+                delete(BOMEntry)
+                .where(tuple_(BOMEntry.smd_part_id, BOMEntry.hardware_device_id).in_(deletions))
+                .execution_options(synchronize_session=False)
+            )
+
+        mark_bom_changed({device_id for _, device_id in changes})
+        db.session.commit()
+        logger.info(f"Applied usage batch: {len(upserts)} upserts, {len(deletions)} deletions")
+
+        for pair, item in changes.items():
+            if item['qty_required'] > 0:
+                action = 'updated' if pair in existing_pairs else 'created'
+            else:
+                action = 'deleted' if pair in existing_pairs else 'unchanged'
+
+            results.append({
+                'index': item['index'],
+                'success': True,
+                'part_id': item['part_id'],
+                'device_id': item['device_id'],
+                'new_qty': item['qty_required'],
+                'action': action
+            })
+
+    # Report superseded duplicates as well, so every item has a result
+    reported = {result['index'] for result in results}
+    for item in items:
+        if item['index'] not in reported:
+            results.append({'index': item['index'], 'success': True, 'message': 'Superseded by a later edit in this batch'})
+
+    return sorted(results, key=lambda result: result['index'])
+
+def explosion_cte(device_ids):
+    """Recursive CTE with every device reachable from the given root devices
+
+    Each row holds the root device, a (sub-)device in its tree and how many units
+    of that sub-device one unit of the root contains. A sub-assembly used on
+    several paths appears once per path, so the multipliers add up correctly.
+    """
+    tree = select(
+        HardwareDevice.id.label('root_id'),
+        HardwareDevice.id.label('device_id'),
+        literal(1).label('multiplier'),
+        literal(0).label('depth')
+    ).where(HardwareDevice.id.in_(device_ids)).cte('bom_tree', recursive=True)
+    
+    return tree.union_all(
+        select(
+            tree.c.root_id,
+            SubAssembly.child_device_id,
+            tree.c.multiplier * SubAssembly.quantity_required,
+            tree.c.depth + 1
+        ).join(
+            SubAssembly, SubAssembly.parent_device_id == tree.c.device_id
+        ).where(tree.c.depth < MAX_BOM_DEPTH)
+    )
+
+def exploded_bom_query(device_ids):
+    """Total required quantity of every part per root device, across all levels"""
+    tree = explosion_cte(device_ids)
+    return select(
+        tree.c.root_id,
+        BOMEntry.smd_part_id,
+        func.sum(tree.c.multiplier * BOMEntry.quantity_required)
+    ).join(
+        BOMEntry, BOMEntry.hardware_device_id == tree.c.device_id
+    ).where(
+        BOMEntry.quantity_required > 0
+    ).group_by(tree.c.root_id, BOMEntry.smd_part_id)
+
+def get_ancestor_ids(device_ids):
+    """Returns all devices that contain one of the given devices on any level"""
+    if not device_ids:
+        return set()
+    
+    ancestors = select(SubAssembly.parent_device_id.label('device_id'))\
+        .where(SubAssembly.child_device_id.in_(device_ids))\
+        .cte('bom_ancestors', recursive=True)
+    ancestors = ancestors.union(
+        select(SubAssembly.parent_device_id)
+        .join(ancestors, SubAssembly.child_device_id == ancestors.c.device_id)
+    )
+    
+    return set(db.session.execute(select(ancestors.c.device_id)).scalars())
+
+def get_descendant_ids(device_id):
+    """Returns all sub-assemblies of a device on any level"""
+    descendants = select(SubAssembly.child_device_id.label('device_id'))\
+        .where(SubAssembly.parent_device_id == device_id)\
+        .cte('bom_descendants', recursive=True)
+    descendants = descendants.union(
+        select(SubAssembly.child_device_id)
+        .join(descendants, SubAssembly.parent_device_id == descendants.c.device_id)
+    )
+    
+    return set(db.session.execute(select(descendants.c.device_id)).scalars())
+
+@traced()
+def refresh_flat_boms(device_ids):
+    """Rebuilds the flattened BOMs of the given devices and of all devices containing them
+
+    The explosion runs as one INSERT ... SELECT over the recursive CTE, so the
+    number of queries does not depend on the nesting depth.
+
+    Returns:
+        int: Number of refreshed devices
+    """
+    device_ids = set(device_ids)
+    if not device_ids:
+        return 0
+    
+    device_ids |= get_ancestor_ids(device_ids)
+    
+    db.session.execute(
+        delete(FlatBOMEntry)
+        .where(FlatBOMEntry.hardware_device_id.in_(device_ids))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        FlatBOMEntry.__table__.insert().from_select(
+            ['hardware_device_id', 'smd_part_id', 'quantity_required'],
+            exploded_bom_query(device_ids)
+        )
+    )
+    
+    # Consumers of the data versions see which devices changed
+    db.session.info.setdefault('changed_devices', set()).update(device_ids)
+    
+    logger.info(f"Refreshed flattened BOMs of {len(device_ids)} devices")
+    return len(device_ids)
+
+def refresh_missing_flat_boms():
+    """Builds the flattened BOMs of devices that have none yet (e.g. after an upgrade)"""
+    flattened = select(FlatBOMEntry.hardware_device_id)
+    device_ids = set(db.session.execute(
+        select(BOMEntry.hardware_device_id).where(~BOMEntry.hardware_device_id.in_(flattened))
+        .union(select(SubAssembly.parent_device_id).where(~SubAssembly.parent_device_id.in_(flattened)))
+    ).scalars())
+    
+    refreshed = refresh_flat_boms(device_ids)
+    db.session.commit()
+    return refreshed
+
+def mark_bom_changed(device_ids):
+    """Marks the flattened BOMs of devices as stale; they are rebuilt before the next commit
+
+    Changes made through the unit of work are detected automatically, this is only
+    needed for bulk statements that bypass it.
+    """
+    db.session.info.setdefault('bom_changed', set()).update(device_ids)
+
+@event.listens_for(RoutingSession, 'after_flush')
+def collect_bom_changes(session, flush_context):
+    """Collects the devices whose BOM or sub-assemblies changed in this flush"""
+    changed = session.info.setdefault('bom_changed', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, BOMEntry):
+            changed.add(obj.hardware_device_id)
+        elif isinstance(obj, SubAssembly):
+            changed.add(obj.parent_device_id)
+
+@event.listens_for(RoutingSession, 'before_commit')
+def refresh_changed_boms(session):
+    """Invalidates and rebuilds the flattened BOMs affected by this transaction"""
+    if session.info.get('read_only'):
+        return
+    
+    session.flush()
+    changed = session.info.pop('bom_changed', None)
+    changed = {device_id for device_id in changed or () if device_id is not None}
+    if changed:
+        refresh_flat_boms(changed)
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def discard_bom_changes(session):
+    """Forgets pending invalidations of a rolled back transaction"""
+    session.info.pop('bom_changed', None)
+
+def set_sub_assembly(parent_id, child_id, quantity):
+    """Adds, updates or (quantity 0) removes a sub-assembly of a device
+
+    Returns:
+        tuple: (success, action or error message)
+    """
+    if parent_id == child_id:
+        return False, 'A device cannot contain itself'
+    
+    link = SubAssembly.query.filter_by(parent_device_id=parent_id, child_device_id=child_id).first()
+    
+    if quantity <= 0:
+        if not link:
+            return True, 'unchanged'
+        db.session.delete(link)
+        db.session.commit()
+        return True, 'deleted'
+    
+    if link:
+        link.quantity_required = quantity
+        action = 'updated'
+    else:
+        # The new link must not close a cycle
+        if parent_id in get_descendant_ids(child_id):
+            return False, 'Sub-assembly would create a cycle'
+        db.session.add(SubAssembly(parent_device_id=parent_id, child_device_id=child_id, quantity_required=quantity))
+        action = 'created'
+    
+    db.session.commit()
+    return True, action
+
+def replace_sub_assemblies(parent_id, quantities):
+    """Replaces all sub-assemblies of a device (used by the BOM import)
+
+    Args:
+        parent_id (int): ID of the parent device
+        quantities (dict): child device ID -> quantity
+
+    Returns:
+        list: Child device IDs that were rejected because they would create a cycle
+    """
+    SubAssembly.query.filter_by(parent_device_id=parent_id).delete()
+    mark_bom_changed([parent_id])
+    
+    rejected = []
+    for child_id, quantity in quantities.items():
+        if child_id == parent_id or parent_id in get_descendant_ids(child_id):
+            rejected.append(child_id)
+            continue
+        db.session.add(SubAssembly(parent_device_id=parent_id, child_device_id=child_id, quantity_required=quantity))
+        # Flush, so the cycle check of the next link sees this one
+        db.session.flush()
+    
+    return rejected
@@ -0,0 +1,147 @@
+import logging
+from sqlalchemy import select, update, delete, func, literal
+from sqlalchemy.orm import aliased
+
+from models import db, SMDPart, HardwareDevice, BOMEntry, SubAssembly, Reservation, ReservedStock
+from bom import dialect_insert, mark_bom_changed, get_ancestor_ids
+from versions import mark_parts_changed, mark_devices_changed
+
+# Configure Logging
+logger = logging.getLogger('bulk')
+
+# Upper bound for the number of IDs in one bulk request
+MAX_BULK_IDS = 1000
+
+def parse_id_list(values):
+    """Validates a non-empty list of integer IDs
+
+    Returns:
+        tuple: (is_valid, sorted unique IDs or error message)
+    """
+    if not isinstance(values, list) or not values:
+        return False, 'Expected a non-empty list of IDs'
+
+    if len(values) > MAX_BULK_IDS:
+        return False, f'Too many IDs (max. {MAX_BULK_IDS})'
+
+    try:
+        ids = sorted({int(value) for value in values})
+    except (ValueError, TypeError):
+        return False, 'Invalid ID values'
+
+    return True, ids
+
+def count_rows(model, *criteria):
+    """Counts the rows of a model matching the criteria"""
+    return db.session.execute(select(func.count()).select_from(model).where(*criteria)).scalar()
+
+def delete_parts(part_ids):
+    """Deletes many parts with one statement in one transaction
+
+    BOM entries, flattened BOM entries, reservations, reserved totals and ledger
+    rows of the parts are removed by ON DELETE CASCADE. The counts of dependent
+    rows are taken before the delete, since cascades do not report them.
+
+    Returns:
+        dict: Affected row counts
+    """
+    counts = {
+        'bom_entries': count_rows(BOMEntry, BOMEntry.smd_part_id.in_(part_ids)),
+        'reservations': count_rows(Reservation, Reservation.smd_part_id.in_(part_ids))
+    }
+    counts['parts'] = db.session.execute(
+        delete(SMDPart).where(SMDPart.id.in_(part_ids)).execution_options(synchronize_session=False)
+    ).rowcount
+
+    mark_parts_changed(part_ids)
+    db.session.commit()
+    logger.info(f"Bulk deleted {counts['parts']} parts")
+    return counts
+
+def delete_devices(device_ids):
+    """Deletes many devices with one statement in one transaction
+
+    BOM entries, sub-assembly links, flattened BOMs and reservations of the
+    devices are removed by ON DELETE CASCADE. The reserved totals are reduced
+    beforehand and devices that contained a deleted device get a new flattened BOM.
+
+    Returns:
+        dict: Affected row counts
+    """
+    in_devices = Reservation.hardware_device_id.in_(device_ids)
+    counts = {
+        'bom_entries': count_rows(BOMEntry, BOMEntry.hardware_device_id.in_(device_ids)),
+        'sub_assemblies': count_rows(
+            SubAssembly,
+            SubAssembly.parent_device_id.in_(device_ids) | SubAssembly.child_device_id.in_(device_ids)
+        ),
+        'reservations': count_rows(Reservation, in_devices)
+    }
+
+    # Devices containing a deleted one need a new flattened BOM
+    mark_bom_changed(get_ancestor_ids(device_ids) - set(device_ids))
+
+    # Keep the reserved totals in line with the cascaded reservations
+    totals = ReservedStock.__table__
+    released = select(func.sum(Reservation.quantity))\
+        .where(in_devices, Reservation.smd_part_id == totals.c.smd_part_id)\
+        .scalar_subquery()
+    db.session.execute(
+        update(totals)
+        .where(totals.c.smd_part_id.in_(select(Reservation.smd_part_id).where(in_devices)))
+        .values(quantity=totals.c.quantity - released)
+    )
+    db.session.execute(delete(totals).where(totals.c.quantity <= 0))
+
+    counts['devices'] = db.session.execute(
+        delete(HardwareDevice).where(HardwareDevice.id.in_(device_ids)).execution_options(synchronize_session=False)
+    ).rowcount
+
+    mark_devices_changed(device_ids)
+    db.session.commit()
+    logger.info(f"Bulk deleted {counts['devices']} devices")
+    return counts
+
+def reassign_usages(from_device_id, to_device_id, part_ids=None):
+    """Moves BOM usages from one device to another in one transaction
+
+    The usages are upserted into the target device (quantities are added if the
+    target already uses a part) and then deleted from the source device.
+
+    Args:
+        from_device_id (int): Source device
+        to_device_id (int): Target device
+        part_ids (list): Only move these parts (all if None)
+
+    Returns:
+        dict: Affected row counts
+    """
+    moved = BOMEntry.hardware_device_id == from_device_id
+    if part_ids is not None:
+        moved = moved & BOMEntry.smd_part_id.in_(part_ids)
+
+    target = aliased(BOMEntry)
+    counts = {
+        'merged': count_rows(BOMEntry, moved, BOMEntry.smd_part_id.in_(
+            select(target.smd_part_id).where(target.hardware_device_id == to_device_id)
+        ))
+    }
+
+    stmt = dialect_insert(BOMEntry).from_select(
+        ['smd_part_id', 'hardware_device_id', 'quantity_required'],
+        select(BOMEntry.smd_part_id, literal(to_device_id), BOMEntry.quantity_required)
+        .where(moved)
+    )
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[BOMEntry.smd_part_id, BOMEntry.hardware_device_id],
+        set_={'quantity_required': BOMEntry.__table__.c.quantity_required + stmt.excluded.quantity_required}
+    ))
+
+    counts['moved'] = db.session.execute(
+        delete(BOMEntry).where(moved).execution_options(synchronize_session=False)
+    ).rowcount
+
+    mark_bom_changed([from_device_id, to_device_id])
+    db.session.commit()
+    logger.info(f"Moved {counts['moved']} usages from device {from_device_id} to {to_device_id}")
+    return counts
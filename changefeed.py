@@ -0,0 +1,323 @@
+"""Live change feed: pushes inventory deltas to open pages with Server-Sent Events
+
+Every commit reports its changed scopes and parts (see versions.on_data_change).
+A background thread turns them into a small delta (stock, status class and
+buildable units of the affected rows, computed once per change) and publishes it:
+
+- with Redis, on a pub/sub channel; every worker process subscribes to it and
+  forwards the messages to its own clients, so changes made in one worker reach
+  the pages connected to all others
+- without Redis, directly to the clients of the own process (single worker)
+
+Pages subscribe with EventSource('/api/changes') and patch their rows in place.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from flask import Response, request
+from sqlalchemy import select
+
+from models import db, HardwareDevice, FlatBOMEntry, read_only
+from helpers import get_inventory_delta
+from metrics import Collector
+from versions import on_data_change, get_versions, scope_device_ids, GLOBAL_SCOPE, PARTS_SCOPE
+
+# Configure Logging
+logger = logging.getLogger('changefeed')
+
+# Set to False to disable the live updates
+CHANGE_FEED_ENABLED = os.environ.get('CHANGE_FEED_ENABLED', 'True').lower() == 'true'
+# Use Redis pub/sub to reach the clients of all worker processes
+CHANGE_FEED_REDIS = os.environ.get('CHANGE_FEED_REDIS', 'True').lower() == 'true'
+CHANGE_FEED_CHANNEL = os.environ.get('CHANGE_FEED_CHANNEL', 'smd:inventory-changes')
+# Threads per worker process (gunicorn --threads, the Docker image passes this value)
+GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', 32))
+# Threads kept free for regular requests when all feeds are open
+CHANGE_FEED_RESERVED_THREADS = max(4, GUNICORN_THREADS // 4)
+# Open feeds per worker process, each one holds a worker thread
+CHANGE_FEED_MAX_CLIENTS = int(os.environ.get('CHANGE_FEED_MAX_CLIENTS', max(1, GUNICORN_THREADS - CHANGE_FEED_RESERVED_THREADS)))
+# Changes of more parts are announced as "reload" instead of a delta
+CHANGE_FEED_MAX_PARTS = int(os.environ.get('CHANGE_FEED_MAX_PARTS', 500))
+
+# A comment line is sent when nothing happened for this long, so proxies keep
+# the connection open and closed connections are noticed
+KEEPALIVE_SECONDS = 15
+# Streams end after this time and the browser reconnects, so threads are recycled
+MAX_STREAM_SECONDS = 600
+# Reconnection delay of the browser (milliseconds)
+RETRY_MILLISECONDS = 3000
+# Messages queued per client, a client that falls further behind is disconnected
+CLIENT_QUEUE_SIZE = 100
+
+class Subscriber:
+    """Message queue of one connected client"""
+
+    def __init__(self):
+        self.messages = queue.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.overflowed = False
+
+class ChangeBroker:
+    """Fans messages out to the clients connected to this process"""
+
+    def __init__(self, max_clients):
+        self.max_clients = max_clients
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    def subscribe(self):
+        """Returns a new Subscriber, or None if the client limit is reached"""
+        with self.lock:
+            if len(self.subscribers) >= self.max_clients:
+                return None
+            subscriber = Subscriber()
+            self.subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def broadcast(self, message):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.messages.put_nowait(message)
+            except queue.Full:
+                subscriber.overflowed = True
+
+broker = ChangeBroker(CHANGE_FEED_MAX_CLIENTS)
+
+Collector(
+    'smd_change_feed_clients', 'Open change feed connections of this process', 'gauge',
+    lambda: {(): len(broker)}
+)
+
+def format_event(event, data):
+    """One Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+def build_change_event(scopes, part_ids):
+    """Turns committed changes into the payload sent to the clients
+
+    Parts of changed devices (BOM edits, builds, reservations) are included,
+    their status depends on the device's requirements.
+
+    Returns:
+        dict: Delta as returned by get_inventory_delta plus the removed parts and
+              devices and the global data version; {'reload': True, ...} if the
+              change is too large or its parts are unknown; None if nothing visible changed
+    """
+    device_ids = scope_device_ids(scopes)
+    part_ids = set(part_ids)
+    if device_ids:
+        part_ids.update(db.session.execute(
+            select(FlatBOMEntry.smd_part_id).where(FlatBOMEntry.hardware_device_id.in_(device_ids))
+        ).scalars())
+
+    version = get_versions([GLOBAL_SCOPE])[GLOBAL_SCOPE][0]
+    if not part_ids and not device_ids:
+        # Bulk part changes without a mark cannot be patched in place
+        return {'version': version, 'reload': True} if PARTS_SCOPE in scopes else None
+    if len(part_ids) > CHANGE_FEED_MAX_PARTS:
+        return {'version': version, 'reload': True}
+
+    delta = get_inventory_delta(part_ids, device_ids)
+    existing_devices = set(db.session.execute(
+        select(HardwareDevice.id).where(HardwareDevice.id.in_(device_ids))
+    ).scalars()) if device_ids else set()
+
+    removed_devices = device_ids - existing_devices
+    delta['devices'] = [device for device in delta['devices'] if device['id'] not in removed_devices]
+    delta['removed_devices'] = sorted(removed_devices)
+    delta['removed_parts'] = sorted(part_ids - {part['id'] for part in delta['parts']})
+    delta['version'] = version
+    return delta
+
+def connect_redis(socket_timeout=None):
+    import redis
+    return redis.Redis(
+        host=os.environ.get('REDIS_HOST', 'localhost'),
+        port=int(os.environ.get('REDIS_PORT', 6379)),
+        db=int(os.environ.get('REDIS_DB', 0)),
+        socket_connect_timeout=2,
+        socket_timeout=socket_timeout
+    )
+
+class ChangeFeed:
+    """Collects committed changes and publishes their deltas from a background thread"""
+
+    def __init__(self):
+        self.app = None
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.publisher = None
+        self.listener = None
+        self.redis = None
+        self.redis_checked = False
+
+    def init_app(self, app):
+        self.app = app
+        on_data_change(self.notify)
+
+    def get_redis(self):
+        """Redis client for the pub/sub channel, None if Redis is not available
+
+        Connects on first use, so importing the app does not wait for Redis.
+        """
+        with self.lock:
+            if self.redis_checked or not CHANGE_FEED_REDIS:
+                return self.redis
+            self.redis_checked = True
+            try:
+                import redis
+            except ImportError:
+                return None
+            try:
+                client = connect_redis(socket_timeout=5)
+                client.ping()
+                self.redis = client
+                logger.info(f"Change feed uses Redis channel {CHANGE_FEED_CHANNEL}")
+            except redis.exceptions.RedisError as e:
+                logger.info(f"Change feed without Redis, local clients only: {str(e)}")
+            return self.redis
+
+    def start_thread(self, name, target):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        return thread
+
+    def notify(self, scopes, part_ids):
+        """Data change callback, runs in the committing thread and only queues the change"""
+        if self.get_redis() is None and not len(broker):
+            return
+        self.pending.put((scopes, part_ids))
+        with self.lock:
+            if self.publisher is None:
+                self.publisher = self.start_thread('change-feed-publisher', self.publish_changes)
+
+    def has_clients(self):
+        client = self.get_redis()
+        if client is None:
+            return bool(len(broker))
+        import redis
+        try:
+            return bool(client.pubsub_numsub(CHANGE_FEED_CHANNEL)[0][1])
+        except redis.exceptions.RedisError:
+            return True
+
+    def publish_changes(self):
+        while True:
+            scopes, part_ids = self.pending.get()
+            scopes, part_ids = set(scopes), set(part_ids)
+            # Commits in quick succession (e.g. an import) are sent as one delta
+            while True:
+                try:
+                    more_scopes, more_parts = self.pending.get_nowait()
+                except queue.Empty:
+                    break
+                scopes |= more_scopes
+                part_ids |= more_parts
+
+            try:
+                if not self.has_clients():
+                    continue
+                with self.app.app_context(), read_only():
+                    data = build_change_event(scopes, part_ids)
+                if data is not None:
+                    self.publish(format_event('inventory', data))
+            except Exception as e:
+                logger.error(f"Error publishing inventory changes: {str(e)}")
+
+    def publish(self, message):
+        client = self.get_redis()
+        if client is not None:
+            import redis
+            try:
+                client.publish(CHANGE_FEED_CHANNEL, message)
+                return
+            except redis.exceptions.RedisError as e:
+                logger.error(f"Error publishing to Redis, local clients only: {str(e)}")
+        broker.broadcast(message)
+
+    def ensure_listener(self):
+        """Starts forwarding the Redis channel to the local clients (once per process)"""
+        if self.get_redis() is None:
+            return
+        with self.lock:
+            if self.listener is None:
+                self.listener = self.start_thread('change-feed-listener', self.listen)
+
+    def listen(self):
+        import redis
+        while True:
+            try:
+                # Own connection without read timeout, the channel may be quiet for hours
+                pubsub = connect_redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANGE_FEED_CHANNEL)
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        broker.broadcast(message['data'].decode('utf-8'))
+            except redis.exceptions.RedisError as e:
+                logger.error(f"Change feed lost the Redis connection: {str(e)}")
+                time.sleep(RETRY_MILLISECONDS / 1000)
+
+change_feed = ChangeFeed()
+
+def stream_changes(subscriber, version):
+    """Event stream of one client, ends after MAX_STREAM_SECONDS"""
+    try:
+        yield f"retry: {RETRY_MILLISECONDS}\n"
+        # The client compares the version with the last one it saw to detect missed changes
+        yield format_event('hello', {'version': version})
+        deadline = time.monotonic() + MAX_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            try:
+                yield subscriber.messages.get(timeout=KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+            if subscriber.overflowed:
+                # Changes were dropped, the page has to be reloaded
+                yield format_event('inventory', {'reload': True})
+                return
+    finally:
+        broker.unsubscribe(subscriber)
+
+def init_change_feed(app):
+    """Registers the change feed route (/api/changes) and the commit callback"""
+    if not CHANGE_FEED_ENABLED:
+        return
+
+    if CHANGE_FEED_MAX_CLIENTS > GUNICORN_THREADS - CHANGE_FEED_RESERVED_THREADS:
+        logger.warning(f"CHANGE_FEED_MAX_CLIENTS={CHANGE_FEED_MAX_CLIENTS} leaves less than {CHANGE_FEED_RESERVED_THREADS} "
+                       f"of {GUNICORN_THREADS} worker threads for regular requests")
+
+    change_feed.init_app(app)
+
+    # Server-Sent Events with the inventory deltas of all commits
+    @app.route('/api/changes')
+    def api_changes():
+        subscriber = broker.subscribe()
+        if subscriber is None:
+            return Response('Too many change feed clients', status=503, headers={'Retry-After': '60'})
+        change_feed.ensure_listener()
+
+        try:
+            version = get_versions([GLOBAL_SCOPE])[GLOBAL_SCOPE][0]
+        except Exception as e:
+            broker.unsubscribe(subscriber)
+            logger.error(f"Error opening change feed: {str(e)}")
+            return Response(f"Error: {str(e)}", status=500)
+
+        logger.info(f"Change feed opened by {request.remote_addr} ({len(broker)} clients)")
+        # No stream_with_context: the stream must not hold the request's database session
+        return Response(stream_changes(subscriber, version), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
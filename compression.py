@@ -0,0 +1,179 @@
+import gzip
+import logging
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from flask import request
+
+from metrics import CACHE_REQUESTS
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Configure Logging
+logger = logging.getLogger('compression')
+
+# Set to False to disable compression, e.g. if a reverse proxy compresses already
+COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', 'True').lower() == 'true'
+# Smaller bodies are sent uncompressed, the overhead is not worth it
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+# Memory for compressed variants of ETagged responses (bytes)
+COMPRESS_CACHE_BYTES = int(os.environ.get('COMPRESS_CACHE_BYTES', 32 * 1024 * 1024))
+
+# Streamed output is flushed to the client after this many uncompressed bytes
+STREAM_FLUSH_BYTES = 16 * 1024
+
+GZIP_LEVEL = 6
+# Brotli quality: 5 compresses better than gzip -6 at a similar speed
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml'
+}
+
+class CompressedVariantCache:
+    """Thread-safe LRU cache of compressed bodies, limited by their total size"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+            return body
+
+    def set(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+variant_cache = CompressedVariantCache(COMPRESS_CACHE_BYTES)
+
+def choose_encoding(accept_encodings):
+    """Best supported content coding accepted by the client ('br', 'gzip' or None)"""
+    candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best = None
+    best_quality = 0
+    for encoding in candidates:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+def compress_stream(chunks, encoding):
+    """Compresses an iterable incrementally
+
+    The output is flushed every STREAM_FLUSH_BYTES of input, so the client
+    receives data while the response is generated; flushing every small chunk
+    (e.g. every CSV row) would ruin the compression ratio.
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        process, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        process, finish = compressor.compress, compressor.flush
+        flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    pending = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = process(chunk)
+        pending += len(chunk)
+        if pending >= STREAM_FLUSH_BYTES:
+            data += flush()
+            pending = 0
+        if data:
+            yield data
+    yield finish()
+
+def is_compressible(response):
+    return (
+        request.method != 'HEAD'
+        and response.status_code == 200
+        and 'Content-Encoding' not in response.headers
+        and response.mimetype in COMPRESSIBLE_TYPES
+    )
+
+def init_compression(app):
+    """Registers the response compression (brotli or gzip, negotiated per request)
+
+    Complete bodies below COMPRESS_MIN_SIZE are sent uncompressed. Streamed
+    responses are compressed chunk by chunk. Compressed bodies of responses with
+    an ETag are cached, so unchanged pages and static files are compressed once.
+    """
+    if not COMPRESSION_ENABLED:
+        return
+
+    @app.after_request
+    def compress_response(response):
+        if response.status_code == 304:
+            # Same validator as the compressed 200 response the client holds
+            etag, weak = response.get_etag()
+            if etag and not weak and choose_encoding(request.accept_encodings):
+                response.set_etag(etag, weak=True)
+            return response
+
+        if not is_compressible(response):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings)
+        if not encoding:
+            return response
+
+        etag, _ = response.get_etag()
+        if response.is_streamed and not response.direct_passthrough:
+            response.response = compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            if response.content_length is not None and response.content_length < COMPRESS_MIN_SIZE:
+                return response
+            # Static files are sent as file wrappers, read them for compression
+            original = response.response
+            response.direct_passthrough = False
+
+            key = (request.full_path, etag, encoding) if etag else None
+            body = variant_cache.get(key) if key else None
+            if key:
+                CACHE_REQUESTS.inc(cache='compression', result='miss' if body is None else 'hit')
+
+            if body is None:
+                data = response.get_data()
+                if len(data) < COMPRESS_MIN_SIZE:
+                    return response
+                body = compress(data, encoding)
+                if key:
+                    variant_cache.set(key, body)
+            response.set_data(body)
+            if hasattr(original, 'close'):
+                original.close()
+
+        response.headers['Content-Encoding'] = encoding
+        # The compressed body is a different representation of the same data
+        if etag:
+            response.set_etag(etag, weak=True)
+        return response
@@ -1,4 +1,3 @@
-import requests
 import json
 import base64
 import time
@@ -7,9 +6,13 @@ import urllib.parse
 import os
 from functools import lru_cache
 import threading
-import redis
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from metrics import DIGIKEY_REQUEST_DURATION, DIGIKEY_RATE_LIMIT_WAIT, DIGIKEY_RATE_LIMIT_WAITS, CACHE_REQUESTS, Collector
+from profiling import record_call
+from tracing import span, traced, propagate, set_span_attribute, KIND_CLIENT
+
 # Configure Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('digikey_api')
@@ -19,22 +22,48 @@ DIGIKEY_CLIENT_ID = os.environ.get('DIGIKEY_CLIENT_ID', "xJXLW87QHd1YqO92iEKmRmh
 DIGIKEY_CLIENT_SECRET = os.environ.get('DIGIKEY_CLIENT_SECRET', "43KtoCkbkpv90fJu")
 DIGIKEY_AUTH_URL = "https://api.digikey.com/v1/oauth2/token"
 DIGIKEY_PRODUCT_DETAILS_URL = "https://api.digikey.com/products/v4/search/{product_number}/productdetails"
+# Currency requested from the API (X-DIGIKEY-Locale-Currency), prices are in this currency
+DIGIKEY_CURRENCY = "EUR"
 
-# Redis connection for better caching, if available
-try:
-    redis_client = redis.Redis(
-        host=os.environ.get('REDIS_HOST', 'localhost'),
-        port=int(os.environ.get('REDIS_PORT', 6379)),
-        db=int(os.environ.get('REDIS_DB', 0)),
-        socket_timeout=5
-    )
-    # Test the connection
-    redis_client.ping()
-    USE_REDIS = True
-    logger.info("Redis cache enabled")
-except (redis.exceptions.ConnectionError, ImportError):
-    USE_REDIS = False
-    logger.info("Redis cache disabled, using in-memory cache")
+# Parallel API lookups of uncached prices (the rate limiter still applies)
+PRICING_WORKERS = 4
+
+# Redis connection for better caching, opened on first use (None if not available)
+REDIS_CLIENT = None
+REDIS_CHECKED = False
+REDIS_LOCK = threading.Lock()
+
+def get_redis_client():
+    """Returns the Redis client, or None if Redis is not available
+
+    The connection is tested once, on first use, so importing the module
+    (and starting a worker) does not wait for Redis.
+    """
+    global REDIS_CLIENT, REDIS_CHECKED
+    with REDIS_LOCK:
+        if REDIS_CHECKED:
+            return REDIS_CLIENT
+        REDIS_CHECKED = True
+        try:
+            import redis
+        except ImportError:
+            logger.info("Redis cache disabled, using in-memory cache")
+            return None
+        try:
+            client = redis.Redis(
+                host=os.environ.get('REDIS_HOST', 'localhost'),
+                port=int(os.environ.get('REDIS_PORT', 6379)),
+                db=int(os.environ.get('REDIS_DB', 0)),
+                socket_connect_timeout=2,
+                socket_timeout=5
+            )
+            # Test the connection
+            client.ping()
+            REDIS_CLIENT = client
+            logger.info("Redis cache enabled")
+        except redis.exceptions.ConnectionError:
+            logger.info("Redis cache disabled, using in-memory cache")
+        return REDIS_CLIENT
 
 # Thread-safe token storage
 TOKEN_LOCK = threading.Lock()
@@ -61,12 +90,40 @@ def apply_rate_limiting():
             sleep_time = LAST_REQUEST_TIMES[0] + RATE_WINDOW - current_time
             if sleep_time > 0:
                 logger.info(f"Rate limit reached, sleeping for {sleep_time:.2f} seconds")
-                time.sleep(sleep_time)
+                wait_for_rate_limit(sleep_time, 'local')
                 current_time = time.time()  # Update time after waiting
                 
         # Add the current request
         LAST_REQUEST_TIMES.append(current_time)
 
+def wait_for_rate_limit(seconds, reason):
+    """Sleeps for the rate limiter and records the wait (reason: local or http_429)"""
+    DIGIKEY_RATE_LIMIT_WAITS.inc(reason=reason)
+    DIGIKEY_RATE_LIMIT_WAIT.inc(seconds, reason=reason)
+    with span('digikey.rate_limit_wait', reason=reason, seconds=round(seconds, 3)):
+        time.sleep(seconds)
+
+def timed_request(operation, method, url, **kwargs):
+    """Sends an API request and records its duration by operation and status code
+
+    The call is also added to the profile of the current request, if it is profiled.
+    """
+    # Imported on first use, it is one of the slowest imports of the app
+    import requests
+
+    start = time.perf_counter()
+    status = 'error'
+    try:
+        with span(f"digikey.http {operation}", KIND_CLIENT, **{'http.method': method, 'http.url': url}):
+            response = requests.request(method, url, **kwargs)
+            status = response.status_code
+            set_span_attribute('http.status_code', status)
+        return response
+    finally:
+        duration = time.perf_counter() - start
+        DIGIKEY_REQUEST_DURATION.observe(duration, operation=operation, status=status)
+        record_call('digikey', start, duration, operation=operation, method=method, url=url, status=status)
+
 # Function to check if a part number is a DigiKey number
 def is_digikey_part_number(part_number):
     """Checks if a part number is a DigiKey number."""
@@ -91,6 +148,7 @@ def is_digikey_part_number(part_number):
     return starts_with_digit_dash or has_pattern
 
 # Function to get an access token
+@traced('digikey.get_access_token')
 def get_digikey_access_token():
     global DIGIKEY_ACCESS_TOKEN, DIGIKEY_TOKEN_EXPIRY
     
@@ -98,10 +156,12 @@ def get_digikey_access_token():
         # Check if a valid token exists
         current_time = time.time()
         if DIGIKEY_ACCESS_TOKEN and current_time < DIGIKEY_TOKEN_EXPIRY:
+            set_span_attribute('digikey.token_source', 'memory')
             return DIGIKEY_ACCESS_TOKEN
         
         # Check if a token is in the cache (if Redis is used)
-        if USE_REDIS:
+        redis_client = get_redis_client()
+        if redis_client is not None:
             cached_token = redis_client.get('digikey_access_token')
             cached_expiry = redis_client.get('digikey_token_expiry')
             
@@ -110,6 +170,7 @@ def get_digikey_access_token():
                 if current_time < token_expiry:
                     DIGIKEY_ACCESS_TOKEN = cached_token.decode('utf-8')
                     DIGIKEY_TOKEN_EXPIRY = token_expiry
+                    set_span_attribute('digikey.token_source', 'redis')
                     return DIGIKEY_ACCESS_TOKEN
     
     try:
@@ -129,8 +190,9 @@ def get_digikey_access_token():
         # Apply Rate Limiting
         apply_rate_limiting()
         
+        set_span_attribute('digikey.token_source', 'api')
         logger.info("Requesting new DigiKey access token")
-        response = requests.post(DIGIKEY_AUTH_URL, headers=headers, data=payload)
+        response = timed_request('token', 'POST', DIGIKEY_AUTH_URL, headers=headers, data=payload)
         
         if response.status_code == 200:
             token_data = response.json()
@@ -142,7 +204,8 @@ def get_digikey_access_token():
                 DIGIKEY_TOKEN_EXPIRY = token_expiry
                 
                 # Cache in Redis, if available
-                if USE_REDIS:
+                redis_client = get_redis_client()
+                if redis_client is not None:
                     redis_client.set('digikey_access_token', DIGIKEY_ACCESS_TOKEN)
                     redis_client.set('digikey_token_expiry', str(token_expiry))
                     
@@ -168,24 +231,56 @@ def get_cached_product(product_number):
     cache_key = get_cache_key(product_number)
     
     # Try Redis first, if available
-    if USE_REDIS:
+    redis_client = get_redis_client()
+    if redis_client is not None:
         cached_data = redis_client.get(cache_key)
         if cached_data:
             try:
-                return json.loads(cached_data)
+                product = json.loads(cached_data)
+                CACHE_REQUESTS.inc(cache='product', result='hit')
+                return product
             except json.JSONDecodeError:
                 pass
     
     # Otherwise get from local cache
     with PRODUCT_CACHE_LOCK:
-        return PRODUCT_CACHE.get(product_number)
+        product = PRODUCT_CACHE.get(product_number)
+    CACHE_REQUESTS.inc(cache='product', result='hit' if product else 'miss')
+    return product
+
+def get_cached_products(product_numbers):
+    """Gets many products from the cache, with one Redis round trip
+
+    Returns:
+        dict: Product number -> cached product data (only the hits)
+    """
+    products = {}
+    redis_client = get_redis_client()
+    if redis_client is not None and product_numbers:
+        values = redis_client.mget([get_cache_key(number) for number in product_numbers])
+        for number, cached_data in zip(product_numbers, values):
+            if cached_data:
+                try:
+                    products[number] = json.loads(cached_data)
+                except json.JSONDecodeError:
+                    pass
+    
+    with PRODUCT_CACHE_LOCK:
+        for number in product_numbers:
+            if number not in products and number in PRODUCT_CACHE:
+                products[number] = PRODUCT_CACHE[number]
+    
+    for number in product_numbers:
+        CACHE_REQUESTS.inc(cache='product', result='hit' if number in products else 'miss')
+    return products
 
 def set_product_cache(product_number, product_data):
     """Stores the product in the cache"""
     cache_key = get_cache_key(product_number)
     
     # Store in Redis, if available
-    if USE_REDIS:
+    redis_client = get_redis_client()
+    if redis_client is not None:
         redis_client.setex(
             cache_key,
             60 * 60 * 24,  # 24 hours TTL
@@ -229,17 +324,65 @@ def encode_part_number(part_number):
     
     return encoded
 
+def extract_pricing(product, digikey_number):
+    """Extracts the price breaks of a product from a DigiKey product details response
+
+    Returns:
+        dict: {currency, unit_price, price_breaks: [{quantity, unit_price}], minimum_order_quantity, stock}
+    """
+    variations = product.get('ProductVariations') or []
+    variation = next(
+        (v for v in variations if v.get('DigiKeyProductNumber') == digikey_number),
+        variations[0] if variations else {}
+    )
+    
+    price_breaks = []
+    for price_break in variation.get('StandardPricing') or []:
+        try:
+            price_breaks.append({
+                'quantity': int(price_break['BreakQuantity']),
+                'unit_price': float(price_break['UnitPrice'])
+            })
+        except (KeyError, TypeError, ValueError):
+            continue
+    price_breaks.sort(key=lambda price_break: price_break['quantity'])
+    
+    unit_price = product.get('UnitPrice')
+    return {
+        'currency': DIGIKEY_CURRENCY,
+        'unit_price': float(unit_price) if unit_price else None,
+        'price_breaks': price_breaks,
+        'minimum_order_quantity': variation.get('MinimumOrderQuantity') or 1,
+        'stock': product.get('QuantityAvailable')
+    }
+
 def fetch_digikey_product_info(digikey_number):
     """Retrieves product information from the DigiKey API, including description and manufacturer part number"""
+    product, error = fetch_product_details(digikey_number)
+    if product is None:
+        return None, error
+    return product.get('manufacturer_part_number'), product.get('description')
+
+@traced('digikey.fetch_product_details')
+def fetch_product_details(digikey_number, require_pricing=False):
+    """Retrieves the cached or current product details (description, manufacturer part number, pricing)
+
+    With require_pricing, cache entries stored before pricing was cached are fetched again.
+
+    Returns:
+        tuple: (product data or None, error message)
+    """
+    import requests
+
     if not digikey_number:
         return None, "No DigiKey number provided"
         
     try:
         # Try to load from cache first
         cached_product = get_cached_product(digikey_number)
-        if cached_product:
+        if cached_product and (not require_pricing or 'pricing' in cached_product):
             logger.info(f"Cache hit for {digikey_number}")
-            return cached_product.get('manufacturer_part_number'), cached_product.get('description')
+            return cached_product, None
             
         logger.info(f"Fetching product info for DigiKey number: {digikey_number}")
         access_token = get_digikey_access_token()
@@ -258,14 +401,14 @@ def fetch_digikey_product_info(digikey_number):
             "Authorization": f"Bearer {access_token}",
             "X-DIGIKEY-Locale-Site": "DE",
             "X-DIGIKEY-Locale-Language": "de",
-            "X-DIGIKEY-Locale-Currency": "EUR"
+            "X-DIGIKEY-Locale-Currency": DIGIKEY_CURRENCY
         }
         
         # Apply Rate Limiting
         apply_rate_limiting()
         
         logger.info(f"API request for: {digikey_number} to URL: {url}")
-        response = requests.get(url, headers=headers)
+        response = timed_request('product_details', 'GET', url, headers=headers)
         
         if response.status_code == 200:
             product_data = response.json()
@@ -305,16 +448,18 @@ def fetch_digikey_product_info(digikey_number):
                 cache_data = {
                     'manufacturer_part_number': manufacturer_part_number,
                     'description': description,
+                    'pricing': extract_pricing(product_data['Product'], digikey_number),
                     'timestamp': datetime.now().isoformat()
                 }
                 set_product_cache(digikey_number, cache_data)
+                return cache_data, None
                 
-            return manufacturer_part_number, description
+            return {'manufacturer_part_number': manufacturer_part_number, 'description': description}, None
         elif response.status_code == 429:
             # If rate limit reached, wait briefly and try again
             logger.warning("Rate limit reached, waiting before retry")
-            time.sleep(2)
-            return fetch_digikey_product_info(digikey_number)
+            wait_for_rate_limit(2, 'http_429')
+            return fetch_product_details(digikey_number, require_pricing)
         else:
             logger.error(f"Product API error: {response.status_code}, {response.text}")
             return None, f"Error retrieving: HTTP {response.status_code}"
@@ -325,8 +470,35 @@ def fetch_digikey_product_info(digikey_number):
         logger.error(f"Product API error: {str(e)}")
         return None, "API error: " + str(e)
 
+def fetch_digikey_pricing(digikey_numbers, max_lookups=50):
+    """Retrieves the pricing of many parts
+
+    Cached products are read in one batch, only the misses are requested from
+    the API, in parallel and at most max_lookups of them.
+
+    Returns:
+        tuple: (dict DigiKey number -> pricing, list of DigiKey numbers without pricing)
+    """
+    digikey_numbers = list(dict.fromkeys(digikey_numbers))
+    pricing = {
+        number: product['pricing']
+        for number, product in get_cached_products(digikey_numbers).items()
+        if product.get('pricing') is not None
+    }
+    
+    lookups = [number for number in digikey_numbers if number not in pricing][:max_lookups]
+    if lookups:
+        fetch = propagate(lambda number: fetch_product_details(number, require_pricing=True), 'digikey.pricing_lookup')
+        with ThreadPoolExecutor(max_workers=PRICING_WORKERS) as executor:
+            for number, (product, _) in zip(lookups, executor.map(fetch, lookups)):
+                if product is not None and product.get('pricing') is not None:
+                    pricing[number] = product['pricing']
+    
+    return pricing, [number for number in digikey_numbers if number not in pricing]
+
 # Improved function for DigiKey KeywordSearch API
 @lru_cache(maxsize=128)
+@traced('digikey.keyword_search')
 def search_digikey_keyword(keyword, limit=10):
     """
     Searches for a keyword in the DigiKey database using the KeywordSearch API
@@ -338,6 +510,8 @@ def search_digikey_keyword(keyword, limit=10):
     Returns:
         list: List of found products
     """
+    import requests
+
     if not keyword:
         return []
         
@@ -345,14 +519,18 @@ def search_digikey_keyword(keyword, limit=10):
     cache_key = f"search:{keyword}:{limit}"
     
     # Get from Redis cache, if available
-    if USE_REDIS:
+    redis_client = get_redis_client()
+    if redis_client is not None:
         cached_results = redis_client.get(cache_key)
         if cached_results:
             try:
-                return json.loads(cached_results)
+                results = json.loads(cached_results)
+                CACHE_REQUESTS.inc(cache='search', result='hit')
+                return results
             except json.JSONDecodeError:
                 pass
-    
+
+    CACHE_REQUESTS.inc(cache='search', result='miss')
     try:
         logger.info(f"Searching DigiKey for keyword: {keyword}")
         access_token = get_digikey_access_token()
@@ -419,7 +597,7 @@ def search_digikey_keyword(keyword, limit=10):
             # Apply Rate Limiting
             apply_rate_limiting()
             
-            response = requests.post(url, headers=headers, json=payload, timeout=10)
+            response = timed_request('keyword_search', 'POST', url, headers=headers, json=payload, timeout=10)
             
             if response.status_code == 200:
                 data = response.json()
@@ -439,7 +617,7 @@ def search_digikey_keyword(keyword, limit=10):
             elif response.status_code == 429:
                 # If rate limit reached, wait briefly and continue with the next search
                 logger.warning("Rate limit reached, waiting before continuing")
-                time.sleep(2)
+                wait_for_rate_limit(2, 'http_429')
             else:
                 logger.error(f"DigiKey API Error for {search_keyword}: {response.status_code}, {response.text}")
                 # Try to analyze the error
@@ -467,7 +645,7 @@ def search_digikey_keyword(keyword, limit=10):
             unique_products.append(product)
         
         # Store in cache, if Redis is available
-        if USE_REDIS and unique_products:
+        if redis_client is not None and unique_products:
             redis_client.setex(
                 cache_key,
                 60 * 60,  # 1 hour TTL
@@ -483,6 +661,16 @@ def search_digikey_keyword(keyword, limit=10):
         logger.error(f"KeywordSearch error: {str(e)}")
         return []
 
+def search_memo_counts():
+    info = search_digikey_keyword.cache_info()
+    return {('hit',): info.hits, ('miss',): info.misses}
+
+# In-process memoization in front of the Redis search cache, hits never enter the function
+Collector(
+    'smd_digikey_search_memo_requests_total', 'In-process keyword search memo lookups by result',
+    'counter', search_memo_counts, ('result',)
+)
+
 # Helper function for uniform extraction of product data
 def extract_product_data(product):
     """
@@ -0,0 +1,98 @@
+import csv
+import io
+import json
+from sqlalchemy import select
+
+from models import db, SMDPart, BOMEntry, FlatBOMEntry
+from reservations import device_available_quantity, join_device_reservations
+
+# Number of rows fetched from the database per batch
+EXPORT_BATCH_SIZE = 500
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'json': 'application/json'
+}
+
+def inventory_query():
+    """All parts in ID order"""
+    return select(
+        SMDPart.id.label('id'),
+        SMDPart.part_number.label('part_number'),
+        SMDPart.digikey_number.label('digikey_number'),
+        SMDPart.description.label('description'),
+        SMDPart.quantity.label('quantity')
+    ).order_by(SMDPart.id)
+
+def bom_query(device_id):
+    """All BOM entries of a device with their part data"""
+    return select(
+        SMDPart.id.label('part_id'),
+        SMDPart.part_number.label('part_number'),
+        SMDPart.digikey_number.label('digikey_number'),
+        SMDPart.description.label('description'),
+        BOMEntry.quantity_required.label('required'),
+        SMDPart.quantity.label('available')
+    ).join(
+        SMDPart, BOMEntry.smd_part_id == SMDPart.id
+    ).where(
+        BOMEntry.hardware_device_id == device_id
+    ).order_by(SMDPart.id)
+
+def missing_parts_query(device_id):
+    """Flattened BOM entries of a device with insufficient available stock, largest shortage first"""
+    available = device_available_quantity().label('available')
+    missing = (FlatBOMEntry.quantity_required - available).label('missing')
+    return join_device_reservations(select(
+        SMDPart.id.label('part_id'),
+        SMDPart.part_number.label('part_number'),
+        SMDPart.digikey_number.label('digikey_number'),
+        SMDPart.description.label('description'),
+        FlatBOMEntry.quantity_required.label('required'),
+        available,
+        missing
+    ).join(
+        SMDPart, FlatBOMEntry.smd_part_id == SMDPart.id
+    ), FlatBOMEntry.hardware_device_id).where(
+        FlatBOMEntry.hardware_device_id == device_id,
+        device_available_quantity() < FlatBOMEntry.quantity_required
+    ).order_by(missing.desc(), SMDPart.id)
+
+def iter_rows(query):
+    """Iterates over query results in batches without loading all rows into memory"""
+    result = db.session.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    for row in result.mappings():
+        yield row
+
+def stream_csv(query):
+    """Generates a CSV document row by row"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column.name for column in query.selected_columns])
+    yield buffer.getvalue()
+
+    for row in iter_rows(query):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row.values())
+        yield buffer.getvalue()
+
+def stream_json(query):
+    """Generates a JSON array row by row"""
+    yield '['
+    separator = ''
+    for row in iter_rows(query):
+        yield separator + json.dumps(dict(row))
+        separator = ','
+    yield ']'
+
+def stream_export(query, export_format):
+    """Returns the row generator for the requested format"""
+    if export_format == 'json':
+        return stream_json(query)
+    return stream_csv(query)
+
+def export_filename(name, export_format):
+    """Builds a safe download filename"""
+    safe_name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+    return f"{safe_name}.{export_format}"
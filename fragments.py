@@ -0,0 +1,184 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from flask import render_template
+from markupsafe import Markup
+
+from metrics import CACHE_REQUESTS
+
+# Configure Logging
+logger = logging.getLogger('fragments')
+
+# 'memory' (in-process LRU, default) or 'redis' (shared between worker processes)
+FRAGMENT_CACHE_BACKEND = os.environ.get('FRAGMENT_CACHE_BACKEND', 'memory').lower()
+# Maximum number of fragments in the in-process cache
+FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 20000))
+# Lifetime of fragments in Redis (seconds)
+FRAGMENT_CACHE_TTL = int(os.environ.get('FRAGMENT_CACHE_TTL', 24 * 60 * 60))
+
+FRAGMENT_TEMPLATES = (
+    'partials/inventory_table.html',
+    'partials/inventory_row.html',
+    'partials/device_row.html'
+)
+
+def templates_digest():
+    """Hash of the fragment templates, so a changed template never reuses old fragments"""
+    digest = hashlib.sha1()
+    template_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+    for name in FRAGMENT_TEMPLATES:
+        try:
+            with open(os.path.join(template_dir, name), 'rb') as template_file:
+                digest.update(template_file.read())
+        except OSError:
+            digest.update(name.encode('utf-8'))
+    return digest.hexdigest()[:12]
+
+TEMPLATES_DIGEST = templates_digest()
+
+class MemoryFragmentCache:
+    """Thread-safe in-process LRU cache"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        found = {}
+        with self.lock:
+            for key in keys:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    found[key] = self.entries[key]
+        return found
+
+    def set_many(self, mapping):
+        with self.lock:
+            for key, value in mapping.items():
+                self.entries[key] = value
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class RedisFragmentCache:
+    """Fragment cache shared by all worker processes, read with one MGET per batch"""
+
+    def __init__(self, ttl):
+        import redis
+        self.ttl = ttl
+        self.client = redis.Redis(
+            host=os.environ.get('REDIS_HOST', 'localhost'),
+            port=int(os.environ.get('REDIS_PORT', 6379)),
+            db=int(os.environ.get('REDIS_DB', 0)),
+            socket_timeout=5
+        )
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self.client.mget([f"fragment:{key}" for key in keys])
+        return {key: value.decode('utf-8') for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, mapping):
+        pipeline = self.client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipeline.setex(f"fragment:{key}", self.ttl, value)
+        pipeline.execute()
+
+    def clear(self):
+        for key in self.client.scan_iter('fragment:*'):
+            self.client.delete(key)
+
+def create_fragment_cache():
+    """Creates the configured cache backend, falling back to the in-process cache"""
+    if FRAGMENT_CACHE_BACKEND == 'redis':
+        try:
+            cache = RedisFragmentCache(FRAGMENT_CACHE_TTL)
+            cache.client.ping()
+            logger.info("Redis fragment cache enabled")
+            return cache
+        except Exception as e:
+            logger.error(f"Redis fragment cache not available, using in-memory cache: {str(e)}")
+    return MemoryFragmentCache(FRAGMENT_CACHE_SIZE)
+
+class LazyFragmentCache:
+    """Creates the cache backend on first use, so importing the app does not connect to Redis"""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.backend = None
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self.backend is None:
+            with self.lock:
+                if self.backend is None:
+                    self.backend = self.factory()
+        return getattr(self.backend, name)
+
+fragment_cache = LazyFragmentCache(create_fragment_cache)
+
+def fragment_key(kind, *values):
+    """Cache key derived from the fragment kind and everything the fragment shows"""
+    digest = hashlib.sha1(repr(values).encode('utf-8')).hexdigest()
+    return f"{kind}:{TEMPLATES_DIGEST}:{digest}"
+
+def get_fragments(keys):
+    """Looks up fragments, cache errors count as misses"""
+    try:
+        return fragment_cache.get_many(keys)
+    except Exception as e:
+        logger.error(f"Fragment cache read error: {str(e)}")
+        return {}
+
+def store_fragments(mapping):
+    """Stores fragments, cache errors are only logged"""
+    if not mapping:
+        return
+    try:
+        fragment_cache.set_many(mapping)
+    except Exception as e:
+        logger.error(f"Fragment cache write error: {str(e)}")
+
+def render_cached(template_name, items):
+    """Renders many fragments of one template, only the ones not in the cache
+
+    Args:
+        template_name (str): Template of a single fragment
+        items (list): (key, context) tuples, the key must cover everything the context shows
+
+    Returns:
+        list: Rendered fragments in the order of the items
+    """
+    cached = get_fragments([key for key, _ in items])
+    CACHE_REQUESTS.inc(len(cached), cache='fragment', result='hit')
+    CACHE_REQUESTS.inc(len(items) - len(cached), cache='fragment', result='miss')
+
+    rendered = {}
+    for key, context in items:
+        if key not in cached and key not in rendered:
+            rendered[key] = render_template(template_name, **context)
+    store_fragments(rendered)
+
+    if rendered:
+        logger.debug(f"Rendered {len(rendered)} of {len(items)} fragments of {template_name}")
+
+    cached.update(rendered)
+    return [Markup(cached[key]) for key, _ in items]
+
+def render_cached_fragment(key, render):
+    """Returns a single cached fragment or renders and stores it"""
+    cached = get_fragments([key]).get(key)
+    CACHE_REQUESTS.inc(cache='fragment', result='miss' if cached is None else 'hit')
+    if cached is None:
+        cached = render()
+        store_fragments({key: cached})
+    return Markup(cached)
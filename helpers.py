@@ -1,6 +1,123 @@
-from models import BOMEntry, SMDPart, HardwareDevice
-from sqlalchemy import func, distinct
+from models import db, BOMEntry, FlatBOMEntry, SMDPart, HardwareDevice, Reservation, ReservedStock
+from sqlalchemy import func, distinct, case, select, and_
 from sqlalchemy.orm import joinedload
+from reservations import free_quantity, device_available_quantity, join_reserved_stock, join_device_reservations
+from tracing import traced
+
+def part_status_expression(free, missing_below, low_below):
+    """SQL expression for the status CSS class of a part
+
+    A part is missing if there is not enough stock for at least one device and
+    low if there is less than twice the largest requirement. Stock reserved for
+    a device counts as available for that device only.
+    """
+    return case(
+        (free < missing_below, 'part-status-missing'),
+        (free < low_below, 'part-status-low'),
+        else_='part-status-ok'
+    )
+
+def status_thresholds():
+    """Per flattened BOM entry: free stock below which the part is missing or low for that device"""
+    own_reserved = func.coalesce(Reservation.quantity, 0)
+    return (
+        FlatBOMEntry.quantity_required - own_reserved,
+        FlatBOMEntry.quantity_required * 2 - own_reserved
+    )
+
+def join_entry_reservations(query):
+    """Adds the reservation of each flattened BOM entry's device to a query over FlatBOMEntry"""
+    return query.outerjoin(Reservation, and_(
+        Reservation.smd_part_id == FlatBOMEntry.smd_part_id,
+        Reservation.hardware_device_id == FlatBOMEntry.hardware_device_id
+    ))
+
+@traced()
+def get_part_status_map(part_ids=None):
+    """Returns the status CSS class of all parts used by a device in one grouped query
+
+    Requirements come from the flattened BOMs, so parts used in sub-assemblies count
+    with their total quantity per device. Reserved stock is not available.
+    """
+    missing_below, low_below = status_thresholds()
+    thresholds = join_entry_reservations(select(
+        FlatBOMEntry.smd_part_id.label('part_id'),
+        func.max(missing_below).label('missing_below'),
+        func.max(low_below).label('low_below')
+    )).where(
+        FlatBOMEntry.quantity_required > 0
+    )
+    
+    if part_ids is not None:
+        thresholds = thresholds.where(FlatBOMEntry.smd_part_id.in_(part_ids))
+    
+    thresholds = thresholds.group_by(FlatBOMEntry.smd_part_id).subquery()
+    
+    rows = db.session.execute(
+        join_reserved_stock(select(
+            SMDPart.id,
+            part_status_expression(free_quantity(), thresholds.c.missing_below, thresholds.c.low_below)
+        ).join(thresholds, thresholds.c.part_id == SMDPart.id))
+    ).all()
+    
+    return dict(rows)
+
+@traced()
+def get_device_build_summary(device_ids=None):
+    """Calculates buildable units, completion percentage and the limiting part per device
+
+    Everything is aggregated in SQL over the flattened BOMs: a window function
+    ranks the entries of each device by the units they allow, and a GROUP BY
+    reduces them per device.
+
+    Returns:
+        dict: device_id -> {'buildable', 'percentage', 'limiting_part_id'}
+    """
+    # Stock reserved for other devices is not available, negative values count as none
+    available = device_available_quantity()
+    available = case((available > 0, available), else_=0)
+    units = (available // FlatBOMEntry.quantity_required).label('units')
+    percentage = case(
+        (available >= FlatBOMEntry.quantity_required, 100.0),
+        else_=available * 100.0 / FlatBOMEntry.quantity_required
+    ).label('percentage')
+    rank = func.row_number().over(
+        partition_by=FlatBOMEntry.hardware_device_id,
+        order_by=(units, FlatBOMEntry.smd_part_id)
+    ).label('rank')
+    
+    per_entry = join_device_reservations(select(
+        FlatBOMEntry.hardware_device_id.label('device_id'),
+        FlatBOMEntry.smd_part_id.label('part_id'),
+        units,
+        percentage,
+        rank
+    ).join(
+        SMDPart, FlatBOMEntry.smd_part_id == SMDPart.id
+    ), FlatBOMEntry.hardware_device_id).where(FlatBOMEntry.quantity_required > 0)
+    
+    if device_ids is not None:
+        per_entry = per_entry.where(FlatBOMEntry.hardware_device_id.in_(device_ids))
+    
+    per_entry = per_entry.subquery()
+    
+    rows = db.session.execute(
+        select(
+            per_entry.c.device_id,
+            func.min(per_entry.c.units),
+            func.avg(per_entry.c.percentage),
+            func.max(case((per_entry.c.rank == 1, per_entry.c.part_id)))
+        ).group_by(per_entry.c.device_id)
+    ).all()
+    
+    return {
+        device_id: {
+            'buildable': buildable,
+            'percentage': round(min(100, float(average))),
+            'limiting_part_id': limiting_part_id
+        }
+        for device_id, buildable, average, limiting_part_id in rows
+    }
 
 # Helper functions for templates
 def get_required_quantity(part_id, device_id):
@@ -16,30 +133,25 @@ def get_part_status_class(part):
     if not part:
         return ""
         
-    # Check if the part is needed for any model
-    entries = BOMEntry.query.filter_by(smd_part_id=part.id).all()
+    # The status only depends on the largest requirement of any model
+    missing_below, low_below = status_thresholds()
+    count, max_missing_below, max_low_below = join_entry_reservations(db.session.query(
+        func.count(FlatBOMEntry.smd_part_id),
+        func.max(case((FlatBOMEntry.quantity_required > 0, missing_below))),
+        func.max(case((FlatBOMEntry.quantity_required > 0, low_below)))
+    )).filter(FlatBOMEntry.smd_part_id == part.id).one()
     
-    if not entries:
+    if not count:
         return ""  # Neutral if not needed
     
-    # Check all entries at once
-    has_missing = False
-    has_low = False
+    if max_missing_below is None:
+        return "part-status-ok"  # Only invalid entries
     
-    for entry in entries:
-        if entry.quantity_required <= 0:
-            continue  # Ignore invalid entries
-            
-        if part.quantity < entry.quantity_required:
-            has_missing = True
-            break  # Break immediately, as Missing status has priority
-        elif part.quantity < entry.quantity_required * 2:
-            has_low = True
-            # Continue checking if there are missing parts
-    
-    if has_missing:
+    reserved = db.session.query(ReservedStock.quantity).filter_by(smd_part_id=part.id).scalar() or 0
+    free = (part.quantity or 0) - reserved
+    if free < max_missing_below:
         return "part-status-missing"  # Red if not enough for at least one model
-    elif has_low:
+    elif free < max_low_below:
         return "part-status-low"  # Yellow if low
     
     return "part-status-ok"  # Green if sufficient
@@ -49,75 +161,28 @@ def get_buildable_count(device_id):
     if not device_id:
         return "N/A"
         
-    # Query all BOM entries for this device - optimized query
-    entries_with_parts = BOMEntry.query.filter_by(hardware_device_id=device_id)\
-                          .join(SMDPart, BOMEntry.smd_part_id == SMDPart.id)\
-                          .with_entities(BOMEntry.quantity_required, SMDPart.quantity)\
-                          .all()
-    
-    if not entries_with_parts:
-        return "N/A"
-    
-    # Initial value for buildable
-    buildable = None
-    
-    # Calculate possible units for each entry
-    for required, available in entries_with_parts:
-        if required <= 0:
-            continue  # Skip invalid entries
-            
-        units_possible = available // required
-        
-        # Update buildable (minimum of possible units)
-        if buildable is None:
-            buildable = units_possible
-        else:
-            buildable = min(buildable, units_possible)
-    
-    return buildable if buildable is not None else 0
+    summary = get_device_build_summary([device_id]).get(device_id)
+    return summary['buildable'] if summary else "N/A"
 
 def get_buildable_percentage(device_id):
     """Calculates the percentage of completion based on available parts"""
     if not device_id:
         return 0
         
-    # Optimized query with fewer roundtrips to the database
-    entries_with_parts = BOMEntry.query.filter_by(hardware_device_id=device_id)\
-                          .join(SMDPart, BOMEntry.smd_part_id == SMDPart.id)\
-                          .with_entities(BOMEntry.quantity_required, SMDPart.quantity)\
-                          .all()
-    
-    if not entries_with_parts:
-        return 0  # If no BOM entries exist
-    
-    total_percentage = 0
-    components_count = 0
-    
-    for required, available in entries_with_parts:
-        if required <= 0:
-            continue  # Skip invalid entries
-            
-        component_percentage = min(100, (available / required) * 100)
-        total_percentage += component_percentage
-        components_count += 1
-    
-    if components_count == 0:
-        return 0
-        
-    average_percentage = total_percentage / components_count
-    return round(min(100, average_percentage))
+    summary = get_device_build_summary([device_id]).get(device_id)
+    return summary['percentage'] if summary else 0
 
 def has_bom_entries(device_id):
     """Checks if BOM entries exist for a device"""
     if not device_id:
         return False
         
-    return BOMEntry.query.filter_by(hardware_device_id=device_id).count() > 0
+    return FlatBOMEntry.query.filter_by(hardware_device_id=device_id).count() > 0
 
 def get_devices_with_bom():
-    """Returns all devices that have BOM entries - optimized query"""
-    # Distinct device_ids that appear in BOMEntry
-    device_ids_query = BOMEntry.query.with_entities(distinct(BOMEntry.hardware_device_id)).all()
+    """Returns all devices that have BOM entries (directly or via sub-assemblies) - optimized query"""
+    # Distinct device_ids that appear in the flattened BOMs
+    device_ids_query = FlatBOMEntry.query.with_entities(distinct(FlatBOMEntry.hardware_device_id)).all()
     device_ids = [entry[0] for entry in device_ids_query]
     
     if not device_ids:
@@ -175,6 +240,24 @@ def get_part_devices(part_id):
     
     return devices
 
+def get_part_devices_map():
+    """Returns the device usages of all parts with one query (part_id -> list as in get_part_devices)"""
+    rows = db.session.query(
+        BOMEntry.smd_part_id, BOMEntry.hardware_device_id, HardwareDevice.name, BOMEntry.quantity_required
+    ).join(
+        HardwareDevice, BOMEntry.hardware_device_id == HardwareDevice.id
+    ).order_by(BOMEntry.id).all()
+    
+    devices = {}
+    for part_id, device_id, device_name, qty_required in rows:
+        devices.setdefault(part_id, []).append({
+            'device_id': device_id,
+            'device_name': device_name,
+            'qty_required': qty_required
+        })
+    
+    return devices
+
 def get_total_required_quantity(part_id):
     """Calculates the total quantity of a component needed across all devices - optimized query"""
     if not part_id:
@@ -192,4 +275,43 @@ def is_part_unassigned(part_id):
     if not part_id:
         return True
         
-    return BOMEntry.query.filter_by(smd_part_id=part_id).count() == 0
\ No newline at end of file
+    return BOMEntry.query.filter_by(smd_part_id=part_id).count() == 0
+
+@traced()
+def get_inventory_delta(part_ids, device_ids=()):
+    """Returns the changed inventory rows after an edit, for patching the page in place
+
+    Args:
+        part_ids (list): Parts whose stock or usage changed
+        device_ids (list): Devices whose BOM changed (including the devices containing them)
+
+    Returns:
+        dict: 'parts' with the new stock and status class of each part, 'devices' with
+              the buildable units of the given devices and of all devices using the parts
+    """
+    part_ids = sorted(set(part_ids))
+    quantities = dict(db.session.execute(
+        select(SMDPart.id, SMDPart.quantity).where(SMDPart.id.in_(part_ids))
+    ).all())
+    part_status = get_part_status_map(part_ids)
+    
+    affected = set(device_ids)
+    affected.update(db.session.execute(
+        select(distinct(FlatBOMEntry.hardware_device_id)).where(FlatBOMEntry.smd_part_id.in_(part_ids))
+    ).scalars())
+    build_summary = get_device_build_summary(sorted(affected)) if affected else {}
+    
+    return {
+        'parts': [
+            {'id': part_id, 'quantity': quantities[part_id], 'status': part_status.get(part_id, '')}
+            for part_id in part_ids if part_id in quantities
+        ],
+        'devices': [
+            {
+                'id': device_id,
+                'buildable': build_summary[device_id]['buildable'] if device_id in build_summary else None,
+                'percentage': build_summary[device_id]['percentage'] if device_id in build_summary else 0
+            }
+            for device_id in sorted(affected)
+        ]
+    }
@@ -0,0 +1,232 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from flask import g, has_request_context, request, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Configure Logging
+logger = logging.getLogger('metrics')
+
+# Set to False to disable the collection and the /metrics endpoint
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() == 'true'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Default latency buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# All metrics in the order of their definition
+REGISTRY = []
+
+def escape_label(value):
+    """Escapes a label value for the text exposition format"""
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """Base class: a named metric with a fixed set of label names"""
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def key(self, labels):
+        return tuple(labels.get(name, '') for name in self.label_names)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+    """Monotonically increasing value"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return self.header() + [
+            f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}" for key, value in items
+        ]
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self.values[key] = (counts, total + value)
+
+    def render(self):
+        with self.lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self.values.items())
+
+        lines = self.header()
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(self.label_names, key, [('le', format_value(float(bound)))])} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+class Collector(Metric):
+    """Metric whose values are read from a callback at scrape time"""
+
+    def __init__(self, name, documentation, kind, collect, labels=()):
+        super().__init__(name, documentation, labels)
+        self.kind = kind
+        self.collect = collect
+
+    def render(self):
+        try:
+            items = sorted(self.collect().items())
+        except Exception as e:
+            logger.error(f"Error collecting {self.name}: {str(e)}")
+            items = []
+        return self.header() + [
+            f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}" for key, value in items
+        ]
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+# HTTP requests
+REQUEST_DURATION = Histogram(
+    'smd_http_request_duration_seconds', 'Duration of HTTP requests', ('method', 'endpoint', 'status')
+)
+REQUEST_QUERIES = Histogram(
+    'smd_http_request_db_queries', 'Number of SQL queries per HTTP request', ('endpoint',),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+
+# Database
+DB_QUERY_DURATION = Histogram(
+    'smd_db_query_duration_seconds', 'Duration of SQL statements', ('statement',)
+)
+
+# DigiKey API
+DIGIKEY_REQUEST_DURATION = Histogram(
+    'smd_digikey_request_duration_seconds', 'Duration of DigiKey API calls', ('operation', 'status')
+)
+DIGIKEY_RATE_LIMIT_WAIT = Counter(
+    'smd_digikey_rate_limit_wait_seconds_total', 'Time spent waiting for the DigiKey rate limiter', ('reason',)
+)
+DIGIKEY_RATE_LIMIT_WAITS = Counter(
+    'smd_digikey_rate_limit_waits_total', 'Number of waits for the DigiKey rate limiter', ('reason',)
+)
+
+# Caches (cache: product, search, fragment; result: hit, miss)
+CACHE_REQUESTS = Counter(
+    'smd_cache_requests_total', 'Cache lookups by result', ('cache', 'result')
+)
+
+# BOM imports
+IMPORT_ROWS = Counter('smd_import_rows_total', 'BOM rows processed by imports')
+IMPORT_DURATION = Histogram(
+    'smd_import_duration_seconds', 'Duration of BOM imports', buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+IMPORT_THROUGHPUT = Gauge('smd_import_rows_per_second', 'Throughput of the last BOM import')
+IMPORT_JOBS = Gauge('smd_import_jobs_in_progress', 'BOM imports queued or running')
+
+# Barcode scans (result: applied, created, queued, unknown, invalid)
+SCANS = Counter('smd_scans_total', 'Scanned labels by result', ('result',))
+SCAN_BATCH_SIZE = Histogram(
+    'smd_scan_batch_size', 'Scan requests committed in one transaction', buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+
+def statement_kind(statement):
+    """First keyword of a SQL statement, keeps the label cardinality low"""
+    keyword = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ''
+    return keyword if keyword in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'PRAGMA', 'BEGIN') else 'OTHER'
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if METRICS_ENABLED:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if not METRICS_ENABLED or not starts:
+        return
+
+    DB_QUERY_DURATION.observe(time.perf_counter() - starts.pop(), statement=statement_kind(statement))
+    if has_request_context() and 'query_count' in g:
+        g.query_count += 1
+
+@event.listens_for(Engine, 'handle_error')
+def discard_query_timer(exception_context):
+    """Failed statements never reach after_cursor_execute"""
+    connection = exception_context.connection
+    starts = connection.info.get('query_start') if connection is not None else None
+    if starts:
+        starts.pop()
+
+def init_metrics(app):
+    """Registers the request hooks and the /metrics endpoint"""
+    if not METRICS_ENABLED:
+        return
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+        g.query_count = 0
+
+    @app.after_request
+    def record_request_metrics(response):
+        if 'request_start' in g:
+            endpoint = request.endpoint or 'unknown'
+            REQUEST_DURATION.observe(
+                time.perf_counter() - g.request_start,
+                method=request.method, endpoint=endpoint, status=response.status_code
+            )
+            REQUEST_QUERIES.observe(g.query_count, endpoint=endpoint)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(render_metrics(), content_type=CONTENT_TYPE)
@@ -1,19 +1,123 @@
+import os
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Index, event
-from sqlalchemy.engine import Engine
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Index, event, DDL, Insert, Update, Delete
+from sqlalchemy.engine import Engine, make_url
 from sqlite3 import Connection as SQLite3Connection
 
+# Bind key of the separate engine used by read-only requests
+READ_BIND_KEY = 'read'
+
+# SQLite storage profile (can be tuned via environment variables)
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 10000))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 20000))
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+
+class RoutingSession(Session):
+    """Session that sends queries of read-only requests to the read engine"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('read_only') and not self._flushing \
+                and not isinstance(clause, (Insert, Update, Delete)):
+            engine = self._db.engines.get(READ_BIND_KEY)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
 # Create SQLAlchemy instance
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
-# Enable SQLite Foreign Key Constraints
+def utcnow():
+    """Current UTC time as naive datetime (as stored in the database)"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+# Enable SQLite Foreign Key Constraints and the storage profile
 @event.listens_for(Engine, "connect")
 def _set_sqlite_pragma(dbapi_connection, connection_record):
     if isinstance(dbapi_connection, SQLite3Connection):
         cursor = dbapi_connection.cursor()
         cursor.execute("PRAGMA foreign_keys=ON")
+        # WAL lets readers continue while a writer is active
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        # Wait for locks instead of failing with "database is locked"
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
         cursor.close()
 
+def _is_sqlite_file(uri):
+    """Checks if the database URI points to an SQLite file (not in-memory)"""
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+    # Let SQLAlchemy emit BEGIN itself, so the transaction mode can be chosen
+    dbapi_connection.isolation_level = None
+
+def _set_read_only(dbapi_connection, connection_record):
+    _disable_pysqlite_transactions(dbapi_connection, connection_record)
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+def _begin_immediate(conn):
+    # Take the write lock up front: writers queue on busy_timeout instead of
+    # failing when a read transaction is upgraded to a write transaction
+    conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+def _begin_deferred(conn):
+    conn.exec_driver_sql("BEGIN")
+
+def init_storage(app):
+    """Initializes the database for the app
+
+    For SQLite files, writes go through the default engine and start with
+    BEGIN IMMEDIATE, so they are serialized. Read-only requests use a
+    separate engine with query_only connections, which in WAL mode is never
+    blocked by a running write transaction (e.g. a BOM import).
+    """
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    use_read_engine = _is_sqlite_file(uri)
+
+    if make_url(uri).get_backend_name() == 'postgresql':
+        # Detect connections dropped by the server or a pooler
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {}).setdefault('pool_pre_ping', True)
+
+    if use_read_engine:
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        binds.setdefault(READ_BIND_KEY, uri)
+
+    db.init_app(app)
+
+    if use_read_engine:
+        with app.app_context():
+            write_engine = db.engines[None]
+            read_engine = db.engines[READ_BIND_KEY]
+
+        event.listen(write_engine, "connect", _disable_pysqlite_transactions)
+        event.listen(write_engine, "begin", _begin_immediate)
+        event.listen(read_engine, "connect", _set_read_only)
+        event.listen(read_engine, "begin", _begin_deferred)
+
+def use_read_engine():
+    """Routes the queries of the current session to the read engine"""
+    db.session.info['read_only'] = True
+
+@contextmanager
+def read_only():
+    """Runs the enclosed queries on the read engine and ends the read transaction afterwards"""
+    previous = db.session.info.get('read_only', False)
+    db.session.info['read_only'] = True
+    try:
+        yield db.session
+    finally:
+        db.session.rollback()
+        db.session.info['read_only'] = previous
+
 # Database models
 class SMDPart(db.Model):
     __tablename__ = 'smd_part'
@@ -51,6 +155,19 @@ class SMDPart(db.Model):
 # Add index for part_number, but not unique, as duplicates may exist
 Index('ix_smd_part_part_number', SMDPart.part_number)
 
+# Trigram indexes for substring searches (ILIKE '%term%') on PostgreSQL
+# (plain DDL: Index options for postgresql would import its dialect on startup)
+event.listen(
+    db.metadata, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
+for _column in ('part_number', 'digikey_number', 'description'):
+    event.listen(
+        db.metadata, 'after_create',
+        DDL(f'CREATE INDEX IF NOT EXISTS ix_smd_part_{_column}_trgm ON smd_part '
+            f'USING gin ({_column} gin_trgm_ops)').execute_if(dialect='postgresql')
+    )
+
 class HardwareDevice(db.Model):
     __tablename__ = 'hardware_device'
     
@@ -111,4 +228,176 @@ class BOMEntry(db.Model):
 
 # Indexes for common access patterns
 Index('ix_bom_entry_part_device', BOMEntry.smd_part_id, BOMEntry.hardware_device_id, unique=True)
-Index('ix_bom_entry_device', BOMEntry.hardware_device_id)
\ No newline at end of file
+Index('ix_bom_entry_device', BOMEntry.hardware_device_id)
+
+class SubAssembly(db.Model):
+    """A device used as a sub-assembly of another device (multi-level BOM)"""
+    __tablename__ = 'sub_assembly'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    parent_device_id = db.Column(db.Integer, db.ForeignKey('hardware_device.id', ondelete='CASCADE'), nullable=False)
+    child_device_id = db.Column(db.Integer, db.ForeignKey('hardware_device.id', ondelete='CASCADE'), nullable=False)
+    quantity_required = db.Column(db.Integer, nullable=False)
+    
+    parent_device = db.relationship('HardwareDevice', foreign_keys=[parent_device_id])
+    child_device = db.relationship('HardwareDevice', foreign_keys=[child_device_id])
+    
+    def __repr__(self):
+        return f"<SubAssembly parent={self.parent_device_id} child={self.child_device_id} qty={self.quantity_required}>"
+    
+    def to_dict(self):
+        """Converts the model to a dictionary"""
+        return {
+            'id': self.id,
+            'parent_device_id': self.parent_device_id,
+            'child_device_id': self.child_device_id,
+            'quantity_required': self.quantity_required
+        }
+    
+    # Validation: Quantity must be positive
+    @db.validates('quantity_required')
+    def validate_quantity(self, key, quantity):
+        if quantity <= 0:
+            raise ValueError("Required quantity must be positive")
+        return quantity
+
+Index('ix_sub_assembly_parent_child', SubAssembly.parent_device_id, SubAssembly.child_device_id, unique=True)
+Index('ix_sub_assembly_child', SubAssembly.child_device_id)
+
+class FlatBOMEntry(db.Model):
+    """Cached flattened BOM: total quantity of each part per device, including sub-assemblies
+
+    Maintained by bom.refresh_flat_boms whenever BOM entries or sub-assemblies change.
+    """
+    __tablename__ = 'flat_bom_entry'
+    
+    hardware_device_id = db.Column(db.Integer, db.ForeignKey('hardware_device.id', ondelete='CASCADE'), primary_key=True)
+    smd_part_id = db.Column(db.Integer, db.ForeignKey('smd_part.id', ondelete='CASCADE'), primary_key=True)
+    quantity_required = db.Column(db.Integer, nullable=False)
+    
+    def __repr__(self):
+        return f"<FlatBOMEntry part_id={self.smd_part_id} device_id={self.hardware_device_id} qty={self.quantity_required}>"
+    
+    def to_dict(self):
+        """Converts the model to a dictionary"""
+        return {
+            'smd_part_id': self.smd_part_id,
+            'hardware_device_id': self.hardware_device_id,
+            'quantity_required': self.quantity_required
+        }
+
+Index('ix_flat_bom_entry_part', FlatBOMEntry.smd_part_id)
+
+class StockMovement(db.Model):
+    """Append-only ledger entry for every change of a part's stock quantity"""
+    __tablename__ = 'stock_movement'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    smd_part_id = db.Column(db.Integer, db.ForeignKey('smd_part.id', ondelete='CASCADE'), nullable=False)
+    delta = db.Column(db.Integer, nullable=False)
+    quantity_after = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(50), nullable=False)
+    reference = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    
+    def __repr__(self):
+        return f"<StockMovement part_id={self.smd_part_id} delta={self.delta}>"
+    
+    def to_dict(self):
+        """Converts the model to a dictionary"""
+        return {
+            'id': self.id,
+            'smd_part_id': self.smd_part_id,
+            'delta': self.delta,
+            'quantity_after': self.quantity_after,
+            'reason': self.reason,
+            'reference': self.reference,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+# Latest movements of a part and time range queries
+Index('ix_stock_movement_part', StockMovement.smd_part_id, StockMovement.id)
+Index('ix_stock_movement_created_at', StockMovement.created_at)
+
+class StockSnapshot(db.Model):
+    """Per-part state of the ledger up to a movement ID (the watermark)
+
+    The cumulative totals allow history and consumption queries to start at the
+    latest snapshot and only read the ledger entries after its watermark.
+    """
+    __tablename__ = 'stock_snapshot'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    smd_part_id = db.Column(db.Integer, db.ForeignKey('smd_part.id', ondelete='CASCADE'), nullable=False)
+    last_movement_id = db.Column(db.Integer, nullable=False)
+    taken_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    quantity = db.Column(db.Integer, nullable=False)
+    total_in = db.Column(db.Integer, nullable=False, default=0)
+    total_out = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<StockSnapshot part_id={self.smd_part_id} watermark={self.last_movement_id}>"
+    
+    def to_dict(self):
+        """Converts the model to a dictionary"""
+        return {
+            'smd_part_id': self.smd_part_id,
+            'last_movement_id': self.last_movement_id,
+            'taken_at': self.taken_at.isoformat() if self.taken_at else None,
+            'quantity': self.quantity,
+            'total_in': self.total_in,
+            'total_out': self.total_out
+        }
+
+Index('ix_stock_snapshot_part', StockSnapshot.smd_part_id, StockSnapshot.last_movement_id, unique=True)
+Index('ix_stock_snapshot_watermark', StockSnapshot.last_movement_id, StockSnapshot.taken_at)
+
+class Reservation(db.Model):
+    """Stock of a part reserved for planned builds of a device
+
+    There is one row per (device, part); repeated reservations add up.
+    """
+    __tablename__ = 'reservation'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    hardware_device_id = db.Column(db.Integer, db.ForeignKey('hardware_device.id', ondelete='CASCADE'), nullable=False)
+    smd_part_id = db.Column(db.Integer, db.ForeignKey('smd_part.id', ondelete='CASCADE'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    
+    def __repr__(self):
+        return f"<Reservation part_id={self.smd_part_id} device_id={self.hardware_device_id} qty={self.quantity}>"
+    
+    def to_dict(self):
+        """Converts the model to a dictionary"""
+        return {
+            'id': self.id,
+            'hardware_device_id': self.hardware_device_id,
+            'smd_part_id': self.smd_part_id,
+            'quantity': self.quantity,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+Index('ix_reservation_device_part', Reservation.hardware_device_id, Reservation.smd_part_id, unique=True)
+Index('ix_reservation_part', Reservation.smd_part_id)
+
+class ReservedStock(db.Model):
+    """Total reserved quantity per part, maintained incrementally with every reservation change"""
+    __tablename__ = 'reserved_stock'
+    
+    smd_part_id = db.Column(db.Integer, db.ForeignKey('smd_part.id', ondelete='CASCADE'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<ReservedStock part_id={self.smd_part_id} qty={self.quantity}>"
+
+class DataVersion(db.Model):
+    """Change counter per scope ('global', 'parts' or 'device:<id>'), used for ETags"""
+    __tablename__ = 'data_version'
+    
+    scope = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    
+    def __repr__(self):
+        return f"<DataVersion {self.scope}={self.version}>"
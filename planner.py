@@ -0,0 +1,206 @@
+import logging
+from sqlalchemy import select, func
+
+from models import db, SMDPart, HardwareDevice, FlatBOMEntry, Reservation
+from reservations import free_quantity, join_reserved_stock
+
+# Configure Logging
+logger = logging.getLogger('planner')
+
+# numpy is imported by the functions using it, so starting the app does not load it
+
+# Upper bound for the number of devices in one production plan
+MAX_PLAN_DEVICES = 1000
+
+PLAN_STRATEGIES = ('priority', 'proportional')
+
+def parse_plan_targets(items):
+    """Validates a list of {device_id, quantity, priority} targets
+
+    Returns:
+        tuple: (is_valid, list of targets or list of errors)
+    """
+    if not isinstance(items, list) or not items:
+        return False, [{'message': 'Expected a non-empty list of targets'}]
+
+    if len(items) > MAX_PLAN_DEVICES:
+        return False, [{'message': f'Too many devices (max. {MAX_PLAN_DEVICES})'}]
+
+    targets = {}
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            device_id = int(item.get('device_id'))
+            quantity = int(item.get('quantity'))
+            priority = float(item.get('priority', 0))
+        except (AttributeError, ValueError, TypeError):
+            errors.append({'index': index, 'message': 'Invalid parameter values'})
+            continue
+
+        if quantity < 0:
+            errors.append({'index': index, 'message': 'Quantity must not be negative'})
+            continue
+
+        if device_id in targets:
+            errors.append({'index': index, 'message': 'Device listed more than once'})
+            continue
+
+        targets[device_id] = {'index': index, 'device_id': device_id, 'quantity': quantity, 'priority': priority}
+
+    if errors:
+        return False, errors
+
+    return True, list(targets.values())
+
+def load_bom_matrix(device_ids):
+    """Loads the flattened BOMs of the devices as a (parts x devices) matrix
+
+    The stock vector holds the unreserved stock plus the reservations of the
+    planned devices themselves.
+
+    Returns:
+        tuple: (part IDs, requirement matrix, stock vector)
+    """
+    import numpy as np
+
+    reserved_for_plan = select(func.sum(Reservation.quantity)).where(
+        Reservation.smd_part_id == SMDPart.id,
+        Reservation.hardware_device_id.in_(device_ids)
+    ).scalar_subquery()
+
+    rows = db.session.execute(
+        join_reserved_stock(select(
+            FlatBOMEntry.smd_part_id,
+            FlatBOMEntry.hardware_device_id,
+            FlatBOMEntry.quantity_required,
+            free_quantity() + func.coalesce(reserved_for_plan, 0)
+        ).join(
+            SMDPart, FlatBOMEntry.smd_part_id == SMDPart.id
+        )).where(FlatBOMEntry.hardware_device_id.in_(device_ids))
+    ).all()
+
+    part_ids = sorted({row[0] for row in rows})
+    part_index = {part_id: i for i, part_id in enumerate(part_ids)}
+    device_index = {device_id: j for j, device_id in enumerate(device_ids)}
+
+    requirements = np.zeros((len(part_ids), len(device_ids)), dtype=np.int64)
+    stock = np.zeros(len(part_ids), dtype=np.int64)
+    if rows:
+        data = np.array(rows, dtype=np.int64)
+        rows_idx = np.fromiter((part_index[p] for p in data[:, 0]), dtype=np.int64, count=len(data))
+        cols_idx = np.fromiter((device_index[d] for d in data[:, 1]), dtype=np.int64, count=len(data))
+        requirements[rows_idx, cols_idx] = data[:, 2]
+        stock[rows_idx] = np.maximum(data[:, 3], 0)
+
+    return part_ids, requirements, stock
+
+def max_units(requirement, remaining):
+    """Units of one device that can be built from the remaining stock"""
+    import numpy as np
+    used = requirement > 0
+    if not used.any():
+        return np.iinfo(np.int64).max
+    return int((remaining[used] // requirement[used]).min())
+
+def allocate_greedy(requirements, remaining, targets, order):
+    """Builds as many units as possible of each device in the given order"""
+    import numpy as np
+    planned = np.zeros(len(targets), dtype=np.int64)
+    for j in order:
+        units = min(int(targets[j]), max_units(requirements[:, j], remaining))
+        if units > 0:
+            planned[j] = units
+            remaining -= requirements[:, j] * units
+    return planned
+
+def plan_production(targets, strategy='priority'):
+    """Computes demand, shortages and a feasible production mix for target quantities
+
+    The total demand is one matrix product over the flattened BOMs. If stock is
+    short, the feasible mix is allocated either greedily by priority (higher
+    priority first, then in request order) or proportionally (the same share of
+    every target first, the rest greedily by priority).
+
+    Args:
+        targets (list): Parsed targets from parse_plan_targets
+        strategy (str): 'priority' or 'proportional'
+
+    Returns:
+        dict: Plan with devices, shortages and bottleneck parts
+    """
+    import numpy as np
+
+    device_ids = [target['device_id'] for target in targets]
+    names = dict(db.session.execute(
+        select(HardwareDevice.id, HardwareDevice.name).where(HardwareDevice.id.in_(device_ids))
+    ).all())
+
+    part_ids, requirements, stock = load_bom_matrix(device_ids)
+    target_units = np.array([target['quantity'] for target in targets], dtype=np.int64)
+
+    demand = requirements @ target_units
+    shortage = np.maximum(demand - stock, 0)
+
+    # Higher priority first, stable for equal priorities
+    order = sorted(range(len(targets)), key=lambda j: -targets[j]['priority'])
+    remaining = stock.copy()
+
+    if strategy == 'proportional' and demand.any():
+        # Largest common share of all targets that the stock covers
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratios = np.where(demand > 0, stock / np.maximum(demand, 1), np.inf)
+        share = min(1.0, float(ratios.min()))
+        planned = np.floor(target_units * share).astype(np.int64)
+        remaining -= requirements @ planned
+        planned += allocate_greedy(requirements, remaining, target_units - planned, order)
+    else:
+        planned = allocate_greedy(requirements, remaining, target_units, order)
+
+    # Bottlenecks: short parts ordered by the number of devices they block, then by shortage
+    short = np.nonzero(shortage)[0]
+    # (integer operands, a product of booleans would only say whether any device is blocked)
+    blocked = (requirements[short] > 0).astype(np.int64) @ (planned < target_units).astype(np.int64) \
+        if len(short) else np.array([], dtype=np.int64)
+    bottleneck_order = sorted(range(len(short)), key=lambda k: (-int(blocked[k]), -int(shortage[short[k]])))
+
+    part_info = {
+        part_id: (part_number, digikey_number)
+        for part_id, part_number, digikey_number in db.session.execute(
+            select(SMDPart.id, SMDPart.part_number, SMDPart.digikey_number)
+            .where(SMDPart.id.in_([part_ids[i] for i in short]))
+        ).all()
+    } if len(short) else {}
+
+    shortages = []
+    for k in bottleneck_order:
+        i = short[k]
+        part_number, digikey_number = part_info.get(part_ids[i], (None, None))
+        shortages.append({
+            'part_id': part_ids[i],
+            'part_number': part_number,
+            'digikey_number': digikey_number,
+            'required': int(demand[i]),
+            'available': int(stock[i]),
+            'missing': int(shortage[i]),
+            'devices_blocked': int(blocked[k])
+        })
+
+    devices = []
+    for j, target in enumerate(targets):
+        devices.append({
+            'device_id': target['device_id'],
+            'device_name': names.get(target['device_id']),
+            'target': int(target_units[j]),
+            'planned': int(planned[j]),
+            'has_bom': bool(requirements[:, j].any())
+        })
+
+    logger.info(f"Planned production of {len(targets)} devices over {len(part_ids)} parts ({strategy})")
+
+    return {
+        'strategy': strategy,
+        'feasible': not shortages,
+        'devices': devices,
+        'shortages': shortages,
+        'bottlenecks': [shortage['part_id'] for shortage in shortages[:10]]
+    }
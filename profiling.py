@@ -0,0 +1,379 @@
+"""On-demand profiling of single requests
+
+Disabled by default (PROFILING_ENABLED). When enabled, a request is profiled if
+it carries the header ``X-Profile-Token`` with the configured PROFILE_TOKEN, or
+at random with PROFILE_SAMPLE_RATE (sampled profiles are only kept for requests
+slower than PROFILE_SAMPLE_MIN_MS). Requests that are not profiled only pay for
+the header check and one random number.
+
+A profile consists of
+
+- <id>.folded: collapsed stacks of a wall-clock sampler (PROFILE_MODE=sample,
+  default), which includes the time spent waiting for the database and the
+  DigiKey API; input for flamegraph.pl, speedscope or inferno
+- <id>.prof: cProfile statistics instead (PROFILE_MODE=cprofile), for pstats or snakeviz
+- <id>.json: request data, the SQL statements with their durations and the
+  DigiKey calls of the request
+
+Profiles are kept in PROFILE_DIR, the oldest are deleted beyond PROFILE_MAX_FILES
+or PROFILE_MAX_BYTES. They are listed on /debug/profiles (with the token header).
+"""
+import cProfile
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from flask import g, has_request_context, request, jsonify, send_file, abort
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from query_budget import normalize_statement
+
+# Configure Logging
+logger = logging.getLogger('profiling')
+
+# Set to True to install the profiling hooks
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'False').lower() == 'true'
+# Secret for the X-Profile-Token header, header-triggered profiling is off without it
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+# Share of requests profiled at random (0.0 - 1.0)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.0))
+# Randomly profiled requests are only kept if they took at least this long
+PROFILE_SAMPLE_MIN_MS = float(os.environ.get('PROFILE_SAMPLE_MIN_MS', 500))
+# 'sample' (wall-clock stack sampler) or 'cprofile'
+PROFILE_MODE = os.environ.get('PROFILE_MODE', 'sample')
+# Directory of the profiles (default: profiles/ in the instance folder)
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '')
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 50))
+PROFILE_MAX_BYTES = int(os.environ.get('PROFILE_MAX_BYTES', 50 * 1024 * 1024))
+
+TOKEN_HEADER = 'X-Profile-Token'
+
+# Interval of the stack sampler
+SAMPLE_INTERVAL = 0.005
+# Requests profiled at the same time, further requests run unprofiled
+MAX_CONCURRENT_PROFILES = 2
+# Statements and calls kept per profile
+MAX_RECORDED_STATEMENTS = 2000
+MAX_RECORDED_CALLS = 500
+
+PROFILE_ID_PATTERN = re.compile(r'^[\w.-]+$')
+
+_slots = threading.BoundedSemaphore(MAX_CONCURRENT_PROFILES)
+_frame_labels = {}
+
+def frame_label(code):
+    """Flamegraph frame name of a code object: function (file:line)"""
+    label = _frame_labels.get(code)
+    if label is None:
+        filename = code.co_filename
+        if 'site-packages' in filename:
+            filename = filename.split('site-packages', 1)[1].lstrip(os.sep)
+        else:
+            filename = os.path.basename(filename)
+        label = f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(';', ':')
+        _frame_labels[code] = label
+    return label
+
+class StackSampler:
+    """Samples the call stack of one thread in wall-clock intervals
+
+    Waiting for I/O shows up as well, which cProfile's CPU-oriented view hides.
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                key = ';'.join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def folded(self):
+        """Collapsed stacks, one "frame;frame;frame count" line per stack"""
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+class RequestProfile:
+    """Profiler, SQL statements and external calls of one request"""
+
+    def __init__(self, trigger):
+        self.id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.trigger = trigger
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.duration = None
+        self.status = None
+        self.statements = []
+        self.statement_count = 0
+        self.statement_time = 0.0
+        self.calls = []
+        self.sampler = None
+        self.profiler = None
+
+    def offset_ms(self, moment):
+        return round((moment - self.start) * 1000, 3)
+
+    def begin(self):
+        if PROFILE_MODE == 'cprofile':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            self.sampler = StackSampler(threading.get_ident())
+            self.sampler.start()
+
+    def end(self):
+        self.duration = time.perf_counter() - self.start
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+
+    def add_statement(self, statement, started, duration):
+        self.statement_count += 1
+        self.statement_time += duration
+        if len(self.statements) < MAX_RECORDED_STATEMENTS:
+            self.statements.append({
+                'statement': normalize_statement(statement),
+                'offset_ms': self.offset_ms(started),
+                'duration_ms': round(duration * 1000, 3)
+            })
+
+    def add_call(self, details):
+        if len(self.calls) < MAX_RECORDED_CALLS:
+            self.calls.append(details)
+
+    def summary(self):
+        return {
+            'id': self.id,
+            'trigger': self.trigger,
+            'mode': 'cprofile' if self.profiler is not None else 'sample',
+            'started_at': self.started_at.isoformat(),
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'status': self.status,
+            'duration_ms': round(self.duration * 1000, 3),
+            'sql': {
+                'count': self.statement_count,
+                'total_ms': round(self.statement_time * 1000, 3),
+                'statements': self.statements,
+                'truncated': self.statement_count > len(self.statements)
+            },
+            'external_calls': self.calls
+        }
+
+def current_profile():
+    """Profile of the current request, None if it is not profiled"""
+    return g.get('profile') if has_request_context() else None
+
+def record_call(service, started, duration, **details):
+    """Adds an external call (e.g. a DigiKey request) to the current request's profile
+
+    Args:
+        service (str): Called service, e.g. 'digikey'
+        started (float): time.perf_counter() at the start of the call
+        duration (float): Duration in seconds
+        details: Further data of the call (operation, URL, status, ...)
+    """
+    profile = current_profile()
+    if profile is not None:
+        profile.add_call({
+            'service': service,
+            'offset_ms': profile.offset_ms(started),
+            'duration_ms': round(duration * 1000, 3),
+            **details
+        })
+
+def has_valid_token():
+    token = request.headers.get(TOKEN_HEADER)
+    return bool(PROFILE_TOKEN and token and hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode()))
+
+def profile_files(directory):
+    """(modified time, size, path) of all files in the profile directory, oldest first"""
+    try:
+        entries = [entry for entry in os.scandir(directory) if entry.is_file()]
+    except FileNotFoundError:
+        return []
+    return sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries)
+
+def prune_profiles(directory):
+    """Deletes the oldest profiles beyond PROFILE_MAX_FILES or PROFILE_MAX_BYTES"""
+    files = profile_files(directory)
+    profiles = {}
+    for modified, size, path in files:
+        profile_id = os.path.basename(path).rsplit('.', 1)[0]
+        oldest, total, paths = profiles.get(profile_id, (modified, 0, []))
+        profiles[profile_id] = (min(oldest, modified), total + size, paths + [path])
+
+    ordered = sorted(profiles.values())
+    total_bytes = sum(size for _, size, _ in ordered)
+    while ordered and (len(ordered) > PROFILE_MAX_FILES or total_bytes > PROFILE_MAX_BYTES):
+        _, size, paths = ordered.pop(0)
+        total_bytes -= size
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def save_profile(profile, directory):
+    """Writes the profile files and prunes old profiles
+
+    Returns:
+        str: Path of the JSON summary
+    """
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, profile.id)
+    if profile.profiler is not None:
+        profile.profiler.dump_stats(f"{base}.prof")
+    else:
+        with open(f"{base}.folded", 'w', encoding='utf-8') as folded_file:
+            folded_file.write(profile.sampler.folded())
+    with open(f"{base}.json", 'w', encoding='utf-8') as summary_file:
+        json.dump(profile.summary(), summary_file, indent=2)
+    prune_profiles(directory)
+    return f"{base}.json"
+
+def init_profiling(app):
+    """Registers the profiling hooks and the /debug/profiles endpoints
+
+    Must be called before the other request hooks are registered, so the
+    profile covers them.
+    """
+    if not PROFILING_ENABLED:
+        return
+
+    directory = PROFILE_DIR or os.path.join(app.instance_path, 'profiles')
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def start_profiled_statement(conn, cursor, statement, parameters, context, executemany):
+        if current_profile() is not None:
+            conn.info.setdefault('profile_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def record_profiled_statement(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('profile_query_start')
+        if not starts:
+            return
+        started = starts.pop()
+        profile = current_profile()
+        if profile is not None:
+            profile.add_statement(statement, started, time.perf_counter() - started)
+
+    @event.listens_for(Engine, 'handle_error')
+    def discard_profiled_statement(exception_context):
+        connection = exception_context.connection
+        starts = connection.info.get('profile_query_start') if connection is not None else None
+        if starts:
+            starts.pop()
+
+    @app.before_request
+    def start_profile():
+        if request.path.startswith('/debug/profiles'):
+            return
+        if has_valid_token():
+            trigger = 'header'
+        elif PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            trigger = 'sample'
+        else:
+            return
+        if not _slots.acquire(blocking=False):
+            return
+        g.profile = RequestProfile(trigger)
+        g.profile.begin()
+
+    @app.after_request
+    def add_profile_header(response):
+        profile = current_profile()
+        if profile is not None:
+            profile.status = response.status_code
+            if profile.trigger == 'header':
+                response.headers['X-Profile-Id'] = profile.id
+        return response
+
+    @app.teardown_request
+    def finish_profile(exception=None):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        try:
+            profile.end()
+            if profile.status is None and exception is not None:
+                profile.status = 500
+            if profile.trigger == 'sample' and profile.duration * 1000 < PROFILE_SAMPLE_MIN_MS:
+                return
+            save_profile(profile, directory)
+            logger.info(f"Profile {profile.id} saved: {request.endpoint} {profile.duration * 1000:.1f} ms")
+        except Exception as e:
+            logger.error(f"Error saving profile: {str(e)}")
+        finally:
+            _slots.release()
+
+    def require_token():
+        if not has_valid_token():
+            abort(403)
+
+    # List of the saved profiles, newest first
+    @app.route('/debug/profiles')
+    def list_profiles():
+        require_token()
+        profiles = []
+        for _, _, path in reversed(profile_files(directory)):
+            if not path.endswith('.json'):
+                continue
+            try:
+                with open(path, encoding='utf-8') as summary_file:
+                    summary = json.load(summary_file)
+            except (OSError, ValueError):
+                continue
+            profiles.append({key: summary.get(key) for key in (
+                'id', 'trigger', 'mode', 'started_at', 'method', 'path', 'endpoint', 'status', 'duration_ms'
+            )})
+        return jsonify({'success': True, 'profiles': profiles})
+
+    # Summary with the SQL statements and external calls of one profile
+    @app.route('/debug/profiles/<profile_id>')
+    def get_profile(profile_id):
+        require_token()
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            abort(404)
+        path = os.path.join(directory, f"{profile_id}.json")
+        if not os.path.exists(path):
+            abort(404)
+        return send_file(path, mimetype='application/json')
+
+    # Collapsed stacks (flamegraph input) or cProfile statistics of one profile
+    @app.route('/debug/profiles/<profile_id>/flamegraph')
+    def get_profile_stacks(profile_id):
+        require_token()
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            abort(404)
+        for extension, mimetype in (('folded', 'text/plain'), ('prof', 'application/octet-stream')):
+            path = os.path.join(directory, f"{profile_id}.{extension}")
+            if os.path.exists(path):
+                return send_file(path, mimetype=mimetype, as_attachment=True, download_name=f"{profile_id}.{extension}")
+        abort(404)
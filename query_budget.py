@@ -0,0 +1,146 @@
+import hashlib
+import logging
+import os
+import re
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Configure Logging
+logger = logging.getLogger('query_budget')
+
+# Identical statements repeated this often in one request are reported as N+1 pattern
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('SQL_N_PLUS_ONE_THRESHOLD', 5))
+
+# Query budget of routes without an entry in ROUTE_QUERY_BUDGETS
+DEFAULT_QUERY_BUDGET = int(os.environ.get('SQL_QUERY_BUDGET', 50))
+
+# Adds the query count and DB time as response headers (always on in debug and testing)
+SQL_DEBUG_HEADERS = os.environ.get('SQL_DEBUG_HEADERS', 'False').lower() == 'true'
+
+# Maximum number of SQL statements per request, by endpoint. The counts must not
+# grow with the number of parts or devices, so the budgets hold for any data size.
+ROUTE_QUERY_BUDGETS = {
+    'index': 20,
+    'missing_parts': 10,
+    'flat_bom': 10,
+    'api_reservations': 5,
+    'api_bom_usage': 10,
+    'api_plan': 15,
+    'update_stock': 40,
+    'update_part_usage': 30,
+    'build_device_units': 30,
+    'reserve_device_units': 20,
+    'release_device_units': 20,
+    'api_bulk_delete_parts': 20,
+    'api_bulk_delete_devices': 30,
+    'api_bom_reassign': 30
+}
+
+# Statements that are part of the transaction handling, not of the route's logic
+IGNORED_PREFIXES = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'PRAGMA')
+
+# Expanded IN lists and bound parameters of the supported drivers
+IN_LIST_PATTERN = re.compile(r'\(\s*(?:\?|%\(\w+\)s|%s)(?:\s*,\s*(?:\?|%\(\w+\)s|%s))*\s*\)')
+PARAMETER_PATTERN = re.compile(r'%\(\w+\)s|%s')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+class QueryBudgetExceeded(Exception):
+    """Raised in strict mode (tests) when a request runs more statements than its budget"""
+
+def normalize_statement(statement):
+    """Statement text without parameters, so repeated executions share one fingerprint"""
+    normalized = WHITESPACE_PATTERN.sub(' ', statement).strip()
+    normalized = IN_LIST_PATTERN.sub('(?...)', normalized)
+    return PARAMETER_PATTERN.sub('?', normalized)
+
+def fingerprint(statement):
+    return hashlib.sha1(normalize_statement(statement).encode('utf-8')).hexdigest()[:12]
+
+def get_query_budget(endpoint):
+    return ROUTE_QUERY_BUDGETS.get(endpoint, DEFAULT_QUERY_BUDGET)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_statements' in g:
+        conn.info.setdefault('budget_query_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('budget_query_start')
+    if not starts:
+        return
+    duration = time.perf_counter() - starts.pop()
+
+    if not has_request_context() or 'sql_statements' not in g:
+        return
+    g.sql_time += duration
+    if statement.lstrip().upper().startswith(IGNORED_PREFIXES):
+        return
+
+    key = fingerprint(statement)
+    entry = g.sql_statements.get(key)
+    if entry is None:
+        g.sql_statements[key] = [1, statement]
+    else:
+        entry[0] += 1
+
+@event.listens_for(Engine, 'handle_error')
+def discard_statement(exception_context):
+    """Failed statements never reach after_cursor_execute"""
+    connection = exception_context.connection
+    starts = connection.info.get('budget_query_start') if connection is not None else None
+    if starts:
+        starts.pop()
+
+def get_request_queries():
+    """Returns (statement count, DB time in seconds, repeated statements) of the current request
+
+    Repeated statements are (count, normalized statement) tuples of the statements
+    executed at least N_PLUS_ONE_THRESHOLD times, most frequent first.
+    """
+    statements = g.get('sql_statements') or {}
+    repeated = sorted(
+        ((count, normalize_statement(statement)) for count, statement in statements.values()
+         if count >= N_PLUS_ONE_THRESHOLD),
+        reverse=True
+    )
+    return sum(count for count, _ in statements.values()), g.get('sql_time', 0.0), repeated
+
+def init_query_budget(app):
+    """Registers the request hooks counting and checking the SQL statements of each request
+
+    Exceeded budgets are logged; with SQL_BUDGET_STRICT (default in testing) they
+    raise QueryBudgetExceeded, so a regression fails the tests that cover the route.
+    """
+    @app.before_request
+    def start_query_budget():
+        g.sql_statements = {}
+        g.sql_time = 0.0
+
+    @app.after_request
+    def check_query_budget(response):
+        if 'sql_statements' not in g:
+            return response
+
+        count, duration, repeated = get_request_queries()
+        endpoint = request.endpoint or 'unknown'
+
+        for repeat_count, statement in repeated:
+            logger.warning(f"Possible N+1 query in {endpoint}: {repeat_count}x {statement[:200]}")
+
+        if SQL_DEBUG_HEADERS or app.debug or app.testing:
+            response.headers['X-SQL-Query-Count'] = str(count)
+            response.headers['X-SQL-Query-Time'] = f"{duration * 1000:.2f}"
+            response.headers['X-SQL-N-Plus-One'] = str(len(repeated))
+            response.headers['Server-Timing'] = f'db;dur={duration * 1000:.2f};desc="{count} queries"'
+
+        budget = get_query_budget(endpoint)
+        if count > budget:
+            message = f"Query budget exceeded in {endpoint}: {count} statements (budget {budget})"
+            if app.config.get('SQL_BUDGET_STRICT', app.testing):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+        return response
@@ -0,0 +1,193 @@
+import logging
+from sqlalchemy import select, update, delete, func, case, and_, literal
+
+from models import db, SMDPart, FlatBOMEntry, Reservation, ReservedStock, utcnow
+from bom import dialect_insert
+from versions import mark_devices_changed
+
+# Configure Logging
+logger = logging.getLogger('reservations')
+
+def free_quantity():
+    """SQL expression for the unreserved stock of a part (needs join_reserved_stock)"""
+    return func.coalesce(SMDPart.quantity, 0) - func.coalesce(ReservedStock.quantity, 0)
+
+def own_reserved_quantity():
+    """SQL expression for the stock reserved for the device itself (needs join_device_reservations)"""
+    return func.coalesce(Reservation.quantity, 0)
+
+def device_available_quantity():
+    """SQL expression for the stock available to a device: unreserved plus its own reservations"""
+    return free_quantity() + own_reserved_quantity()
+
+def join_reserved_stock(query):
+    """Adds the reserved total of each part to a query over SMDPart"""
+    return query.outerjoin(ReservedStock, ReservedStock.smd_part_id == SMDPart.id)
+
+def join_device_reservations(query, device_column):
+    """Adds the reserved total and the reservation of the given device to a query over SMDPart"""
+    return join_reserved_stock(query).outerjoin(
+        Reservation,
+        and_(Reservation.smd_part_id == SMDPart.id, Reservation.hardware_device_id == device_column)
+    )
+
+def reserve_device(device_id, units):
+    """Reserves the stock for building units of a device in one transaction
+
+    Reservation rows and the reserved totals are both upserted with one
+    INSERT ... SELECT over the flattened BOM. If the reserved total of any part
+    exceeds its stock afterwards, nothing is changed.
+
+    Returns:
+        tuple: (success, number of reserved parts or list of shortages)
+    """
+    needed = (FlatBOMEntry.quantity_required * units)
+    in_bom = FlatBOMEntry.hardware_device_id == device_id
+
+    entry_count = db.session.execute(
+        select(func.count()).select_from(FlatBOMEntry).where(in_bom)
+    ).scalar()
+
+    if not entry_count:
+        db.session.rollback()
+        return False, []
+
+    stmt = dialect_insert(Reservation).from_select(
+        ['hardware_device_id', 'smd_part_id', 'quantity', 'updated_at'],
+        select(literal(device_id), FlatBOMEntry.smd_part_id, needed, literal(utcnow())).where(in_bom)
+    )
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[Reservation.hardware_device_id, Reservation.smd_part_id],
+        set_={
+            'quantity': Reservation.__table__.c.quantity + stmt.excluded.quantity,
+            'updated_at': stmt.excluded.updated_at
+        }
+    ))
+
+    stmt = dialect_insert(ReservedStock).from_select(
+        ['smd_part_id', 'quantity'],
+        select(FlatBOMEntry.smd_part_id, needed).where(in_bom)
+    )
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[ReservedStock.smd_part_id],
+        set_={'quantity': ReservedStock.__table__.c.quantity + stmt.excluded.quantity}
+    ))
+
+    shortages = db.session.execute(
+        select(
+            SMDPart.id, SMDPart.part_number, SMDPart.digikey_number,
+            needed, free_quantity() + needed
+        ).join(
+            SMDPart, FlatBOMEntry.smd_part_id == SMDPart.id
+        ).join(
+            ReservedStock, ReservedStock.smd_part_id == SMDPart.id
+        ).where(
+            in_bom,
+            func.coalesce(SMDPart.quantity, 0) < ReservedStock.quantity
+        ).order_by(SMDPart.id)
+    ).all()
+
+    if shortages:
+        db.session.rollback()
+        return False, [
+            {
+                'part_id': part_id,
+                'part_number': part_number,
+                'digikey_number': digikey_number,
+                'required': required,
+                'available': available,
+                'missing': required - available
+            }
+            for part_id, part_number, digikey_number, required, available in shortages
+        ]
+
+    mark_devices_changed([device_id])
+    db.session.commit()
+    logger.info(f"Reserved stock of {entry_count} parts for {units} units of device {device_id}")
+    return True, entry_count
+
+def consume_reservations(device_id, units=None):
+    """Reduces the reservations of a device by the requirement of units (all if None)
+
+    The reserved totals are decremented by exactly the released amounts. Runs in
+    the caller's transaction and does not commit.
+
+    Returns:
+        int: Number of reservations changed
+    """
+    reservations = Reservation.__table__
+
+    if units is None:
+        release = reservations.c.quantity
+    else:
+        required = func.coalesce(
+            select(FlatBOMEntry.quantity_required * units).where(
+                FlatBOMEntry.hardware_device_id == device_id,
+                FlatBOMEntry.smd_part_id == reservations.c.smd_part_id
+            ).scalar_subquery(),
+            0
+        )
+        release = case((reservations.c.quantity < required, reservations.c.quantity), else_=required)
+
+    own = reservations.c.hardware_device_id == device_id
+
+    # Totals first, while the reservations still hold the amounts to release
+    totals = ReservedStock.__table__
+    db.session.execute(
+        update(totals)
+        .where(totals.c.smd_part_id.in_(select(reservations.c.smd_part_id).where(own)))
+        .values(quantity=totals.c.quantity - select(release).where(
+            own, reservations.c.smd_part_id == totals.c.smd_part_id
+        ).scalar_subquery())
+    )
+
+    changed = db.session.execute(
+        update(reservations).where(own).values(quantity=reservations.c.quantity - release)
+    ).rowcount
+
+    db.session.execute(delete(reservations).where(own, reservations.c.quantity <= 0))
+    db.session.execute(delete(totals).where(totals.c.quantity <= 0))
+    mark_devices_changed([device_id])
+    return changed
+
+def release_reservations(device_id, units=None):
+    """Releases the reservations of a device for units (all if None) and commits"""
+    changed = consume_reservations(device_id, units)
+    db.session.commit()
+    logger.info(f"Released reservations of device {device_id} ({'all' if units is None else units} units)")
+    return changed
+
+def get_reservations(device_id=None, part_id=None):
+    """Returns reservations with part data, optionally filtered by device or part"""
+    query = select(
+        Reservation.hardware_device_id,
+        Reservation.smd_part_id,
+        SMDPart.part_number,
+        SMDPart.digikey_number,
+        Reservation.quantity,
+        func.coalesce(SMDPart.quantity, 0),
+        func.coalesce(ReservedStock.quantity, 0)
+    ).join(
+        SMDPart, Reservation.smd_part_id == SMDPart.id
+    ).outerjoin(
+        ReservedStock, ReservedStock.smd_part_id == SMDPart.id
+    ).order_by(Reservation.hardware_device_id, Reservation.smd_part_id)
+
+    if device_id is not None:
+        query = query.where(Reservation.hardware_device_id == device_id)
+    if part_id is not None:
+        query = query.where(Reservation.smd_part_id == part_id)
+
+    return [
+        {
+            'device_id': row_device_id,
+            'part_id': row_part_id,
+            'part_number': part_number,
+            'digikey_number': digikey_number,
+            'reserved': reserved,
+            'quantity': quantity,
+            'available': quantity - reserved_total
+        }
+        for row_device_id, row_part_id, part_number, digikey_number, reserved, quantity, reserved_total
+        in db.session.execute(query).all()
+    ]
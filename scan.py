@@ -0,0 +1,461 @@
+"""Barcode scan ingest for DigiKey reel and bag labels
+
+Scans are parsed from the 2D label (ISO/IEC 15434 with ANSI MH10.8.2 data
+identifiers) and resolved with one query over the indexed digikey_number column.
+Stock increments of concurrent requests are collected for SCAN_BATCH_WINDOW
+and committed in one transaction (group commit), so a scanning station does
+not wait for one SQLite write per label.
+
+Unknown parts are created right away from the DigiKey product cache or, without
+a cache entry, from the label data. Their description is then fetched from the
+API by a background thread, so a scan never waits for DigiKey.
+"""
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+from models import db, SMDPart
+from bom import dialect_insert
+from versions import mark_parts_changed
+from stock import resolve_part_ids, apply_stock_deltas, record_stock_movements
+from digikey_api import get_cached_products, fetch_product_details, is_digikey_part_number
+from metrics import SCANS, SCAN_BATCH_SIZE
+from tracing import traced
+
+# Configure Logging
+logger = logging.getLogger('scan')
+
+# Scans arriving within this time (seconds) are committed in one transaction
+SCAN_BATCH_WINDOW = float(os.environ.get('SCAN_BATCH_WINDOW', 0.05))
+# A request answers "queued" if its increments are not committed within this time
+SCAN_WAIT_SECONDS = 5
+# Upper bound for the scans of one request
+MAX_SCAN_BATCH = 500
+MAX_PAYLOAD_LENGTH = 1000
+# Parts waiting for their DigiKey data, further parts keep the label data
+ENRICH_QUEUE_SIZE = 1000
+
+# Description of parts created without product data (same as the add-part form)
+PLACEHOLDER_DESCRIPTION = "No description available"
+
+GROUP_SEPARATOR = '\x1d'
+RECORD_SEPARATOR = '\x1e'
+END_OF_TRANSMISSION = '\x04'
+LABEL_HEADER = '[)>'
+
+# Keyboard-wedge scanners cannot type control characters and send one of these instead
+SEPARATOR_SUBSTITUTES = {
+    '␝': GROUP_SEPARATOR, '{GS}': GROUP_SEPARATOR, '<GS>': GROUP_SEPARATOR,
+    '␞': RECORD_SEPARATOR, '{RS}': RECORD_SEPARATOR, '<RS>': RECORD_SEPARATOR,
+    '␄': END_OF_TRANSMISSION, '{EOT}': END_OF_TRANSMISSION, '<EOT>': END_OF_TRANSMISSION
+}
+SEPARATOR_PATTERN = re.compile(f"[{GROUP_SEPARATOR}{RECORD_SEPARATOR}{END_OF_TRANSMISSION}]")
+
+# Data identifiers used on DigiKey labels, longer identifiers first
+FIELD_IDENTIFIERS = (
+    ('30P', 'digikey_number'),
+    ('1P', 'manufacturer_part_number'),
+    ('1K', 'sales_order'),
+    ('P', 'customer_part_number'),
+    ('Q', 'quantity')
+)
+
+def parse_label(payload):
+    """Parses a DigiKey 2D label, or a plain DigiKey part number (1D barcode, typed)
+
+    Returns:
+        tuple: (is_valid, {digikey_number, manufacturer_part_number, quantity,
+               sales_order, from_label} or error message)
+    """
+    if not isinstance(payload, str) or not payload.strip():
+        return False, 'Empty scan'
+    if len(payload) > MAX_PAYLOAD_LENGTH:
+        return False, 'Scan too long'
+
+    for substitute, separator in SEPARATOR_SUBSTITUTES.items():
+        payload = payload.replace(substitute, separator)
+    payload = payload.strip(' \r\n')
+
+    if not payload.startswith(LABEL_HEADER):
+        number = payload.strip()
+        if len(number) > 100 or SEPARATOR_PATTERN.search(number):
+            return False, 'Not a DigiKey label or part number'
+        return True, {
+            'digikey_number': number,
+            'manufacturer_part_number': None,
+            'quantity': None,
+            'sales_order': None,
+            'from_label': False
+        }
+
+    fields = {}
+    for field in SEPARATOR_PATTERN.split(payload[len(LABEL_HEADER):]):
+        for identifier, key in FIELD_IDENTIFIERS:
+            if field.startswith(identifier):
+                fields.setdefault(key, field[len(identifier):].strip())
+                break
+
+    # P holds the customer part number, or the DigiKey number if there is none
+    digikey_number = fields.get('digikey_number') or fields.get('customer_part_number')
+    if not digikey_number or len(digikey_number) > 100:
+        return False, 'Label without DigiKey part number'
+
+    quantity = None
+    if fields.get('quantity'):
+        try:
+            quantity = int(fields['quantity'])
+        except ValueError:
+            return False, 'Invalid quantity on label'
+
+    return True, {
+        'digikey_number': digikey_number,
+        'manufacturer_part_number': fields.get('manufacturer_part_number') or None,
+        'quantity': quantity,
+        'sales_order': fields.get('sales_order') or None,
+        'from_label': True
+    }
+
+def parse_scans(items):
+    """Validates a list of scans (label payload strings or {payload, quantity} objects)
+
+    The quantity of an object overrides the quantity on the label. Unreadable
+    scans do not invalidate the others, they carry an error.
+
+    Returns:
+        tuple: (is_valid, list of parsed scans or error message)
+    """
+    if not isinstance(items, list) or not items:
+        return False, 'Expected a non-empty list of scans'
+
+    if len(items) > MAX_SCAN_BATCH:
+        return False, f'Too many scans (max. {MAX_SCAN_BATCH})'
+
+    scans = []
+    for index, item in enumerate(items):
+        quantity = None
+        if isinstance(item, dict):
+            quantity = item.get('quantity')
+            item = item.get('payload')
+
+        is_valid, result = parse_label(item)
+        if not is_valid:
+            scans.append({'index': index, 'error': result})
+            continue
+
+        if quantity is not None:
+            try:
+                result['quantity'] = int(quantity)
+            except (ValueError, TypeError):
+                scans.append({'index': index, 'error': 'Invalid quantity'})
+                continue
+
+        if result['quantity'] is None:
+            scans.append({'index': index, 'error': 'No quantity on label'})
+        elif result['quantity'] <= 0:
+            scans.append({'index': index, 'error': 'Quantity must be positive'})
+        else:
+            scans.append({'index': index, 'error': None, **result})
+
+    return True, scans
+
+class PendingIncrements:
+    """Stock increments of one request, waiting for the group commit"""
+
+    def __init__(self, increments, reference):
+        self.increments = increments
+        self.reference = reference
+        self.quantities = None
+        self.error = None
+        self.done = threading.Event()
+
+class StockBatcher:
+    """Commits the stock increments of concurrent requests in one transaction"""
+
+    def __init__(self):
+        self.app = None
+        self.pending = []
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def init_app(self, app):
+        self.app = app
+
+    def submit(self, increments, reference=None):
+        """Queues {part_id: quantity} increments and waits for their commit
+
+        Returns:
+            dict: Part ID -> stock after the commit (None for parts deleted in the
+                  meantime), or None if the commit takes longer than SCAN_WAIT_SECONDS
+                  (the increments are still applied)
+        """
+        pending = PendingIncrements(increments, reference)
+        with self.condition:
+            self.pending.append(pending)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='scan-batcher', daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+        if not pending.done.wait(SCAN_WAIT_SECONDS):
+            return None
+        if pending.error:
+            raise RuntimeError(pending.error)
+        return pending.quantities
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+            # Scans arriving in the meantime share the transaction
+            time.sleep(SCAN_BATCH_WINDOW)
+            with self.condition:
+                batch, self.pending = self.pending, []
+
+            by_reference = {}
+            for pending in batch:
+                by_reference.setdefault(pending.reference, []).append(pending)
+
+            for reference, group in by_reference.items():
+                try:
+                    with self.app.app_context():
+                        self.commit(group, reference)
+                except Exception as e:
+                    logger.error(f"Error committing {len(group)} scans: {str(e)}")
+                    for pending in group:
+                        pending.error = str(e)
+                finally:
+                    for pending in group:
+                        pending.done.set()
+
+    def commit(self, group, reference):
+        totals = {}
+        for pending in group:
+            for part_id, quantity in pending.increments.items():
+                totals[part_id] = totals.get(part_id, 0) + quantity
+
+        items = [
+            {'index': index, 'part_id': part_id, 'digikey_number': None, 'delta': quantity}
+            for index, (part_id, quantity) in enumerate(totals.items())
+        ]
+        success, result = apply_stock_deltas(items, 'scan', reference)
+        while not success:
+            # Parts deleted since they were resolved are left out (reported as unknown),
+            # the increments of the others are applied
+            deleted = {error['part_id'] for error in result if error['error'] == 'Part not found'}
+            if not deleted:
+                raise RuntimeError('Stock increments could not be applied')
+            logger.warning(f"Scanned parts deleted before the stock update: {sorted(deleted)}")
+            items = [item for item in items if item['part_id'] not in deleted]
+            success, result = apply_stock_deltas(items, 'scan', reference) if items else (True, [])
+
+        SCAN_BATCH_SIZE.observe(len(group))
+        quantities = {part['part_id']: part['quantity'] for part in result}
+        for pending in group:
+            pending.quantities = {part_id: quantities.get(part_id) for part_id in pending.increments}
+
+stock_batcher = StockBatcher()
+
+class PartEnricher:
+    """Fetches the DigiKey data of parts created from scans in a background thread"""
+
+    def __init__(self):
+        self.app = None
+        self.parts = queue.Queue(maxsize=ENRICH_QUEUE_SIZE)
+        self.queued = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def init_app(self, app):
+        self.app = app
+
+    def enqueue(self, digikey_number):
+        with self.lock:
+            if digikey_number in self.queued:
+                return
+            try:
+                self.parts.put_nowait(digikey_number)
+            except queue.Full:
+                logger.warning(f"Enrichment queue full, {digikey_number} keeps the label data")
+                return
+            self.queued.add(digikey_number)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='scan-enricher', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            digikey_number = self.parts.get()
+            try:
+                with self.app.app_context():
+                    self.enrich(digikey_number)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error enriching part {digikey_number}: {str(e)}")
+            finally:
+                with self.lock:
+                    self.queued.discard(digikey_number)
+
+    def enrich(self, digikey_number):
+        product, error = fetch_product_details(digikey_number)
+        if product is None:
+            logger.warning(f"No DigiKey data for scanned part {digikey_number}: {error}")
+            return
+
+        part = SMDPart.query.filter_by(digikey_number=digikey_number).first()
+        if part is None:
+            return
+        # Only placeholders are replaced, edits made in the meantime are kept
+        if part.description == PLACEHOLDER_DESCRIPTION and product.get('description'):
+            part.description = product['description']
+        if part.part_number == digikey_number and product.get('manufacturer_part_number'):
+            part.part_number = product['manufacturer_part_number']
+        db.session.commit()
+
+part_enricher = PartEnricher()
+
+def create_scanned_parts(scans_by_number):
+    """Creates the parts of unknown DigiKey numbers with their scanned stock in one transaction
+
+    Product data comes from the cache, or from the label until the background
+    lookup has completed. Numbers created by another request in the meantime are
+    skipped (ON CONFLICT DO NOTHING), the others are still created.
+
+    Returns:
+        dict: DigiKey number -> new part ID, without the skipped numbers (the
+              caller resolves them again and adds the stock to the existing parts)
+    """
+    cached = get_cached_products(list(scans_by_number))
+    rows = []
+    for number, scans in scans_by_number.items():
+        product = cached.get(number, {})
+        label_number = next((scan['manufacturer_part_number'] for scan in scans if scan['manufacturer_part_number']), None)
+        rows.append({
+            'part_number': product.get('manufacturer_part_number') or label_number or number,
+            'description': product.get('description') or PLACEHOLDER_DESCRIPTION,
+            'digikey_number': number,
+            'quantity': sum(scan['quantity'] for scan in scans)
+        })
+
+    stmt = dialect_insert(SMDPart).values(rows).on_conflict_do_nothing(index_elements=[SMDPart.digikey_number])
+    created = dict(db.session.execute(stmt.returning(SMDPart.digikey_number, SMDPart.id)).all())
+    if not created:
+        db.session.rollback()
+        return {}
+
+    # The ledger entry of a new part carries the reference of its first scan
+    by_reference = {}
+    for row in rows:
+        part_id = created.get(row['digikey_number'])
+        if part_id is not None:
+            by_reference.setdefault(scans_by_number[row['digikey_number']][0]['reference'], []).append(
+                (part_id, row['quantity'], row['quantity'])
+            )
+    for reference, changes in by_reference.items():
+        record_stock_movements(changes, 'scan', reference)
+    mark_parts_changed(created.values())
+    db.session.commit()
+
+    for row in rows:
+        if row['digikey_number'] in created and row['description'] == PLACEHOLDER_DESCRIPTION \
+                and is_digikey_part_number(row['digikey_number']):
+            part_enricher.enqueue(row['digikey_number'])
+    return created
+
+@traced()
+def ingest_scans(scans, reference=None):
+    """Adds the scanned quantities to the stock
+
+    Args:
+        scans (list): Parsed scans from parse_scans
+        reference (str): Ledger reference, by default the sales order on the label
+
+    Returns:
+        list: One result per scan: {index, status, part_id, digikey_number, quantity_added, quantity}
+              with status applied, created, queued (commit still pending), unknown or invalid
+    """
+    results = {}
+    valid = []
+    for scan in scans:
+        if scan['error']:
+            results[scan['index']] = {'index': scan['index'], 'status': 'invalid', 'error': scan['error']}
+        else:
+            scan['reference'] = (reference or scan['sales_order'] or '')[:100] or None
+            valid.append(scan)
+
+    _, by_digikey = resolve_part_ids(digikey_numbers=[scan['digikey_number'] for scan in valid])
+
+    # Unknown parts are created if the scan is a DigiKey label or looks like a DigiKey number
+    unknown = {}
+    for scan in valid:
+        number = scan['digikey_number']
+        if number in by_digikey:
+            continue
+        if scan['from_label'] or is_digikey_part_number(number):
+            unknown.setdefault(number, []).append(scan)
+        else:
+            results[scan['index']] = {'index': scan['index'], 'status': 'unknown', 'digikey_number': number, 'error': 'Part not found'}
+
+    created = {}
+    if unknown:
+        created = create_scanned_parts(unknown)
+        existing = [number for number in unknown if number not in created]
+        if existing:
+            # Created by a concurrent scan, the stock is added to the existing parts
+            by_digikey.update(resolve_part_ids(digikey_numbers=existing)[1])
+    # End the read transaction, so later reads see the batched commits
+    db.session.rollback()
+
+    for number, part_id in created.items():
+        for scan in unknown[number]:
+            results[scan['index']] = {
+                'index': scan['index'], 'status': 'created', 'part_id': part_id,
+                'digikey_number': number, 'quantity_added': scan['quantity']
+            }
+
+    increments = {}
+    for scan in valid:
+        part_id = by_digikey.get(scan['digikey_number'])
+        if part_id is not None and scan['index'] not in results:
+            increments.setdefault(scan['reference'], {})
+            increments[scan['reference']][part_id] = increments[scan['reference']].get(part_id, 0) + scan['quantity']
+
+    quantities = {}
+    queued = set()
+    for scan_reference, part_increments in increments.items():
+        committed = stock_batcher.submit(part_increments, scan_reference)
+        if committed is None:
+            queued.update(part_increments)
+        else:
+            quantities.update(committed)
+
+    for scan in valid:
+        if scan['index'] in results:
+            continue
+        part_id = by_digikey.get(scan['digikey_number'])
+        if part_id is None or (part_id not in queued and quantities.get(part_id) is None):
+            results[scan['index']] = {'index': scan['index'], 'status': 'unknown', 'digikey_number': scan['digikey_number'], 'error': 'Part not found'}
+            continue
+        results[scan['index']] = {
+            'index': scan['index'], 'status': 'queued' if part_id in queued else 'applied', 'part_id': part_id,
+            'digikey_number': scan['digikey_number'], 'quantity_added': scan['quantity']
+        }
+
+    # Stock of all touched parts after the commits, for the page to show
+    final = {part_id: quantity for part_id, quantity in quantities.items() if quantity is not None}
+    for number, part_id in created.items():
+        final.setdefault(part_id, sum(scan['quantity'] for scan in unknown[number]))
+    ordered = [results[index] for index in sorted(results)]
+    for result in ordered:
+        if result.get('part_id') in final:
+            result['quantity'] = final[result['part_id']]
+        SCANS.inc(result=result['status'])
+    return ordered
+
+def init_scan(app):
+    """Binds the scan ingest background threads to the app"""
+    stock_batcher.init_app(app)
+    part_enricher.init_app(app)
@@ -0,0 +1,126 @@
+import logging
+import os
+from sqlalchemy import select, func, case, true
+
+from models import db, SMDPart, FlatBOMEntry, Reservation
+from reservations import free_quantity, join_reserved_stock
+from digikey_api import fetch_digikey_pricing
+from tracing import traced
+
+# Configure Logging
+logger = logging.getLogger('shopping')
+
+# Uncached prices requested from DigiKey per shopping list, the rest is reported as unpriced
+SHOPPING_PRICE_LOOKUPS = int(os.environ.get('SHOPPING_PRICE_LOOKUPS', 20))
+
+def shopping_list_query(targets=None):
+    """Shortages of all parts for building the targets, one row per part, largest shortage first
+
+    Requirements of all devices are summed per part (and so per DigiKey number)
+    in one grouped query. The available stock is the unreserved stock plus the
+    reservations of the planned devices themselves.
+
+    Args:
+        targets (list): {device_id, quantity} per device, None for one unit of every device
+    """
+    if targets is None:
+        units = FlatBOMEntry.quantity_required
+        demand_filter = FlatBOMEntry.quantity_required > 0
+        reservation_filter = true()
+    else:
+        multipliers = {target['device_id']: target['quantity'] for target in targets if target['quantity'] > 0}
+        units = FlatBOMEntry.quantity_required * case(multipliers, value=FlatBOMEntry.hardware_device_id, else_=0)
+        demand_filter = FlatBOMEntry.hardware_device_id.in_(list(multipliers))
+        reservation_filter = Reservation.hardware_device_id.in_(list(multipliers))
+
+    demand = select(
+        FlatBOMEntry.smd_part_id.label('part_id'),
+        func.sum(units).label('required'),
+        func.count().label('devices')
+    ).where(demand_filter).group_by(FlatBOMEntry.smd_part_id).subquery()
+
+    reserved = select(
+        Reservation.smd_part_id.label('part_id'),
+        func.sum(Reservation.quantity).label('quantity')
+    ).where(reservation_filter).group_by(Reservation.smd_part_id).subquery()
+
+    available = (free_quantity() + func.coalesce(reserved.c.quantity, 0)).label('available')
+    missing = (demand.c.required - available).label('missing')
+    return join_reserved_stock(select(
+        SMDPart.id.label('part_id'),
+        SMDPart.part_number.label('part_number'),
+        SMDPart.digikey_number.label('digikey_number'),
+        SMDPart.description.label('description'),
+        demand.c.devices.label('devices'),
+        demand.c.required.label('required'),
+        available,
+        missing
+    ).join(
+        demand, demand.c.part_id == SMDPart.id
+    )).outerjoin(
+        reserved, reserved.c.part_id == SMDPart.id
+    ).where(
+        demand.c.required > available
+    ).order_by(missing.desc(), SMDPart.id)
+
+def price_order(pricing, quantity):
+    """Order quantity and price of buying at least quantity units
+
+    The order is rounded up to the minimum order quantity and priced with the
+    largest price break it reaches.
+
+    Returns:
+        tuple: (order quantity, unit price, extended price); prices are None without price data
+    """
+    order_quantity = max(quantity, pricing.get('minimum_order_quantity') or 1)
+    unit_price = pricing.get('unit_price')
+    for price_break in pricing.get('price_breaks', []):
+        if price_break['quantity'] <= order_quantity:
+            unit_price = price_break['unit_price']
+
+    if unit_price is None:
+        return order_quantity, None, None
+    return order_quantity, unit_price, round(unit_price * order_quantity, 2)
+
+@traced()
+def build_shopping_list(targets=None, with_pricing=False):
+    """Shopping list for building the targets, optionally with DigiKey prices
+
+    Returns:
+        dict: items (one per DigiKey number) and totals; with pricing, the
+              estimated cost of the priced items and the unpriced DigiKey numbers
+    """
+    # Targets of zero units need nothing (and would leave the CASE without branches)
+    if targets is not None and not any(target['quantity'] > 0 for target in targets):
+        return {'items': [], 'totals': {'parts': 0, 'missing_units': 0}}
+
+    items = [dict(row._mapping) for row in db.session.execute(shopping_list_query(targets))]
+    totals = {
+        'parts': len(items),
+        'missing_units': sum(item['missing'] for item in items)
+    }
+
+    if with_pricing and items:
+        pricing, unpriced = fetch_digikey_pricing([item['digikey_number'] for item in items], SHOPPING_PRICE_LOOKUPS)
+        currency = None
+        estimated_cost = 0.0
+        for item in items:
+            part_pricing = pricing.get(item['digikey_number'])
+            if part_pricing is None:
+                item.update({'order_quantity': item['missing'], 'unit_price': None, 'extended_price': None})
+                continue
+            order_quantity, unit_price, extended_price = price_order(part_pricing, item['missing'])
+            item.update({'order_quantity': order_quantity, 'unit_price': unit_price, 'extended_price': extended_price})
+            currency = part_pricing.get('currency', currency)
+            if extended_price is not None:
+                estimated_cost += extended_price
+            else:
+                unpriced.append(item['digikey_number'])
+
+        totals.update({
+            'estimated_cost': round(estimated_cost, 2),
+            'currency': currency,
+            'unpriced': unpriced
+        })
+
+    return {'items': items, 'totals': totals}
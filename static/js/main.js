@@ -236,7 +236,165 @@ function formatError(error) {
     return String(error);
 }
 
+/**
+ * Patch the inventory rows and device rows changed by an edit in place
+ * @param {Object} delta - {parts: [{id, quantity, status}], devices: [{id, buildable, percentage}]}
+ * @returns {boolean} False if a changed item has no row on the page, the page must then be reloaded
+ */
+function applyInventoryDelta(delta) {
+    if (!delta) {
+        return false;
+    }
+    let complete = true;
+    
+    (delta.parts || []).forEach(part => {
+        const row = document.querySelector(`#inventory-table tr[data-part-id="${part.id}"]`);
+        if (!row) {
+            complete = false;
+            return;
+        }
+        
+        row.classList.remove('part-status-ok', 'part-status-low', 'part-status-missing');
+        if (part.status) {
+            row.classList.add(part.status);
+        }
+        
+        const quantity = part.quantity ?? 0;
+        safeQuerySelector(`.stock-qty-display[data-part-id="${part.id}"]`, stockDisplay => {
+            stockDisplay.textContent = quantity;
+            stockDisplay.classList.toggle('bg-danger', quantity == 0);
+            stockDisplay.classList.toggle('bg-primary', quantity != 0);
+        });
+        safeQuerySelector(`.edit-stock-btn[data-part-id="${part.id}"]`, editButton => {
+            editButton.dataset.partQuantity = quantity;
+        });
+    });
+    
+    (delta.devices || []).forEach(device => {
+        const row = document.querySelector(`.device-row[data-device-id="${device.id}"]`);
+        if (!row || device.buildable === null) {
+            // The device got its first or lost its last BOM entry, the card changes
+            if (row || device.buildable !== null) {
+                complete = false;
+            }
+            return;
+        }
+        
+        safeQuerySelector(`.device-row[data-device-id="${device.id}"] .buildable-count`, count => {
+            count.textContent = device.buildable;
+        });
+        safeQuerySelector(`.device-row[data-device-id="${device.id}"] .progress-bar`, bar => {
+            bar.style.width = `${device.percentage}%`;
+            bar.setAttribute('aria-valuenow', device.percentage);
+            bar.classList.remove('bg-success', 'bg-warning', 'bg-danger');
+            bar.classList.add(device.percentage >= 100 ? 'bg-success' : device.percentage >= 50 ? 'bg-warning' : 'bg-danger');
+            bar.textContent = device.percentage < 100 ? `${device.percentage}%` : '';
+        });
+    });
+    
+    return complete;
+}
+
+/**
+ * Keeps the page current with the changes of other stations (Server-Sent Events)
+ * 
+ * Deltas are patched in place. Changes that cannot be shown without a reload
+ * (new rows, removed devices, large imports, changes missed while disconnected)
+ * show a notice with a reload button instead of reloading under the user's hands.
+ */
+function connectChangeFeed() {
+    if (!window.EventSource || !document.getElementById('inventory-table')) {
+        return;
+    }
+    
+    let lastVersion = null;
+    const showReloadNotice = () => {
+        safeQuerySelector('#live-update-notice', notice => notice.classList.remove('d-none'));
+    };
+    
+    const source = new EventSource('/api/changes');
+    
+    source.addEventListener('hello', event => {
+        const data = JSON.parse(event.data);
+        // After a reconnect: changes made while the feed was closed were missed
+        if (lastVersion !== null && data.version > lastVersion) {
+            showReloadNotice();
+        }
+        lastVersion = Math.max(lastVersion ?? 0, data.version ?? 0);
+    });
+    
+    source.addEventListener('inventory', event => {
+        const data = JSON.parse(event.data);
+        lastVersion = Math.max(lastVersion ?? 0, data.version ?? 0);
+        if (data.reload) {
+            showReloadNotice();
+            return;
+        }
+        
+        (data.removed_parts || []).forEach(partId => {
+            safeQuerySelector(`#inventory-table tr[data-part-id="${partId}"]`, row => row.remove());
+        });
+        const removedDeviceShown = (data.removed_devices || []).some(
+            deviceId => document.querySelector(`.device-row[data-device-id="${deviceId}"]`)
+        );
+        
+        if (!applyInventoryDelta(data) || removedDeviceShown) {
+            showReloadNotice();
+        }
+    });
+}
+
 document.addEventListener('DOMContentLoaded', function() {
+    // Live updates from other stations
+    connectChangeFeed();
+    safeQuerySelector('#live-update-reload', button => {
+        addSafeEventListener(button, 'click', () => window.location.reload());
+    });
+    
+    // Barcode scanner input: every label is booked when the scanner sends Enter
+    safeQuerySelector('#scan-input', scanInput => {
+        addSafeEventListener(scanInput, 'keydown', function(event) {
+            if (event.key !== 'Enter' || !this.value.trim()) {
+                return;
+            }
+            event.preventDefault();
+            const payload = this.value;
+            this.value = '';
+            
+            fetch('/api/scan', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Accept': 'application/json',
+                    'X-Requested-With': 'XMLHttpRequest'
+                },
+                body: JSON.stringify([payload])
+            })
+            .then(response => response.json())
+            .then(data => {
+                const result = (data.results || [])[0] || {};
+                safeQuerySelector('#scan-feedback', feedback => {
+                    feedback.classList.toggle('text-danger', !data.success);
+                    feedback.classList.toggle('text-success', !!data.success);
+                    feedback.textContent = data.success
+                        ? `${result.digikey_number}: +${result.quantity_added}` + (result.quantity !== undefined ? ` (stock ${result.quantity})` : '') + (result.status === 'created' ? ' - new part' : '')
+                        : (result.error || data.message || 'Scan failed');
+                });
+                // New parts have no row yet, the notice offers a reload instead of interrupting the scanning
+                if (data.delta && !applyInventoryDelta(data.delta)) {
+                    safeQuerySelector('#live-update-notice', notice => notice.classList.remove('d-none'));
+                }
+            })
+            .catch(error => {
+                console.error('Error:', error);
+                safeQuerySelector('#scan-feedback', feedback => {
+                    feedback.classList.add('text-danger');
+                    feedback.textContent = 'Error booking scan: ' + formatError(error);
+                });
+            });
+        });
+    });
+    
     // BOM upload form intercept and pass tracking_id
     safeQuerySelector('#bom-import-form', form => {
         addSafeEventListener(form, 'submit', function(event) {
@@ -848,6 +1006,7 @@ document.addEventListener('DOMContentLoaded', function() {
                             method: 'POST',
                             headers: {
                                 'Content-Type': 'application/x-www-form-urlencoded',
+                                'Accept': 'application/json',
                                 'X-Requested-With': 'XMLHttpRequest'
                             },
                             body: `part_id=${partId}&quantity=${qty}`
@@ -856,28 +1015,13 @@ document.addEventListener('DOMContentLoaded', function() {
                             if (!response.ok) {
                                 throw new Error('Network response was not ok: ' + response.status);
                             }
-                            return response.text();
+                            return response.json();
                         })
-                        .then(() => {
-                            // Update stock in UI
-                            safeQuerySelector(`.stock-qty-display[data-part-id="${partId}"]`, stockDisplay => {
-                                stockDisplay.textContent = qty;
-                                
-                                // Change badge color based on quantity
-                                if (qty == 0) {
-                                    stockDisplay.classList.remove('bg-primary');
-                                    stockDisplay.classList.add('bg-danger');
-                                } else {
-                                    stockDisplay.classList.remove('bg-danger');
-                                    stockDisplay.classList.add('bg-primary');
-                                }
-                            });
-                            
-                            // Also update the button's data attribute
-                            this.dataset.partQuantity = qty;
-                            
-                            // Update component status class (requires reload)
-                            window.location.reload();
+                        .then(data => {
+                            // Update stock, status class and buildability of the affected devices
+                            if (!applyInventoryDelta(data.delta)) {
+                                window.location.reload();
+                            }
                         })
                         .catch(error => {
                             console.error('Error:', error);
@@ -891,6 +1035,77 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
 
+    // Build units of a device (consumes the stock of all BOM parts)
+    safeQuerySelectorAll('.build-device-btn', buildDeviceBtns => {
+        buildDeviceBtns.forEach(btn => {
+            addSafeEventListener(btn, 'click', function() {
+                const deviceId = this.dataset.deviceId;
+                const deviceName = this.dataset.deviceName;
+                
+                if (!deviceId || !deviceName) {
+                    alert('Error: Device information not found');
+                    return;
+                }
+                
+                const units = prompt(`How many units of "${deviceName}" were built? The stock of all BOM parts will be reduced.`, '1');
+                
+                if (units === null) {
+                    return;
+                }
+                
+                if (isNaN(units) || parseInt(units, 10) <= 0) {
+                    alert('Please enter a positive number.');
+                    return;
+                }
+                
+                // Show loading status
+                const originalInnerHTML = this.innerHTML;
+                this.innerHTML = '<i class="fas fa-spinner fa-spin"></i>';
+                this.disabled = true;
+                
+                fetch(`/devices/${deviceId}/build`, {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                        'Accept': 'application/json',
+                        'X-Requested-With': 'XMLHttpRequest'
+                    },
+                    body: JSON.stringify({ units: parseInt(units, 10) })
+                })
+                .then(response => response.json())
+                .then(data => {
+                    if (data.success) {
+                        alert(data.message);
+                        if (!applyInventoryDelta(data.delta)) {
+                            window.location.reload();
+                        }
+                        // Reset button
+                        this.innerHTML = originalInnerHTML;
+                        this.disabled = false;
+                    } else {
+                        let message = 'Error: ' + (data.message || 'Unknown error');
+                        if (data.missing_parts && data.missing_parts.length > 0) {
+                            message += '\n\n' + data.missing_parts
+                                .map(part => `${part.part_number}: ${part.missing} missing`)
+                                .join('\n');
+                        }
+                        alert(message);
+                        // Reset button
+                        this.innerHTML = originalInnerHTML;
+                        this.disabled = false;
+                    }
+                })
+                .catch(error => {
+                    console.error('Error building device:', error);
+                    alert('Error building device: ' + formatError(error));
+                    // Reset button
+                    this.innerHTML = originalInnerHTML;
+                    this.disabled = false;
+                });
+            });
+        });
+    });
+
     // Delete function for devices
     safeQuerySelectorAll('.delete-device-btn', deleteDeviceBtns => {
         deleteDeviceBtns.forEach(btn => {
@@ -1305,6 +1520,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/x-www-form-urlencoded',
+                    'Accept': 'application/json',
                     'X-Requested-With': 'XMLHttpRequest'
                 },
                 body: `part_id=${partId}&device_id=${deviceId}&qty_required=${quantity}`
@@ -1335,8 +1551,10 @@ document.addEventListener('DOMContentLoaded', function() {
                         badge.dataset.qty = quantity;
                     });
                     
-                    // Reload page to update all views
-                    window.location.reload();
+                    // Update status class and buildability of the affected devices
+                    if (!applyInventoryDelta(data.delta)) {
+                        window.location.reload();
+                    }
                 } else {
                     alert('Error: ' + (data.message || 'Unknown error'));
                 }
@@ -1376,6 +1594,7 @@ document.addEventListener('DOMContentLoaded', function() {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/x-www-form-urlencoded',
+                        'Accept': 'application/json',
                         'X-Requested-With': 'XMLHttpRequest'
                     },
                     body: `part_id=${partId}&device_id=${deviceId}&qty_required=0`
@@ -1403,8 +1622,11 @@ document.addEventListener('DOMContentLoaded', function() {
                             }
                         });
                         
-                        // Reload page to update all views
-                        window.location.reload();
+                        // Without usages the row shows the "not assigned" badge, which needs a reload
+                        const hasUsages = document.querySelector(`.device-badge[data-part-id="${partId}"][data-device-id]`);
+                        if (!hasUsages || !applyInventoryDelta(data.delta)) {
+                            window.location.reload();
+                        }
                     } else {
                         alert('Error: ' + (data.message || 'Unknown error'));
                     }
@@ -0,0 +1,495 @@
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+from sqlalchemy import update, select, bindparam, func, case, and_, literal, text
+
+from models import db, SMDPart, FlatBOMEntry, Reservation, ReservedStock, StockMovement, StockSnapshot, utcnow
+from reservations import device_available_quantity, join_device_reservations, consume_reservations
+from versions import mark_parts_changed, mark_devices_changed
+
+# Configure Logging
+logger = logging.getLogger('stock')
+
+# Upper bound for one batch of stock changes
+MAX_DELTA_BATCH = 1000
+
+# Seconds between two ledger snapshots (0 disables the scheduler)
+STOCK_SNAPSHOT_INTERVAL = int(os.environ.get('STOCK_SNAPSHOT_INTERVAL', 3600))
+
+def parse_stock_deltas(items):
+    """Validates a list of {part_id|digikey_number, delta} items
+
+    Returns:
+        tuple: (is_valid, parsed items or list of errors)
+    """
+    if not isinstance(items, list) or not items:
+        return False, [{'index': None, 'error': 'Expected a non-empty list of deltas'}]
+
+    if len(items) > MAX_DELTA_BATCH:
+        return False, [{'index': None, 'error': f'Too many deltas (max. {MAX_DELTA_BATCH})'}]
+
+    parsed = []
+    errors = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({'index': index, 'error': 'Invalid item'})
+            continue
+
+        part_id = item.get('part_id')
+        digikey_number = item.get('digikey_number')
+
+        if (part_id is None) == (digikey_number is None):
+            errors.append({'index': index, 'error': 'Exactly one of part_id or digikey_number is required'})
+            continue
+
+        # Only JSON integers: int() would truncate 2.7 and accept true or "5"
+        delta = item.get('delta')
+        if not isinstance(delta, int) or isinstance(delta, bool):
+            errors.append({'index': index, 'error': 'Invalid delta'})
+            continue
+
+        if part_id is not None:
+            try:
+                part_id = int(part_id)
+            except (ValueError, TypeError):
+                errors.append({'index': index, 'error': 'Invalid part_id'})
+                continue
+        else:
+            digikey_number = str(digikey_number).strip()
+            if not digikey_number or len(digikey_number) > 100:
+                errors.append({'index': index, 'error': 'Invalid digikey_number'})
+                continue
+
+        parsed.append({
+            'index': index,
+            'part_id': part_id,
+            'digikey_number': digikey_number,
+            'delta': delta
+        })
+
+    if errors:
+        return False, errors
+
+    return True, parsed
+
+def resolve_part_ids(part_ids=(), digikey_numbers=()):
+    """Maps part IDs and DigiKey numbers to existing part IDs with one query each"""
+    found_ids = set()
+    by_digikey = {}
+
+    if part_ids:
+        found_ids = set(db.session.execute(
+            select(SMDPart.id).where(SMDPart.id.in_(set(part_ids)))
+        ).scalars())
+
+    if digikey_numbers:
+        by_digikey = dict(db.session.execute(
+            select(SMDPart.digikey_number, SMDPart.id).where(SMDPart.digikey_number.in_(set(digikey_numbers)))
+        ).all())
+
+    return found_ids, by_digikey
+
+def apply_stock_deltas(items, reason='delta', reference=None):
+    """Applies relative stock changes atomically in a single transaction
+
+    The quantity is changed with ``quantity = quantity + :delta`` directly in SQL,
+    and a row is only updated if the result stays non-negative. If any part is
+    unknown or would go negative, the whole batch is rolled back.
+
+    Args:
+        items (list): Parsed items from parse_stock_deltas
+        reason (str): Reason stored in the stock movement ledger
+        reference (str): Optional reference stored in the ledger
+
+    Returns:
+        tuple: (success, list of {part_id, digikey_number, quantity} or list of errors)
+    """
+    found_ids, by_digikey = resolve_part_ids(
+        [item['part_id'] for item in items if item['part_id'] is not None],
+        [item['digikey_number'] for item in items if item['digikey_number'] is not None]
+    )
+
+    # Sum up deltas per part, so repeated scans of the same reel cost one update
+    totals = {}
+    errors = []
+    for item in items:
+        if item['part_id'] is not None:
+            part_id = item['part_id'] if item['part_id'] in found_ids else None
+        else:
+            part_id = by_digikey.get(item['digikey_number'])
+
+        if part_id is None:
+            errors.append({
+                'index': item['index'],
+                'part_id': item['part_id'],
+                'digikey_number': item['digikey_number'],
+                'error': 'Part not found'
+            })
+            continue
+
+        totals[part_id] = totals.get(part_id, 0) + item['delta']
+
+    if errors:
+        db.session.rollback()
+        return False, errors
+
+    params = [{'b_part_id': part_id, 'b_delta': delta} for part_id, delta in totals.items() if delta]
+
+    if params:
+        parts = SMDPart.__table__
+        new_quantity = func.coalesce(parts.c.quantity, 0) + bindparam('b_delta')
+        stmt = update(parts)\
+            .where(parts.c.id == bindparam('b_part_id'))\
+            .where(new_quantity >= 0)\
+            .values(quantity=new_quantity)
+
+        if db.engine.dialect.supports_sane_multi_rowcount:
+            updated = db.session.execute(stmt, params).rowcount
+        else:
+            updated = sum(db.session.execute(stmt, param).rowcount for param in params)
+
+        if updated != len(params):
+            # A part would have gone negative or was deleted since it was resolved - report which ones
+            db.session.rollback()
+            current = dict(db.session.execute(
+                select(SMDPart.id, func.coalesce(SMDPart.quantity, 0)).where(SMDPart.id.in_(totals.keys()))
+            ).all())
+            db.session.rollback()
+
+            for part_id, delta in totals.items():
+                if part_id not in current:
+                    if delta:
+                        errors.append({'part_id': part_id, 'error': 'Part not found'})
+                elif current[part_id] + delta < 0:
+                    errors.append({
+                        'part_id': part_id,
+                        'available': current[part_id],
+                        'delta': delta,
+                        'error': 'Quantity would become negative'
+                    })
+            return False, errors
+
+    rows = db.session.execute(
+        select(SMDPart.id, SMDPart.digikey_number, SMDPart.quantity).where(SMDPart.id.in_(totals.keys()))
+    ).all()
+    record_stock_movements(
+        [(part_id, totals[part_id], quantity) for part_id, _, quantity in rows],
+        reason, reference
+    )
+    db.session.commit()
+
+    logger.info(f"Applied {len(params)} stock deltas")
+    return True, [
+        {'part_id': part_id, 'digikey_number': digikey_number, 'quantity': quantity}
+        for part_id, digikey_number, quantity in rows
+    ]
+
+def build_device(device_id, units):
+    """Consumes the stock for building units of a device in one transaction
+
+    All parts of the device's flattened BOM (including sub-assemblies) are
+    decremented with a single UPDATE using a correlated subquery. Each row is
+    only updated if the stock suffices; if any part falls short, nothing is
+    changed. Stock reserved for other devices is not used, the device's own
+    reservations are consumed by the build.
+
+    Returns:
+        tuple: (success, number of consumed parts or list of shortages)
+    """
+    required = (FlatBOMEntry.quantity_required * units)
+    required_for_part = select(required)\
+        .where(FlatBOMEntry.smd_part_id == SMDPart.id, FlatBOMEntry.hardware_device_id == device_id)\
+        .scalar_subquery()
+    bom_part_ids = select(FlatBOMEntry.smd_part_id).where(FlatBOMEntry.hardware_device_id == device_id)
+
+    entry_count = db.session.execute(
+        select(func.count()).select_from(FlatBOMEntry).where(FlatBOMEntry.hardware_device_id == device_id)
+    ).scalar()
+
+    if not entry_count:
+        db.session.rollback()
+        return False, []
+
+    parts = SMDPart.__table__
+    reserved_total = select(ReservedStock.quantity)\
+        .where(ReservedStock.smd_part_id == parts.c.id)\
+        .scalar_subquery()
+    reserved_own = select(Reservation.quantity)\
+        .where(Reservation.smd_part_id == parts.c.id, Reservation.hardware_device_id == device_id)\
+        .scalar_subquery()
+    reserved_by_others = func.coalesce(reserved_total, 0) - func.coalesce(reserved_own, 0)
+
+    updated = db.session.execute(
+        update(parts)
+        .where(parts.c.id.in_(bom_part_ids))
+        .where(func.coalesce(parts.c.quantity, 0) - reserved_by_others >= required_for_part)
+        .values(quantity=func.coalesce(parts.c.quantity, 0) - required_for_part)
+    ).rowcount
+
+    if updated != entry_count:
+        db.session.rollback()
+        available = device_available_quantity()
+        shortages = db.session.execute(
+            join_device_reservations(
+                select(
+                    SMDPart.id, SMDPart.part_number, SMDPart.digikey_number,
+                    required, available
+                ).join(
+                    SMDPart, FlatBOMEntry.smd_part_id == SMDPart.id
+                ),
+                FlatBOMEntry.hardware_device_id
+            ).where(
+                FlatBOMEntry.hardware_device_id == device_id,
+                available < required
+            ).order_by(SMDPart.id)
+        ).all()
+        db.session.rollback()
+        return False, [
+            {
+                'part_id': part_id,
+                'part_number': part_number,
+                'digikey_number': digikey_number,
+                'required': needed,
+                'available': available,
+                'missing': needed - available
+            }
+            for part_id, part_number, digikey_number, needed, available in shortages
+        ]
+
+    # The built units no longer need their reservations
+    consume_reservations(device_id, units)
+
+    # Log the consumption of every part in the ledger with one INSERT ... SELECT
+    db.session.execute(
+        StockMovement.__table__.insert().from_select(
+            ['smd_part_id', 'delta', 'quantity_after', 'reason', 'reference', 'created_at'],
+            select(
+                FlatBOMEntry.smd_part_id,
+                -required,
+                SMDPart.quantity,
+                literal('build'),
+                literal(f"device:{device_id} units:{units}"),
+                literal(utcnow())
+            ).join(
+                SMDPart, FlatBOMEntry.smd_part_id == SMDPart.id
+            ).where(FlatBOMEntry.hardware_device_id == device_id)
+        )
+    )
+    mark_devices_changed([device_id])
+    db.session.commit()
+
+    logger.info(f"Built {units} units of device {device_id}, consumed {updated} parts")
+    return True, updated
+
+def record_stock_movements(changes, reason, reference=None):
+    """Appends entries to the stock movement ledger
+
+    Must be called in the transaction that changes the quantities.
+
+    Args:
+        changes (iterable): (part_id, delta, quantity_after) tuples, zero deltas are skipped
+        reason (str): e.g. 'adjustment', 'delta', 'initial'
+        reference (str): Optional reference (order, device, ...)
+    """
+    now = utcnow()
+    rows = [
+        {
+            'smd_part_id': part_id,
+            'delta': delta,
+            'quantity_after': quantity_after,
+            'reason': reason,
+            'reference': reference[:100] if reference else None,
+            'created_at': now
+        }
+        for part_id, delta, quantity_after in changes if delta
+    ]
+    if rows:
+        db.session.execute(StockMovement.__table__.insert(), rows)
+        mark_parts_changed(row['smd_part_id'] for row in rows)
+
+def latest_snapshots(watermark, part_ids=None):
+    """Subquery with the latest snapshot of each part up to a watermark"""
+    latest = select(
+        StockSnapshot.smd_part_id.label('part_id'),
+        func.max(StockSnapshot.last_movement_id).label('last_movement_id')
+    ).where(StockSnapshot.last_movement_id <= watermark)
+
+    if part_ids is not None:
+        latest = latest.where(StockSnapshot.smd_part_id.in_(part_ids))
+
+    latest = latest.group_by(StockSnapshot.smd_part_id).subquery()
+
+    return select(
+        StockSnapshot.smd_part_id.label('part_id'),
+        StockSnapshot.quantity.label('quantity'),
+        StockSnapshot.total_in.label('total_in'),
+        StockSnapshot.total_out.label('total_out')
+    ).join(latest, and_(
+        StockSnapshot.smd_part_id == latest.c.part_id,
+        StockSnapshot.last_movement_id == latest.c.last_movement_id
+    )).subquery()
+
+def take_stock_snapshot():
+    """Writes a snapshot for every part with ledger entries since the last snapshot
+
+    All snapshots of one run share the same watermark (the highest movement ID
+    at that time), so later queries only need to read movements after it.
+
+    Returns:
+        int: Number of snapshot rows written
+    """
+    if db.engine.dialect.name == 'postgresql':
+        # Wait for running writers, so no movement below the watermark is still uncommitted
+        db.session.execute(text('LOCK TABLE stock_movement IN SHARE MODE'))
+
+    watermark = db.session.execute(select(func.max(StockMovement.id))).scalar()
+    previous = db.session.execute(select(func.max(StockSnapshot.last_movement_id))).scalar() or 0
+
+    if not watermark or watermark <= previous:
+        db.session.rollback()
+        return 0
+
+    movements = select(
+        StockMovement.smd_part_id.label('part_id'),
+        func.sum(case((StockMovement.delta > 0, StockMovement.delta), else_=0)).label('total_in'),
+        func.sum(case((StockMovement.delta < 0, -StockMovement.delta), else_=0)).label('total_out'),
+        func.max(StockMovement.id).label('last_id')
+    ).where(
+        StockMovement.id > previous,
+        StockMovement.id <= watermark
+    ).group_by(StockMovement.smd_part_id).subquery()
+
+    previous_snapshots = latest_snapshots(previous)
+    quantity_after = select(StockMovement.quantity_after)\
+        .where(StockMovement.id == movements.c.last_id)\
+        .scalar_subquery()
+
+    result = db.session.execute(
+        StockSnapshot.__table__.insert().from_select(
+            ['smd_part_id', 'last_movement_id', 'taken_at', 'quantity', 'total_in', 'total_out'],
+            select(
+                movements.c.part_id,
+                literal(watermark),
+                literal(utcnow()),
+                quantity_after,
+                func.coalesce(previous_snapshots.c.total_in, 0) + movements.c.total_in,
+                func.coalesce(previous_snapshots.c.total_out, 0) + movements.c.total_out
+            ).outerjoin(previous_snapshots, previous_snapshots.c.part_id == movements.c.part_id)
+        )
+    )
+    db.session.commit()
+
+    logger.info(f"Stock snapshot written up to movement {watermark} ({result.rowcount} parts)")
+    return result.rowcount
+
+def cumulative_totals(as_of, part_ids=None):
+    """Total stock received and consumed per part up to a point in time
+
+    Starts at the latest snapshot run before ``as_of`` and only adds the ledger
+    entries between its watermark and the next run.
+
+    Returns:
+        dict: part_id -> {'total_in', 'total_out'}
+    """
+    watermark = db.session.execute(
+        select(func.max(StockSnapshot.last_movement_id)).where(StockSnapshot.taken_at <= as_of)
+    ).scalar() or 0
+    next_watermark = db.session.execute(
+        select(func.min(StockSnapshot.last_movement_id)).where(StockSnapshot.last_movement_id > watermark)
+    ).scalar()
+
+    totals = {}
+    if watermark:
+        snapshots = latest_snapshots(watermark, part_ids)
+        for part_id, _, total_in, total_out in db.session.execute(select(snapshots)).all():
+            totals[part_id] = {'total_in': total_in, 'total_out': total_out}
+
+    tail = select(
+        StockMovement.smd_part_id,
+        func.sum(case((StockMovement.delta > 0, StockMovement.delta), else_=0)),
+        func.sum(case((StockMovement.delta < 0, -StockMovement.delta), else_=0))
+    ).where(
+        StockMovement.id > watermark,
+        StockMovement.created_at <= as_of
+    )
+    # Everything before as_of is covered by the next run, which bounds the scan
+    if next_watermark:
+        tail = tail.where(StockMovement.id <= next_watermark)
+    if part_ids is not None:
+        tail = tail.where(StockMovement.smd_part_id.in_(part_ids))
+
+    for part_id, total_in, total_out in db.session.execute(tail.group_by(StockMovement.smd_part_id)).all():
+        entry = totals.setdefault(part_id, {'total_in': 0, 'total_out': 0})
+        entry['total_in'] += total_in or 0
+        entry['total_out'] += total_out or 0
+
+    return totals
+
+def get_consumption(days=30, part_ids=None):
+    """Received and consumed quantities per part within the last days
+
+    Returns:
+        dict: part_id -> {'received', 'consumed', 'consumption_per_day'}
+    """
+    until = utcnow()
+    since = until - timedelta(days=days)
+
+    end_totals = cumulative_totals(until, part_ids)
+    start_totals = cumulative_totals(since, part_ids)
+
+    consumption = {}
+    for part_id, end in end_totals.items():
+        start = start_totals.get(part_id, {'total_in': 0, 'total_out': 0})
+        consumed = end['total_out'] - start['total_out']
+        consumption[part_id] = {
+            'received': end['total_in'] - start['total_in'],
+            'consumed': consumed,
+            'consumption_per_day': round(consumed / days, 2) if days else None
+        }
+
+    return consumption
+
+def get_part_history(part_id, limit=50):
+    """Latest snapshot and the most recent ledger entries of a part"""
+    snapshot = StockSnapshot.query.filter_by(smd_part_id=part_id)\
+        .order_by(StockSnapshot.last_movement_id.desc())\
+        .first()
+    movements = StockMovement.query.filter_by(smd_part_id=part_id)\
+        .order_by(StockMovement.id.desc())\
+        .limit(limit)\
+        .all()
+
+    return {
+        'snapshot': snapshot.to_dict() if snapshot else None,
+        'movements': [movement.to_dict() for movement in movements]
+    }
+
+_snapshot_thread = None
+_snapshot_thread_lock = threading.Lock()
+
+def start_snapshot_scheduler(app, interval=None):
+    """Starts a daemon thread that takes ledger snapshots periodically (once per process)"""
+    global _snapshot_thread
+
+    interval = STOCK_SNAPSHOT_INTERVAL if interval is None else interval
+    if interval <= 0:
+        return
+
+    with _snapshot_thread_lock:
+        if _snapshot_thread is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                with app.app_context():
+                    try:
+                        take_stock_snapshot()
+                    except Exception as e:
+                        db.session.rollback()
+                        logger.error(f"Stock snapshot error: {str(e)}")
+
+        _snapshot_thread = threading.Thread(target=run, name='stock-snapshots', daemon=True)
+        _snapshot_thread.start()
@@ -0,0 +1,60 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The app reads its configuration on import, so it points to a scratch database
+os.environ['DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='smd_tests_'), 'test.db')}"
+os.environ.setdefault('CHANGE_FEED_REDIS', 'False')
+
+from app import app as flask_app
+from models import db, SMDPart, HardwareDevice, BOMEntry
+
+@pytest.fixture
+def app():
+    """The app in testing mode (strict query budgets) with an empty database"""
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def make_inventory(app):
+    """Creates parts and devices from {name: stock} and {device: {part: quantity}}
+
+    Returns:
+        tuple: (part name -> ID, device name -> ID)
+    """
+    def make(parts, boms):
+        with app.app_context():
+            part_objects = {
+                name: SMDPart(part_number=name, description=f'{name} description', digikey_number=f'{name}-ND', quantity=stock)
+                for name, stock in parts.items()
+            }
+            device_objects = {name: HardwareDevice(name=name) for name in boms}
+            db.session.add_all([*part_objects.values(), *device_objects.values()])
+            db.session.flush()
+            for device, entries in boms.items():
+                for part, quantity in entries.items():
+                    db.session.add(BOMEntry(
+                        smd_part_id=part_objects[part].id,
+                        hardware_device_id=device_objects[device].id,
+                        quantity_required=quantity
+                    ))
+            db.session.commit()
+            return (
+                {name: part.id for name, part in part_objects.items()},
+                {name: device.id for name, device in device_objects.items()}
+            )
+    return make
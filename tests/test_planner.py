@@ -0,0 +1,55 @@
+"""Production planning (POST /api/plan): demand, shortages, feasible mix and bottlenecks"""
+import pytest
+
+def plan(client, targets, strategy='priority'):
+    response = client.post('/api/plan', json={'targets': targets, 'strategy': strategy})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response.get_json()
+
+def planned_units(result):
+    return {device['device_id']: device['planned'] for device in result['devices']}
+
+def test_feasible_plan_builds_every_target(client, make_inventory):
+    parts, devices = make_inventory({'R1': 100, 'C1': 100}, {'A': {'R1': 2, 'C1': 1}, 'B': {'R1': 1}})
+
+    result = plan(client, [{'device_id': devices['A'], 'quantity': 10}, {'device_id': devices['B'], 'quantity': 20}])
+
+    assert result['feasible'] is True
+    assert result['shortages'] == []
+    assert planned_units(result) == {devices['A']: 10, devices['B']: 20}
+
+def test_shortages_sum_the_demand_of_all_targets(client, make_inventory):
+    parts, devices = make_inventory({'R1': 5, 'C1': 100}, {'A': {'R1': 2, 'C1': 1}, 'B': {'R1': 1}})
+
+    result = plan(client, [{'device_id': devices['A'], 'quantity': 3}, {'device_id': devices['B'], 'quantity': 4}])
+
+    assert result['feasible'] is False
+    assert [(s['part_id'], s['required'], s['available'], s['missing']) for s in result['shortages']] == [
+        (parts['R1'], 10, 5, 5)
+    ]
+
+@pytest.mark.parametrize('strategy, expected', [
+    # B (higher priority) takes 5 of the 10 units, A gets the rest
+    ('priority', {'A': 2, 'B': 5}),
+    # Common share 10/13 of both targets (3 and 3 units), the last unit of stock goes to B
+    ('proportional', {'A': 3, 'B': 4})
+])
+def test_feasible_mix(client, make_inventory, strategy, expected):
+    parts, devices = make_inventory({'P1': 10}, {'A': {'P1': 2}, 'B': {'P1': 1}})
+
+    result = plan(client, [
+        {'device_id': devices['A'], 'quantity': 4, 'priority': 1},
+        {'device_id': devices['B'], 'quantity': 5, 'priority': 2}
+    ], strategy)
+
+    assert planned_units(result) == {devices[name]: units for name, units in expected.items()}
+
+def test_bottlenecks_ordered_by_blocked_devices(client, make_inventory):
+    # R1 is missing for both devices, U1 misses more units but only blocks A
+    parts, devices = make_inventory({'R1': 1, 'U1': 0}, {'A': {'R1': 1, 'U1': 10}, 'B': {'R1': 1}})
+
+    result = plan(client, [{'device_id': devices['A'], 'quantity': 2}, {'device_id': devices['B'], 'quantity': 2}])
+
+    blocked = {s['part_id']: s['devices_blocked'] for s in result['shortages']}
+    assert blocked == {parts['R1']: 2, parts['U1']: 1}
+    assert result['bottlenecks'] == [parts['R1'], parts['U1']]
@@ -0,0 +1,60 @@
+"""Every route with a query budget is requested against small and large synthetic
+inventories in testing mode, where an exceeded budget raises QueryBudgetExceeded.
+The same budget must hold for both sizes, so per-row queries fail here.
+"""
+import pytest
+
+from benchmarks.synthetic import generate_inventory
+from query_budget import ROUTE_QUERY_BUDGETS, get_query_budget
+
+SIZES = {
+    'small': {'parts': 100, 'devices': 4, 'bom_size': 30},
+    'large': {'parts': 1500, 'devices': 20, 'bom_size': 120}
+}
+
+def request_route(client, endpoint, parts, devices):
+    """Sends a typical request to the route of an endpoint"""
+    part, device, other = parts[0], devices[0], devices[1]
+    json_headers = {'Accept': 'application/json'}
+    requests = {
+        'index': lambda: client.get('/'),
+        'missing_parts': lambda: client.get(f'/missing_parts/{device}'),
+        'flat_bom': lambda: client.get(f'/devices/{device}/flat_bom'),
+        'api_reservations': lambda: client.get('/api/reservations'),
+        'api_bom_usage': lambda: client.post('/api/bom/usage', json=[
+            {'part_id': part_id, 'device_id': device, 'qty_required': 2} for part_id in parts[:50]
+        ]),
+        'api_plan': lambda: client.post('/api/plan', json={
+            'targets': [{'device_id': device_id, 'quantity': 5} for device_id in devices]
+        }),
+        'update_stock': lambda: client.post('/update_stock', data={'part_id': part, 'quantity': 1000}, headers=json_headers),
+        'update_part_usage': lambda: client.post('/update_part_usage', data={
+            'part_id': part, 'device_id': device, 'qty_required': 3
+        }, headers=json_headers),
+        'build_device_units': lambda: client.post(f'/devices/{device}/build', json={'units': 1}, headers=json_headers),
+        'reserve_device_units': lambda: client.post(f'/devices/{device}/reserve', json={'units': 1}, headers=json_headers),
+        'release_device_units': lambda: client.post(f'/devices/{device}/release', json={}, headers=json_headers),
+        'api_bulk_delete_parts': lambda: client.post('/api/parts/bulk_delete', json={'part_ids': parts[:20]}),
+        'api_bulk_delete_devices': lambda: client.post('/api/devices/bulk_delete', json={'device_ids': [other]}),
+        'api_bom_reassign': lambda: client.post('/api/bom/reassign', json={'from_device_id': other, 'to_device_id': device})
+    }
+    return requests[endpoint]()
+
+def test_every_budget_is_covered():
+    covered = {'index', 'missing_parts', 'flat_bom', 'api_reservations', 'api_bom_usage', 'api_plan',
+               'update_stock', 'update_part_usage', 'build_device_units', 'reserve_device_units',
+               'release_device_units', 'api_bulk_delete_parts', 'api_bulk_delete_devices', 'api_bom_reassign'}
+    assert set(ROUTE_QUERY_BUDGETS) == covered
+
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('endpoint', sorted(ROUTE_QUERY_BUDGETS))
+def test_route_within_query_budget(app, client, endpoint, size):
+    with app.app_context():
+        inventory = generate_inventory(**SIZES[size])
+
+    # Raises QueryBudgetExceeded in testing mode if the budget is exceeded
+    response = request_route(client, endpoint, inventory['part_ids'], inventory['device_ids'])
+
+    assert response.status_code < 500, response.get_data(as_text=True)[:500]
+    assert response.headers.get('X-SQL-Query-Count') is not None
+    assert int(response.headers['X-SQL-Query-Count']) <= get_query_budget(endpoint)
@@ -0,0 +1,42 @@
+"""Shopping list aggregation over the flattened BOMs (POST /api/shopping-list)"""
+
+def test_zero_quantity_targets_need_nothing(client, make_inventory):
+    parts, devices = make_inventory({'R1': 0}, {'Board': {'R1': 2}})
+
+    response = client.post('/api/shopping-list', json=[{'device_id': devices['Board'], 'quantity': 0}])
+
+    assert response.status_code == 200
+    assert response.get_json()['items'] == []
+    assert response.get_json()['totals'] == {'parts': 0, 'missing_units': 0}
+
+def shopping_list(client, targets):
+    response = client.post('/api/shopping-list', json=targets)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return {item['digikey_number']: item for item in response.get_json()['items']}, response.get_json()['items']
+
+def test_requirements_are_summed_across_devices(client, make_inventory):
+    parts, devices = make_inventory({'R1': 10, 'C1': 1}, {'A': {'R1': 2, 'C1': 1}, 'B': {'R1': 3}})
+
+    items, rows = shopping_list(client, [{'device_id': devices['A'], 'quantity': 3}, {'device_id': devices['B'], 'quantity': 2}])
+
+    # One row per DigiKey number, even though R1 is used by both devices (equal shortages by part ID)
+    assert [row['digikey_number'] for row in rows] == ['R1-ND', 'C1-ND']
+    assert (items['R1-ND']['devices'], items['R1-ND']['required'], items['R1-ND']['available'], items['R1-ND']['missing']) == (2, 12, 10, 2)
+    assert (items['C1-ND']['devices'], items['C1-ND']['required'], items['C1-ND']['missing']) == (1, 3, 2)
+
+def test_build_multipliers_are_applied(client, make_inventory):
+    parts, devices = make_inventory({'R1': 10}, {'A': {'R1': 2}})
+
+    assert shopping_list(client, [{'device_id': devices['A'], 'quantity': 5}])[0] == {}
+    items, _ = shopping_list(client, [{'device_id': devices['A'], 'quantity': 6}])
+    assert (items['R1-ND']['required'], items['R1-ND']['missing']) == (12, 2)
+
+def test_own_reservations_count_as_available(client, make_inventory):
+    parts, devices = make_inventory({'R1': 10}, {'A': {'R1': 2}, 'B': {'R1': 3}})
+    response = client.post(f"/devices/{devices['A']}/reserve", json={'units': 2}, headers={'Accept': 'application/json'})
+    assert response.status_code == 200
+
+    # A may use the 4 units reserved for it, B only the 6 unreserved ones
+    assert shopping_list(client, [{'device_id': devices['A'], 'quantity': 4}])[0] == {}
+    items, _ = shopping_list(client, [{'device_id': devices['B'], 'quantity': 3}])
+    assert (items['R1-ND']['required'], items['R1-ND']['available'], items['R1-ND']['missing']) == (9, 6, 3)
@@ -0,0 +1,30 @@
+"""Batched stock changes (POST /api/stock/deltas)"""
+import pytest
+
+from stock import parse_stock_deltas
+
+@pytest.mark.parametrize('delta', [2.7, True, False, '5', None])
+def test_delta_must_be_an_integer(delta):
+    is_valid, errors = parse_stock_deltas([{'part_id': 1, 'delta': delta}])
+
+    assert is_valid is False
+    assert errors == [{'index': 0, 'error': 'Invalid delta'}]
+
+def test_integer_deltas_are_applied(client, make_inventory):
+    parts, devices = make_inventory({'R1': 10, 'C1': 5}, {})
+
+    response = client.post('/api/stock/deltas', json=[
+        {'part_id': parts['R1'], 'delta': -3},
+        {'digikey_number': 'C1-ND', 'delta': 7}
+    ])
+
+    assert response.status_code == 200
+    assert {part['part_id']: part['quantity'] for part in response.get_json()['parts']} == {parts['R1']: 7, parts['C1']: 12}
+
+def test_float_delta_changes_nothing(client, make_inventory):
+    parts, devices = make_inventory({'R1': 10}, {})
+
+    response = client.post('/api/stock/deltas', json=[{'part_id': parts['R1'], 'delta': 2.7}])
+
+    assert response.status_code == 400
+    assert response.get_json()['errors'] == [{'index': 0, 'error': 'Invalid delta'}]
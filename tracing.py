@@ -0,0 +1,387 @@
+"""Lightweight request tracing with nested spans
+
+Each request gets a trace ID (taken from an incoming W3C ``traceparent`` header
+if present) and a root span. Functions decorated with @traced, SQL statements
+and DigiKey API calls (rate limiter waits, token requests, HTTP calls) become
+child spans of the span active in the current thread. Background threads
+started with propagate() continue the trace of the request that started them.
+
+Finished spans are exported in batches from a background thread:
+
+- TRACING_EXPORTER=file: one JSON object per span and line (TRACE_FILE)
+- TRACING_EXPORTER=otlp: OTLP/HTTP JSON to a collector (TRACE_OTLP_ENDPOINT,
+  e.g. http://localhost:4318/v1/traces of an OpenTelemetry collector or Jaeger)
+
+With TRACING_ENABLED=False (default) no hooks are installed and @traced
+functions only pay for one flag check.
+"""
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from query_budget import normalize_statement
+
+# Configure Logging
+logger = logging.getLogger('tracing')
+
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'False').lower() == 'true'
+# 'file' or 'otlp'
+TRACING_EXPORTER = os.environ.get('TRACING_EXPORTER', 'file')
+TRACE_FILE = os.environ.get('TRACE_FILE', 'traces.jsonl')
+# The trace file is renamed to <file>.1 when it grows beyond this size
+TRACE_FILE_MAX_BYTES = int(os.environ.get('TRACE_FILE_MAX_BYTES', 50 * 1024 * 1024))
+TRACE_OTLP_ENDPOINT = os.environ.get('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+TRACE_SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', 'smd-manager')
+
+# Finished spans waiting for export, further spans are dropped
+MAX_QUEUED_SPANS = 10000
+# Spans per export batch and maximum delay of a batch
+EXPORT_BATCH_SIZE = 512
+EXPORT_INTERVAL = 2.0
+# Longer SQL statements are truncated in the span attributes
+MAX_STATEMENT_LENGTH = 1000
+
+# OTLP span kinds
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+TRACEPARENT_PATTERN = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+class Span:
+    """One timed operation of a trace"""
+
+    def __init__(self, name, trace_id, parent_id=None, kind=KIND_INTERNAL, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, error=None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        exporter.submit(self)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'kind': self.kind,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'attributes': self.attributes,
+            'error': self.error
+        }
+
+def current_span():
+    """Span active in the current thread, None outside of a trace"""
+    return _current_span.get()
+
+def current_trace_id():
+    span = _current_span.get()
+    return span.trace_id if span is not None else None
+
+def set_span_attribute(key, value):
+    """Sets an attribute of the active span, if any"""
+    span = _current_span.get()
+    if span is not None:
+        span.set_attribute(key, value)
+
+def start_span(name, kind=KIND_INTERNAL, attributes=None, trace_id=None, parent_id=None):
+    """Starts a span as child of the active span (or a new trace) without activating it"""
+    parent = _current_span.get()
+    if trace_id is None:
+        if parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            trace_id = secrets.token_hex(16)
+    return Span(name, trace_id, parent_id, kind, attributes)
+
+class span:
+    """Context manager running the enclosed block in a child span of the active span
+
+    Without an active trace (e.g. in CLI commands) or with tracing disabled,
+    no span is created.
+    """
+
+    def __init__(self, name, kind=KIND_INTERNAL, **attributes):
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.span = None
+        self.token = None
+
+    def __enter__(self):
+        if TRACING_ENABLED and _current_span.get() is not None:
+            self.span = start_span(self.name, self.kind, self.attributes)
+            self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self.span is not None:
+            _current_span.reset(self.token)
+            self.span.end(exc)
+        return False
+
+def traced(name=None, kind=KIND_INTERNAL):
+    """Decorator running the function in a child span (named after the function by default)"""
+    def decorator(function):
+        span_name = name or f"{function.__module__}.{function.__qualname__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not TRACING_ENABLED or _current_span.get() is None:
+                return function(*args, **kwargs)
+            with span(span_name, kind):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def propagate(function, name=None):
+    """Wraps a thread target so it continues the trace of the calling thread
+
+    Only the span is carried over, not the Flask request context of the caller.
+    """
+    parent = _current_span.get()
+    if not TRACING_ENABLED or parent is None:
+        return function
+    span_name = name or f"{function.__module__}.{function.__qualname__}"
+
+    @functools.wraps(function)
+    def run(*args, **kwargs):
+        token = _current_span.set(parent)
+        try:
+            with span(span_name, thread=threading.current_thread().name):
+                return function(*args, **kwargs)
+        finally:
+            _current_span.reset(token)
+    return run
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+def otlp_payload(spans):
+    """OTLP/HTTP JSON request body for a batch of spans"""
+    return {
+        'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': TRACE_SERVICE_NAME}}]},
+            'scopeSpans': [{
+                'scope': {'name': 'smd-manager.tracing'},
+                'spans': [
+                    {
+                        'traceId': item.trace_id,
+                        'spanId': item.span_id,
+                        **({'parentSpanId': item.parent_id} if item.parent_id else {}),
+                        'name': item.name,
+                        'kind': item.kind,
+                        'startTimeUnixNano': str(item.start_ns),
+                        'endTimeUnixNano': str(item.end_ns),
+                        'attributes': [{'key': key, 'value': otlp_value(value)} for key, value in item.attributes.items()],
+                        'status': {'code': 2, 'message': item.error} if item.error else {'code': 1}
+                    }
+                    for item in spans
+                ]
+            }]
+        }]
+    }
+
+class SpanExporter:
+    """Exports finished spans in batches from a background thread"""
+
+    def __init__(self):
+        self.spans = queue.Queue(maxsize=MAX_QUEUED_SPANS)
+        self.dropped = 0
+        self.thread = None
+        self.lock = threading.Lock()
+        self.file_path = TRACE_FILE
+
+    def submit(self, finished):
+        try:
+            self.spans.put_nowait(finished)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.run, name='trace-exporter', daemon=True)
+                    self.thread.start()
+                    atexit.register(self.flush)
+
+    def take_batch(self, timeout):
+        batch = []
+        try:
+            batch.append(self.spans.get(timeout=timeout))
+            while len(batch) < EXPORT_BATCH_SIZE:
+                batch.append(self.spans.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.take_batch(EXPORT_INTERVAL)
+            if batch:
+                self.export(batch)
+
+    def flush(self):
+        """Exports all queued spans (at exit)"""
+        while True:
+            batch = self.take_batch(0)
+            if not batch:
+                return
+            self.export(batch)
+
+    def export(self, batch):
+        try:
+            if TRACING_EXPORTER == 'otlp':
+                self.export_otlp(batch)
+            else:
+                self.export_file(batch)
+        except Exception as e:
+            logger.warning(f"Error exporting {len(batch)} spans: {str(e)}")
+        if self.dropped:
+            logger.warning(f"{self.dropped} spans dropped, the export queue was full")
+            self.dropped = 0
+
+    def export_file(self, batch):
+        with self.lock:
+            try:
+                if os.path.getsize(self.file_path) > TRACE_FILE_MAX_BYTES:
+                    os.replace(self.file_path, f"{self.file_path}.1")
+            except OSError:
+                pass
+            with open(self.file_path, 'a', encoding='utf-8') as trace_file:
+                for finished in batch:
+                    trace_file.write(json.dumps(finished.to_dict(), separators=(',', ':')) + '\n')
+
+    def export_otlp(self, batch):
+        import urllib.request
+        body = json.dumps(otlp_payload(batch)).encode('utf-8')
+        export_request = urllib.request.Request(
+            TRACE_OTLP_ENDPOINT, data=body, method='POST', headers={'Content-Type': 'application/json'}
+        )
+        with urllib.request.urlopen(export_request, timeout=5) as response:
+            response.read()
+
+exporter = SpanExporter()
+
+class TraceLogRecordFactory:
+    """Adds the trace ID of the active span to every log record (%(trace_id)s)"""
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def __call__(self, *args, **kwargs):
+        record = self.factory(*args, **kwargs)
+        record.trace_id = current_trace_id() or '-'
+        return record
+
+def init_tracing(app):
+    """Registers the request spans, the SQL spans and the trace ID in the log output
+
+    Must be called before the other request hooks are registered, so the root
+    span covers them.
+    """
+    if not TRACING_ENABLED:
+        return
+
+    if TRACING_EXPORTER == 'file' and not os.path.isabs(TRACE_FILE):
+        os.makedirs(app.instance_path, exist_ok=True)
+        exporter.file_path = os.path.join(app.instance_path, TRACE_FILE)
+
+    logging.setLogRecordFactory(TraceLogRecordFactory(logging.getLogRecordFactory()))
+    for handler in logging.getLogger().handlers:
+        if handler.formatter is not None and '%(trace_id)s' not in handler.formatter._fmt:
+            handler.setFormatter(logging.Formatter(
+                handler.formatter._fmt.replace('%(message)s', '[%(trace_id)s] %(message)s')
+            ))
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def start_statement_span(conn, cursor, statement, parameters, context, executemany):
+        if _current_span.get() is not None:
+            conn.info.setdefault('trace_spans', []).append(start_span('db.query', attributes={
+                'db.system': conn.dialect.name,
+                'db.statement': normalize_statement(statement)[:MAX_STATEMENT_LENGTH]
+            }))
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def end_statement_span(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get('trace_spans')
+        if spans:
+            statement_span = spans.pop()
+            if cursor.rowcount is not None and cursor.rowcount >= 0:
+                statement_span.set_attribute('db.rows', cursor.rowcount)
+            statement_span.end()
+
+    @event.listens_for(Engine, 'handle_error')
+    def fail_statement_span(exception_context):
+        connection = exception_context.connection
+        spans = connection.info.get('trace_spans') if connection is not None else None
+        if spans:
+            spans.pop().end(exception_context.original_exception)
+
+    @app.before_request
+    def start_request_span():
+        trace_id = parent_id = None
+        match = TRACEPARENT_PATTERN.match(request.headers.get('traceparent', ''))
+        if match:
+            trace_id, parent_id = match.groups()
+        root = start_span(
+            f"{request.method} {request.url_rule.rule if request.url_rule else request.path}",
+            KIND_SERVER,
+            {'http.method': request.method, 'http.target': request.full_path.rstrip('?'), 'http.route': request.endpoint or ''},
+            trace_id, parent_id
+        )
+        g.trace_span = root
+        g.trace_token = _current_span.set(root)
+
+    @app.after_request
+    def add_trace_headers(response):
+        root = g.get('trace_span')
+        if root is not None:
+            root.set_attribute('http.status_code', response.status_code)
+            response.headers['X-Trace-Id'] = root.trace_id
+            response.headers['traceparent'] = f"00-{root.trace_id}-{root.span_id}-01"
+        return response
+
+    @app.teardown_request
+    def end_request_span(exception=None):
+        root = g.pop('trace_span', None)
+        if root is None:
+            return
+        _current_span.reset(g.pop('trace_token'))
+        root.end(exception)
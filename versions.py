@@ -0,0 +1,145 @@
+import logging
+from sqlalchemy import select, event
+
+from models import db, DataVersion, SMDPart, HardwareDevice, RoutingSession, utcnow
+# Imported from bom, so the flattened BOMs are refreshed before the versions are bumped
+from bom import dialect_insert
+
+# Configure Logging
+logger = logging.getLogger('versions')
+
+GLOBAL_SCOPE = 'global'
+PARTS_SCOPE = 'parts'
+DEVICE_SCOPE_PREFIX = 'device:'
+
+# Writes to these tables change the part data (stock, catalog, reservations)
+PART_TABLES = {'smd_part', 'reservation', 'reserved_stock'}
+
+# Writes to these tables do not change any visible data
+IGNORED_TABLES = {'data_version', 'stock_snapshot'}
+
+# Callbacks notified with the changed scopes and parts after every commit
+_listeners = []
+
+def device_scope(device_id):
+    """Version scope of a single device"""
+    return f"{DEVICE_SCOPE_PREFIX}{device_id}"
+
+def scope_device_ids(scopes):
+    """IDs of the devices among version scopes"""
+    return {int(scope[len(DEVICE_SCOPE_PREFIX):]) for scope in scopes if scope.startswith(DEVICE_SCOPE_PREFIX)}
+
+def get_versions(scopes):
+    """Returns {scope: (version, updated_at)} with one primary key lookup
+
+    Unknown scopes have never changed and are reported as (0, None).
+    """
+    rows = db.session.execute(
+        select(DataVersion.scope, DataVersion.version, DataVersion.updated_at)
+        .where(DataVersion.scope.in_(scopes))
+    ).all()
+
+    versions = {scope: (0, None) for scope in scopes}
+    versions.update({scope: (version, updated_at) for scope, version, updated_at in rows})
+    return versions
+
+def on_data_change(callback):
+    """Registers a callback(scopes, part_ids) that is called after each commit
+
+    part_ids are the parts changed through the unit of work or marked with
+    mark_parts_changed(); bulk statements without a mark only show in the scopes.
+    """
+    _listeners.append(callback)
+    return callback
+
+def mark_parts_changed(part_ids):
+    """Reports parts changed by bulk statements to the data change callbacks"""
+    db.session.info.setdefault('changed_parts', set()).update(part_ids)
+
+def mark_devices_changed(device_ids):
+    """Bumps the version scopes of devices changed by bulk statements"""
+    db.session.info.setdefault('changed_devices', set()).update(device_ids)
+
+def _written_tables(session):
+    return session.info.setdefault('written_tables', set())
+
+@event.listens_for(RoutingSession, 'after_flush')
+def collect_flushed_changes(session, flush_context):
+    """Collects the tables, devices and parts changed through the unit of work"""
+    tables = _written_tables(session)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, '__tablename__', None)
+        if table:
+            tables.add(table)
+        if isinstance(obj, HardwareDevice) and obj.id is not None:
+            session.info.setdefault('changed_devices', set()).add(obj.id)
+        part_id = obj.id if isinstance(obj, SMDPart) else getattr(obj, 'smd_part_id', None)
+        if part_id is not None:
+            session.info.setdefault('changed_parts', set()).add(part_id)
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def collect_statement_changes(orm_execute_state):
+    """Collects the tables changed by bulk INSERT, UPDATE and DELETE statements"""
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None:
+            _written_tables(orm_execute_state.session).add(table.name)
+
+@event.listens_for(RoutingSession, 'before_commit')
+def bump_data_versions(session):
+    """Increments the versions of all scopes changed in this transaction
+
+    The counters are written in the same transaction as the data, so a version
+    is never visible before the data it describes.
+    """
+    if session.info.get('read_only'):
+        return
+
+    session.flush()
+    tables = _written_tables(session) - IGNORED_TABLES
+    devices = session.info.pop('changed_devices', set())
+    parts = session.info.pop('changed_parts', set())
+    session.info.pop('written_tables', None)
+
+    if not tables and not devices and not parts:
+        return
+
+    scopes = {GLOBAL_SCOPE}
+    if parts or tables & PART_TABLES:
+        scopes.add(PARTS_SCOPE)
+    scopes.update(device_scope(device_id) for device_id in devices)
+
+    now = utcnow()
+    stmt = dialect_insert(DataVersion).values([
+        {'scope': scope, 'version': 1, 'updated_at': now} for scope in sorted(scopes)
+    ])
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=[DataVersion.scope],
+        set_={'version': DataVersion.__table__.c.version + 1, 'updated_at': stmt.excluded.updated_at}
+    ))
+
+    # Published after the commit succeeded
+    session.info['bumped_scopes'] = scopes
+    session.info['bumped_parts'] = parts
+
+@event.listens_for(RoutingSession, 'after_commit')
+def publish_data_versions(session):
+    """Notifies the registered callbacks about the committed changes"""
+    # The version upsert itself was collected as well
+    session.info.pop('written_tables', None)
+    scopes = session.info.pop('bumped_scopes', None)
+    parts = session.info.pop('bumped_parts', set())
+    if not scopes:
+        return
+
+    for callback in _listeners:
+        try:
+            callback(scopes, parts)
+        except Exception as e:
+            logger.error(f"Error in data change listener: {str(e)}")
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def discard_data_changes(session):
+    """Forgets the changes of a rolled back transaction"""
+    for key in ('written_tables', 'changed_devices', 'changed_parts', 'bumped_scopes', 'bumped_parts'):
+        session.info.pop(key, None)